@@ -18,6 +18,7 @@ any later version.
 """
 
 import os
+import json
 import logging
 import uuid
 import hashlib
@@ -25,7 +26,9 @@ import mimetypes
 from urllib.request import Request
 from urllib.request import urlopen
 from urllib.parse import urlparse
+from urllib.parse import urlencode
 from urllib.error import HTTPError
+import bson
 from bson.json_util import loads
 from bson.json_util import dumps
 
@@ -35,6 +38,68 @@ from bson.json_util import dumps
 #     token = fin.read().encode('utf-8')
 
 
+# Media type used with each DC System
+serverFormats = dict()
+
+
+def serverformat(host: str):
+    """Return the media type used to exchange documents with a DC System.
+
+    BSON is used if the server supports it (see its features), otherwise JSON.
+    """
+    if host not in serverFormats:
+        try:
+            features = json.loads(urlopen(Request('%s/features' % host)).read())
+            mediatypes = features.get('supportedMediaTypes', [])
+        except Exception:
+            mediatypes = []
+        serverFormats[host] = 'application/bson' if 'application/bson' in mediatypes else 'application/json'
+    return serverFormats[host]
+
+
+def encodebody(obj, mediatype: str):
+    """Serialize a document or a list of documents for the body of a request."""
+    if mediatype == 'application/bson':
+        # A list is sent as the documents one after the other
+        if isinstance(obj, list):
+            return b''.join(bson.encode(doc) for doc in obj)
+        return bson.encode(obj)
+    return dumps(obj).encode()
+
+
+def decodebody(data: bytes, mediatype: str):
+    """Read a document from the body of a response."""
+    if mediatype == 'application/bson':
+        return bson.decode(data)
+    return loads(data)
+
+
+def makerequest(url: str, mediatype: str, obj=None):
+    """Create a request which sends and accepts documents in a media type."""
+    req = Request(url, data=encodebody(obj, mediatype) if obj is not None else None)
+    req.add_header("Accept", mediatype)
+    if obj is not None:
+        req.add_header("Content-Type", mediatype)
+    return req
+
+
+def getall(url: str, mediatype: str = 'application/json'):
+    """Retrieve all the items of a list following the pagination cursors."""
+    contents = list()
+    cursor = None
+    while True:
+        query = '?%s' % urlencode({'cursor': cursor}) if cursor is not None else ''
+        u = urlopen(makerequest(url + query, mediatype))
+        page = decodebody(u.read(), mediatype)
+        if u.getcode() != 200:
+            raise Exception('Error retrieving list from %s' % url)
+
+        contents.extend(page['contents'])
+        cursor = page.get('next_cursor')
+        if cursor is None:
+            return contents
+
+
 class DigitalObject(object):
     """Representation of a digital object"""
     def __init__(self, uri: str, checksum: str = None, mimetype: str = None):
@@ -107,11 +172,12 @@ class Member(object):
             raise Exception('memberid must be valid and existing ID')
 
         # Query the member to check it has been properly created
-        req = Request('%s/collections/%s/members/%s' % (self.host, collid, memberid))
+        mediatype = serverformat(self.host)
+        req = makerequest('%s/collections/%s/members/%s' % (self.host, collid, memberid), mediatype)
         # req.add_header("Authorization", "Bearer %s" % token)
 
         u = urlopen(req)
-        memb = loads(u.read())
+        memb = decodebody(u.read(), mediatype)
         # Check that error code is 200
         if u.getcode() == 200:
             self.json = memb
@@ -122,13 +188,13 @@ class Member(object):
     def save(self, collid: str):
         # If this is a new Member
         if '_id' not in self.json:
-            req = Request('%s/collections/%s/members' %
-                          (self.host, collid), data=dumps(self.json).encode())
-            req.add_header("Content-Type", 'application/json')
+            mediatype = serverformat(self.host)
+            req = makerequest('%s/collections/%s/members' % (self.host, collid),
+                              mediatype, self.json)
             # Create a member
             try:
                 u = urlopen(req)
-                return loads(u.read())
+                return decodebody(u.read(), mediatype)
             except Exception as e:
                 return {'message': 'Error creating member'}
         else:
@@ -204,24 +270,19 @@ class Collection(object):
             raise Exception('collid must be valid and existing ID')
 
         # Request the collection
-        req = Request('%s/collections/%s' % (self.host, str(collid)))
+        mediatype = serverformat(self.host)
+        req = makerequest('%s/collections/%s' % (self.host, str(collid)), mediatype)
         # req.add_header("Authorization", "Bearer %s" % token)
 
         u = urlopen(req)
-        coll = loads(u.read())
+        coll = decodebody(u.read(), mediatype)
         # Check that error code is 200
         if u.getcode() == 200:
             self.json = coll
 
             # Retrieve also the members
-            # Query the member to check it has been properly created
-            req = Request('%s/collections/%s/members/' % (self.host, collid))
-            u = urlopen(req)
-            members = loads(u.read())
-            # Check that error code is 200
-            if u.getcode() == 200:
-                for m in members:
-                    self.addmember(Member(host=self.host, jsondesc=m))
+            for m in getall('%s/collections/%s/members' % (self.host, collid), mediatype):
+                self.addmember(Member(host=self.host, jsondesc=m))
 
             return
 
@@ -242,17 +303,29 @@ class Collection(object):
                     raise Exception('Member without location')
 
             # Create a collection
-            req = Request('%s/collections' % self.host, data=dumps(self.json).encode())
-            req.add_header("Content-Type", 'application/json')
+            mediatype = serverformat(self.host)
+            req = makerequest('%s/collections' % self.host, mediatype, self.json)
             try:
                 u = urlopen(req)
-                coll = loads(u.read())
+                coll = decodebody(u.read(), mediatype)
             except Exception as e:
                 return {'message': 'Error creating collection'}
 
-            for m in self:
-                print(coll['_id'])
-                m.save(coll['_id'])
+            # Create all members with a single request
+            members = [m.json for m in self]
+            if len(members):
+                req = makerequest('%s/collections/%s/members' % (self.host, coll['_id']),
+                                  mediatype, members)
+                try:
+                    u = urlopen(req)
+                    result = decodebody(u.read(), mediatype)
+                except Exception as e:
+                    return {'message': 'Error creating members'}
+
+                # A single member in BSON is created like in a single POST
+                for error in result.get('errors', []):
+                    logging.error('Member %d not created: %s' % (error['index'], error['message']))
+            return coll
         else:
             # Update not yet implemented!
             logging.error('Update not yet implemented!')
@@ -266,13 +339,12 @@ class DataCollectionClient(object):
 
     def createcollection(self, datafile):
         with open(datafile) as fin:
-            data = fin.read().encode('utf-8')
-            req = Request('%s/collections' % self.host, data=data)
-            req.add_header("Content-Type", 'application/json')
+            mediatype = serverformat(self.host)
+            req = makerequest('%s/collections' % self.host, mediatype, loads(fin.read()))
             # req.add_header("Authorization", "Bearer %s" % token)
             # Create a collection
             u = urlopen(req)
-            coll = json.loads(u.read())
+            coll = decodebody(u.read(), mediatype)
             # Check that I received a 201 code
 
             if u.getcode() == 201:
@@ -282,13 +354,13 @@ class DataCollectionClient(object):
 
     def createmember(self, collid, datafile):
         with open(datafile) as fin:
-            data = fin.read().encode()
-            req = Request('%s/collections/%s/members' % (self.host, collid), data=data)
-            req.add_header("Content-Type", 'application/json')
+            mediatype = serverformat(self.host)
+            req = makerequest('%s/collections/%s/members' % (self.host, collid), mediatype,
+                              loads(fin.read()))
             # req.add_header("Authorization", "Bearer %s" % token)
             # Create a member
             u = urlopen(req)
-            memb = json.loads(u.read())
+            memb = decodebody(u.read(), mediatype)
             # Check that I received a 201 code
 
             if u.getcode() == 201:
@@ -326,17 +398,18 @@ class DataCollectionClient(object):
 
     def getmember(self, collid, memberid=None):
         # Query the member to check it has been properly created
+        mediatype = serverformat(self.host)
         if memberid is not None:
-            req = Request('%s/collections/%s/members/%s' %
-                          (self.host, collid, memberid))
+            req = makerequest('%s/collections/%s/members/%s' %
+                              (self.host, collid, memberid), mediatype)
         else:
-            req = Request('%s/collections/%s/members' %
-                          (self.host, collid))
+            # Retrieve all pages of the list
+            return getall('%s/collections/%s/members' % (self.host, collid), mediatype)
 
         # req.add_header("Authorization", "Bearer %s" % token)
 
         u = urlopen(req)
-        memb = loads(u.read())
+        memb = decodebody(u.read(), mediatype)
         # Check that error code is 200
         if u.getcode() == 200:
             return memb
@@ -345,17 +418,18 @@ class DataCollectionClient(object):
 
     def getcollection(self, collid=None):
         # Query the collection to check it has been properly created
+        mediatype = serverformat(self.host)
         if collid is not None:
-            req = Request('%s/collections/%s' %
-                          (self.host, str(collid)))
+            req = makerequest('%s/collections/%s' %
+                              (self.host, str(collid)), mediatype)
         else:
-            req = Request('%s/collections' %
-                          (self.host))
+            # Retrieve all pages of the list
+            return getall('%s/collections' % self.host, mediatype)
 
         # req.add_header("Authorization", "Bearer %s" % token)
 
         u = urlopen(req)
-        coll = loads(u.read())
+        coll = decodebody(u.read(), mediatype)
         # Check that error code is 200
         if u.getcode() == 200:
             return coll
@@ -364,13 +438,14 @@ class DataCollectionClient(object):
 
     def getcollcapabilities(self, collid):
         # Query the collection capabilities
-        req = Request('%s/collections/%s/capabilities' %
-                      (self.host, collid))
+        mediatype = serverformat(self.host)
+        req = makerequest('%s/collections/%s/capabilities' %
+                          (self.host, collid), mediatype)
 
         # req.add_header("Authorization", "Bearer %s" % token)
 
         u = urlopen(req)
-        capab = json.loads(u.read())
+        capab = decodebody(u.read(), mediatype)
         # Check that error code is 200
         if u.getcode() == 200:
             return capab
@@ -26,52 +26,164 @@
 ##################################################################
 
 import cherrypy
+from cherrypy.lib import cptools
+from cherrypy.lib import static
+from cheroot import wsgi
 import os
-import json
+import sys
+import time
+import signal
+import argparse
+import functools
+import threading
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 # import gnupg
-from pymongo import MongoClient
-from bson.json_util import dumps
-from datacoll.dcmongo import Collection
-from datacoll.dcmongo import Collections
-from datacoll.dcmongo import Member
-from datacoll.dcmongo import Members
-from datacoll.dcmongo import DCEncoder
+from datacoll.dcbase import loadengine
+from datacoll.dcbase import readconfig
+from datacoll.dcbase import CollectionFull
+from datacoll.dccompress import codings
+from datacoll.dccompress import compressoptions
+from datacoll.dccompress import compressibleTypes
+from datacoll.dccompress import negotiate
+from datacoll.dccompress import compress
+from datacoll.dccompress import compressiter
+from datacoll.dccompress import codedetag
+from datacoll.dccompress import decompress
+from datacoll.dcformat import jsontype
+from datacoll.dcformat import canonicaltype
+from datacoll.dcformat import selectformat
+from datacoll.dcformat import encode
+from datacoll.dcformat import decode
+from datacoll.dcformat import pagedocument
+from datacoll.dcformat import JSONFactory
+from datacoll.dcformat import addvary
+from datacoll.dcjson import dumps
+from datacoll.dcproxy import urlFile
+from datacoll.dcproxy import canproxy
+from datacoll.dcproxy import forwarded
+from datacoll.dcproxy import downloadoptions
+from datacoll.dccache import cachekey
+from datacoll.dccache import contentcache
+from datacoll.dccache import contenttype
+from datacoll.dcarchive import archiveFormats
+from datacoll.dcarchive import ArchiveBuilder
+from datacoll.dcarchive import archivechunks
+from datacoll.dcjson import setserializer
+from datacoll.dcmodel import indexField
+from datacoll.dcmodel import isordered
+from datacoll.dcmodel import setindex
+from datacoll.dcrequest import RequestError
+from datacoll.dcrequest import archiveformat
+from datacoll.dcrequest import beforedocuments
+from datacoll.dcrequest import checkid
+from datacoll.dcrequest import checkmatch
+from datacoll.dcrequest import collcapabilities
+from datacoll.dcrequest import collectionetag
+from datacoll.dcrequest import collstats
+from datacoll.dcrequest import downloadetag
+from datacoll.dcrequest import errorbody
+from datacoll.dcrequest import features
+from datacoll.dcrequest import getprojection
+from datacoll.dcrequest import insertedresult
+from datacoll.dcrequest import memberetag
+from datacoll.dcrequest import membersetag
+from datacoll.dcrequest import memberspage
+from datacoll.dcrequest import opsoptions
+from datacoll.dcrequest import orderedinsert
+from datacoll.dcrequest import pagination
+from datacoll.dcrequest import readmembers
+from datacoll.dcrequest import representationetag
 
 # TODO Read from __init__
 version = '0.3a1'
-cfgfile = 'datacoll.cfg'
-
-# FIXME This is hardcoded but should be read from the configuration file
-limit = 100
-# For the time being these are the capabilities for the immutable datasets
-# coming from the user requests.
-capabilitiesFixed = {
-                      "isOrdered": False,
-                      "appendsToEnd": True,
-                      "supportsRoles": False,
-                      "membershipIsMutable": True,
-                      "metadataIsMutable": True,
-                      "restrictedToType": "string",
-                      "maxLength": -1,
-                      "ruleBasedGeneration": False
-                    }
-
-"""Constructor of the DataColl object."""
-config = configparser.RawConfigParser()
-here = os.path.dirname(__file__)
-config.read(os.path.join(here, cfgfile))
-
-# Read connection parameters
-host = config.get('mongo', 'host')
-port = config.getint('mongo', 'port')
-user = config.get('mongo', 'user')
-password = config.get('mongo', 'password')
-db = config.get('mongo', 'db')
-limit = config.getint('mongo', 'limit')
-
-client = MongoClient(host, port)
-conn = client[db]
+
+
+class Service(object):
+    """Configuration and connections of one instance of the service.
+
+    Nothing is opened when the object is created. The connections to the
+    storage engine are opened by each process the first time they are used,
+    so that the service can be created before the workers of a server are
+    forked. The startup tasks (indexes and cache) also run at that moment.
+    """
+
+    def __init__(self, config):
+        """Constructor of the Service.
+
+        :param config: Configuration of the service.
+        :type config: configparser.RawConfigParser
+        """
+        self.config = config
+        # Default and maximum number of items returned in one page of a list
+        self.limit = config.getint('mongo', 'limit', fallback=500)
+        # Number of documents retrieved from Mongo in each round trip of a list
+        self.batchsize = config.getint('mongo', 'batchsize', fallback=100)
+        # Number of members removed in each operation when a collection is deleted
+        self.deletebatch = config.getint('mongo', 'deletebatch', fallback=1000)
+        # Minimum size in bytes of the chunks streamed to the client
+        self.flushsize = config.getint('Service', 'flushsize', fallback=65536)
+        # Maximum size in bytes of a request body after decompressing it
+        self.maxbodysize = config.getint('Service', 'maxbodysize', fallback=104857600)
+        # Storage engine of the Collections and Members (see dcbase)
+        self.engine = loadengine(config)
+        # Size and time to live of the cache of collections of the engine
+        if self.engine.collectionCache is not None:
+            self.engine.collectionCache.size = config.getint('cache', 'size', fallback=1000)
+            self.engine.collectionCache.ttl = config.getfloat('cache', 'ttl', fallback=60)
+        # Redirect to the content of the members or stream it (see dcproxy)
+        self.download = downloadoptions(config)
+        # Threads fetching the content of the members of the archives. The
+        # threads are started when they are first used, after the fork.
+        self.fetchpool = ThreadPoolExecutor(max_workers=self.download['fetchworkers'])
+        # Content of the members fetched by the service (see dccache) or None
+        self.contentcache = contentcache(self.download)
+
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__conn = None
+        self.__readconn = None
+
+    def connect(self):
+        """Open the connections of the current process if it has none.
+
+        Connections inherited from the parent of a forked process are not
+        used, as the drivers of the DBs are not safe after a fork.
+        """
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+
+            conn = self.engine.connect(self.config)
+            # Create the missing indexes. This does nothing if all of them are present.
+            if self.config.getboolean('mongo', 'ensureindexes', fallback=False):
+                self.engine.ensureindexes(conn)
+                # Counters of Members of the Collections created by a previous version
+                self.engine.recount(conn)
+            # Load the most used collections in the cache
+            warmids = self.config.get('cache', 'warm', fallback='')
+            if len(warmids.strip()):
+                self.engine.warmcache(conn, [collid.strip() for collid in warmids.split(',')])
+
+            # Connection of the GET requests, which may be served by the replicas
+            self.__readconn = self.engine.readconnection(conn, self.config)
+            self.__conn = conn
+            self.__pid = os.getpid()
+
+    @property
+    def conn(self):
+        """Connection of the requests which modify documents."""
+        if self.__pid != os.getpid():
+            self.connect()
+        return self.__conn
+
+    @property
+    def readconn(self):
+        """Connection of the requests which only read documents."""
+        if self.__pid != os.getpid():
+            self.connect()
+        return self.__readconn
+
 
 # Create the object to verify the signature in tokens
 # try:
@@ -123,7 +235,7 @@ conn = client[db]
 #         except Exception as e:
 #             messDict = {'code': 0,
 #                         'message': str(e)}
-#             message = json.dumps(messDict, cls=DCEncoder)
+#             message = dumps(messDict)
 #             cherrypy.response.headers['Content-Type'] = 'application/json'
 #             raise cherrypy.HTTPError(400, message)
 #
@@ -150,16 +262,207 @@ conn = client[db]
 #         except Exception as e:
 #             messDict = {'code': 0,
 #                         'message': str(e)}
-#             message = json.dumps(messDict, cls=DCEncoder)
+#             message = dumps(messDict)
 #             cherrypy.response.headers['Content-Type'] = 'application/json'
 #             raise cherrypy.HTTPError(400, message)
 #
 #     return checktokenintern
 
 
+def checketag(etag):
+    """Set the ETag of the response and check the conditions of the request.
+
+    If the client already has this version (If-None-Match) a response 304
+    without body is sent. The tag includes the format and the content coding
+    negotiated for the response.
+
+    :param etag: Quoted entity tag of the representation to send.
+    :type etag: str
+    :raises: cherrypy.HTTPRedirect
+    """
+    setetag(etag)
+    cptools.validate_etags()
+
+
+def setetag(etag):
+    """Set the ETag of the response for the format and coding negotiated.
+
+    :param etag: Quoted entity tag of the document (see makeetag).
+    :type etag: str
+    """
+    coding = getattr(cherrypy.request, 'contentcoding', None)
+    cherrypy.response.headers['ETag'] = representationetag(etag,
+                                                           cherrypy.request.headers.get('Accept'),
+                                                           coding)
+
+
+def requesterrors(f):
+    """Send the errors of an invalid request (see RequestError) in JSON format.
+
+    :param f: Handler of the request.
+    :type f: function
+    :returns: The handler raising cherrypy.HTTPError instead of RequestError.
+    :rtype: function
+    """
+    @functools.wraps(f)
+    def handler(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except RequestError as e:
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(e.status, errorbody(str(e)))
+    return handler
+
+
+def responseformat():
+    """Return the media type of the response selected with the Accept header."""
+    return selectformat(cherrypy.request.headers.get('Accept'))
+
+
+def senddocument(document):
+    """Serialize a document in the format requested by the client.
+
+    :param document: Document to send.
+    :type document: dict
+    :returns: The body of the response.
+    :rtype: bytes
+    """
+    mediatype = responseformat()
+    headers = cherrypy.response.headers
+    headers['Content-Type'] = mediatype
+    addvary(headers, 'Accept')
+    return encode(document, mediatype)
+
+
+def sendpage(objlist, flushsize):
+    """Send a page of a list in the format requested by the client.
+
+    JSON is streamed while the documents are read from the cursor. Binary
+    formats need the size of the whole page, so the page is read first.
+
+    :param objlist: List of objects with a fetchone method (e.g. :class:`~Members`)
+    :type objlist: :class:`~datacoll.dcbase.PageBase`
+    :param flushsize: Minimum size in bytes of the chunks streamed.
+    :type flushsize: int
+    :returns: The body of the response.
+    :rtype: iterable
+    """
+    if responseformat() == jsontype:
+        addvary(cherrypy.response.headers, 'Accept')
+        cherrypy.response.stream = True
+        return JSONFactory(objlist, flushsize)
+    return senddocument(pagedocument(objlist))
+
+
+def readbody(maxsize):
+    """Read the body of the request decompressing it if it has a Content-Encoding.
+
+    :param maxsize: Maximum size in bytes of the decompressed body.
+    :type maxsize: int
+    :returns: The body of the request.
+    :rtype: bytes
+    :raises: cherrypy.HTTPError
+    """
+    body = cherrypy.request.body.fp.read()
+    coding = cherrypy.request.headers.get('Content-Encoding')
+    if coding is None:
+        return body
+
+    try:
+        return decompress(body, coding, maxsize)
+    except LookupError as e:
+        code = 415
+        messdict = {'code': 0,
+                    'message': str(e)}
+    except OverflowError as e:
+        code = 413
+        messdict = {'code': 0,
+                    'message': str(e)}
+    except ValueError as e:
+        code = 400
+        messdict = {'code': 0,
+                    'message': str(e)}
+    message = dumps(messdict)
+    cherrypy.response.headers['Content-Type'] = 'application/json'
+    raise cherrypy.HTTPError(code, message)
+
+
+def readdocument(maxsize):
+    """Read a document from the body of the request in the format of its Content-Type.
+
+    :param maxsize: Maximum size in bytes of the decompressed body.
+    :type maxsize: int
+    :returns: A document or a list of documents.
+    :rtype: object
+    :raises: ValueError, cherrypy.HTTPError
+    """
+    body = readbody(maxsize)
+    return decode(body, canonicaltype(cherrypy.request.headers.get('Content-Type')))
+
+
+def compresstool(codings=codings, level=6, minsize=1024):
+    """Negotiate the content coding of the response (CherryPy tool).
+
+    The coding is kept in cherrypy.request.contentcoding, so that the ETag
+    of the response can include it, and the response is compressed before it
+    is sent.
+
+    :param codings: Content codings enabled in the preferred order.
+    :type codings: tuple
+    :param level: Compression level.
+    :type level: int
+    :param minsize: Minimum size in bytes of a body to compress it, unless
+        it is streamed.
+    :type minsize: int
+    """
+    request = cherrypy.request
+    request.contentcoding = negotiate(request.headers.get('Accept-Encoding'), codings)
+    request.hooks.attach('before_finalize', compressresponse, level=level, minsize=minsize)
+
+
+def compressresponse(level=6, minsize=1024):
+    """Compress the body of a JSON response with the negotiated coding."""
+    response = cherrypy.response
+    contenttype = response.headers.get('Content-Type', '').split(';')[0].strip()
+    if contenttype not in compressibleTypes:
+        return
+
+    # Caches must keep a version for each coding
+    addvary(response.headers, 'Accept-Encoding')
+
+    coding = cherrypy.request.contentcoding
+    # The status is only set by the handlers which do not return 200
+    status = int(str(response.status or 200).split()[0])
+    if coding is None or status not in (200, 201) or 'Content-Encoding' in response.headers:
+        return
+
+    if response.stream:
+        # Lists are compressed while they are read from the cursor
+        response.body = compressiter(response.body, coding, level)
+    else:
+        body = response.collapse_body()
+        if len(body) < minsize:
+            return
+        response.body = compress(body, coding, level)
+
+    response.headers['Content-Encoding'] = coding
+    response.headers.pop('Content-Length', None)
+    if 'ETag' in response.headers:
+        response.headers['ETag'] = codedetag(response.headers['ETag'], coding)
+
+
+cherrypy.tools.compress = cherrypy.Tool('before_handler', compresstool)
+
+
 class Application(object):
-    def __init__(self):
-        self.collections = CollectionAPI()
+    def __init__(self, service):
+        """Constructor of the root of the API.
+
+        :param service: Configuration and connections of the service.
+        :type service: :class:`~Service`
+        """
+        self.service = service
+        self.collections = CollectionAPI(service)
 
     @cherrypy.expose
     def index(self):
@@ -178,26 +481,154 @@ class Application(object):
 
     @cherrypy.expose
     def features(self):
-        syscapab = {
-            "providesCollectionPids": False,
-            "collectionPidProviderType": "string",
-            "enforcesAccess": False,
-            "supportsPagination": False,
-            "asynchronousActions": False,
-            "ruleBasedGeneration": False,
-            "maxExpansionDepth": 4,
-            "providesVersioning": False,
-            "supportedCollectionOperations": [],
-            "supportedModelTypes": []
-        }
         cherrypy.response.header_list = [('Content-Type', 'application/json')]
-        return json.dumps(syscapab, cls=DCEncoder)
+        return dumps(features)
+
+    @cherrypy.expose
+    def stats(self):
+        """Return the counters of the caches of this process.
+
+        :returns: Hits and misses of the caches in JSON format
+        :rtype: string
+        """
+        result = dict()
+        if self.service.engine.collectionCache is not None:
+            result['collectionCache'] = self.service.engine.collectionCache.stats()
+        if self.service.contentcache is not None:
+            result['contentCache'] = self.service.contentcache.stats()
+        cherrypy.response.header_list = [('Content-Type', 'application/json')]
+        return dumps(result)
+
+
+class OpsAPI(object):
+    """Operations on the Members of a Collection.
+
+    The results are streamed while they are read from the DB, so they are
+    sent as a single list without next_cursor.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def notfound(self, collid, otherid=None):
+        if otherid is None:
+            text = 'Collection %s not found' % collid
+        else:
+            text = 'Collection %s or %s not found' % (collid, otherid)
+        messdict = {'code': 0,
+                    'message': text}
+        message = dumps(messdict)
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return cherrypy.HTTPError(404, message)
+
+    @cherrypy.expose
+    @requesterrors
+    def findMatch(self, collid, **kwargs):
+        """Return the members with the same values as the fields of a member.
+
+        :param collid: Collection ID.
+        :type collid: str
+        :returns: The members found in JSON format.
+        :rtype: string
+        :raises: cherrypy.HTTPError
+        """
+        if cherrypy.request.method != 'POST':
+            messdict = {'code': 0,
+                        'message': 'findMatch expects a member in the body of a POST'}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(405, message)
+
+        try:
+            document = readdocument(self.service.maxbodysize)
+        except ValueError:
+            messdict = {'code': 0,
+                        'message': 'Invalid JSON document'}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(400, message)
+
+        checkmatch(document)
+
+        try:
+            coll = self.service.engine.Collection(self.service.readconn, collid, fetch=False)
+            result = coll.findmatch(document, batchsize=self.service.batchsize)
+        except Exception:
+            raise self.notfound(collid)
+
+        return sendpage(result, self.service.flushsize)
+
+    @cherrypy.expose
+    @requesterrors
+    def intersection(self, otherid, collid, **kwargs):
+        """Return the members with the same checksum (or location) in another collection.
+
+        :param otherid: ID of the other collection (from the path).
+        :type otherid: str
+        :param collid: Collection ID.
+        :type collid: str
+        :returns: The members of the collection found in the other one in JSON format.
+        :rtype: string
+        :raises: cherrypy.HTTPError
+        """
+        field, depth = opsoptions(kwargs)
+        try:
+            coll = self.service.engine.Collection(self.service.readconn, collid, fetch=False)
+            result = coll.intersection(otherid, field, batchsize=self.service.batchsize)
+        except Exception:
+            raise self.notfound(collid, otherid)
+
+        return sendpage(result, self.service.flushsize)
+
+    @cherrypy.expose
+    @requesterrors
+    def union(self, otherid, collid, **kwargs):
+        """Return the members of a collection and the ones of another which are not there.
+
+        :param otherid: ID of the other collection (from the path).
+        :type otherid: str
+        :param collid: Collection ID.
+        :type collid: str
+        :returns: The members of both collections in JSON format.
+        :rtype: string
+        :raises: cherrypy.HTTPError
+        """
+        field, depth = opsoptions(kwargs)
+        try:
+            coll = self.service.engine.Collection(self.service.readconn, collid, fetch=False)
+            result = coll.union(otherid, field, batchsize=self.service.batchsize)
+        except Exception:
+            raise self.notfound(collid, otherid)
+
+        return sendpage(result, self.service.flushsize)
+
+    @cherrypy.expose
+    @requesterrors
+    def flatten(self, collid, **kwargs):
+        """Return the members of a collection and of the collections it contains.
+
+        :param collid: Collection ID.
+        :type collid: str
+        :returns: The members in JSON format.
+        :rtype: string
+        :raises: cherrypy.HTTPError
+        """
+        field, depth = opsoptions(kwargs)
+        try:
+            coll = self.service.engine.Collection(self.service.readconn, collid, fetch=False)
+            result = coll.flatten(depth, batchsize=self.service.batchsize)
+        except Exception:
+            raise self.notfound(collid)
+
+        return sendpage(result, self.service.flushsize)
 
 
 @cherrypy.popargs('collid')
 class CollectionAPI(object):
-    def __init__(self):
-        self.members = MemberAPI()
+    def __init__(self, service):
+        self.service = service
+        self.members = MemberAPI(service)
+        self.ops = OpsAPI(service)
 
     @cherrypy.expose
     def capabilities(self, collid):
@@ -212,22 +643,86 @@ class CollectionAPI(object):
         # For the time being, these are fixed collections.
         # To be modified in the future with mutable collections
         try:
-            coll = Collection(conn, collid=collid)
+            coll = self.service.engine.Collection(self.service.readconn, collid=collid)
         except Exception:
             messdict = {'code': 0,
                         'message': 'Collection ID %s not found' % collid}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(404, message)
 
-        auxcap = capabilitiesFixed.copy()
-        # TODO See if capabilities should stay out side from Collection
-        # auxCap['restrictedtotype'] = coll.restrictedtotype
+        # The capabilities stored in the Collection (e.g. maxLength) replace the fixed ones
+        auxcap = collcapabilities(coll.document)
 
-        cherrypy.response.headers['Content-Type'] = 'application/json'
-        return json.dumps(auxcap, cls=DCEncoder).encode('utf-8')
+        return senddocument(auxcap)
+
+    @cherrypy.expose
+    def stats(self, collid):
+        """Return the number of members of a collection and their total size.
+
+        The counters are kept with the collection, so no member is read.
+
+        :param collid: Collection ID.
+        :type collid: str
+        :returns: memberCount, memberBytes and maxLength in JSON format.
+        :rtype: string
+        :raises: cherrypy.HTTPError
+        """
+        try:
+            coll = self.service.engine.Collection(self.service.readconn, collid=collid)
+            count, size = coll.counters()
+        except Exception:
+            messdict = {'code': 0,
+                        'message': 'Collection ID %s not found' % collid}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(404, message)
+
+        return senddocument(collstats(coll.document, count, size))
 
     @cherrypy.expose
+    @requesterrors
+    def download(self, collid, **kwargs):
+        """Send an archive with the content of all members of a collection.
+
+        :param collid: Collection ID.
+        :type collid: str
+        :param format: tar (default) or zip.
+        :type format: str
+        :returns: Generator of the chunks of the archive.
+        :rtype: generator
+        :raises: cherrypy.HTTPError
+        """
+        fmt = archiveformat(kwargs)
+
+        try:
+            coll = self.service.engine.Collection(self.service.readconn, collid=collid)
+            # Members of an ordered collection are added by their position
+            memblist = self.service.engine.Members(self.service.readconn, collid=collid,
+                                                   sort=indexField if isordered(coll.document)
+                                                   else None,
+                                                   batchsize=self.service.batchsize)
+        except Exception:
+            messdict = {'code': 0,
+                        'message': 'Collection ID %s not found' % collid}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(404, message)
+
+        options = self.service.download
+        cherrypy.response.headers['Content-Type'] = archiveFormats[fmt]
+        cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="%s.%s"' \
+                                                           % (collid, fmt)
+        return archivechunks(iter(memblist.fetchone, None),
+                             ArchiveBuilder(fmt, options['chunksize']), self.service.fetchpool,
+                             options['fetchworkers'], options, collid, self.service.contentcache)
+
+    # The archive is streamed while the members are fetched
+    download._cp_config = {'response.stream': True,
+                           'tools.compress.on': False}
+
+    @cherrypy.expose
+    @requesterrors
     def index(self, collid=None, **kwargs):
         cherrypy.response.headers['Content-Type'] = 'application/json'
         if cherrypy.request.method == 'GET':
@@ -244,7 +739,7 @@ class CollectionAPI(object):
 
         messdict = {'code': 0,
                     'message': 'Method %s not recognized/implemented!' % cherrypy.request.method}
-        message = json.dumps(messdict, cls=DCEncoder)
+        message = dumps(messdict)
         raise cherrypy.HTTPError(400, message)
 
     # @checktokenhard
@@ -252,20 +747,25 @@ class CollectionAPI(object):
         if collid is None:
             messdict = {'code': 0,
                         'message': 'No collection ID was received!'}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(400, message)
 
+        def progress(removed):
+            cherrypy.log('Collection %s: %d members deleted' % (collid, removed))
+
+        # The Collection is not read before deleting it
         try:
-            coll = Collection(conn, collid=collid)
+            coll = self.service.engine.Collection(self.service.conn, collid=collid, fetch=False)
+            removed = coll.delete(batchsize=self.service.deletebatch, progress=progress)
         except Exception:
             messdict = {'code': 0,
                         'message': 'Collection ID %s not found' % collid}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(404, message)
 
-        coll.delete()
+        cherrypy.log('Collection %s deleted with %d members' % (collid, removed))
 
         return ""
 
@@ -274,119 +774,196 @@ class CollectionAPI(object):
         if collid is None:
             messdict = {'code': 0,
                         'message': 'No collection ID was received!'}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(400, message)
+
+        try:
+            jsoncoll = readdocument(self.service.maxbodysize)
+        except ValueError:
+            messdict = {'code': 0,
+                        'message': 'Invalid JSON document'}
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(400, message)
 
-        jsoncoll = json.loads(cherrypy.request.body.fp.read())
+        checkid(jsoncoll, collid, 'Collection')
 
+        # The update returns the new version of the document
         try:
-            coll = Collection(conn, collid=collid)
+            coll = self.service.engine.Collection(self.service.conn, collid=collid, fetch=False)
+            coll.update(jsoncoll)
         except Exception:
             messdict = {'code': 0,
                         'message': 'Collection ID %s not found' % collid}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(404, message)
 
-        # TODO I must check if the object coll is being updated as in the DB!
-        coll.update(jsoncoll)
-
-        cherrypy.response.headers['Content-Type'] = 'application/json'
-        return coll.document
+        setetag(collectionetag(coll._id, coll.version))
+        return senddocument(coll.document)
 
     # @checktokenhard
     def post(self, collid, **kwargs):
-        jsoncoll = json.loads(cherrypy.request.body.fp.read())
-
-        # _id must always be a str
-        if isinstance(collid, bytes):
-            collid = collid.decode('utf-8')
-
-        if collid is not None:
-            collid = str(collid)
-
-            try:
-                # This should raise an Exception if the Collection does not exist
-                coll = Collection(conn, collid)
-
-                # Otherwise send Error 400
-                msg = 'Collection with this ID already exists! (%s)'
-                messdict = {'code': 0,
-                            'message': msg % (collid)}
-                message = json.dumps(messdict, cls=DCEncoder)
-                cherrypy.log(message, traceback=True)
-                cherrypy.response.headers['Content-Type'] = 'application/json'
-                raise cherrypy.HTTPError(400, message)
-            except Exception:
-                pass
-        else:
-            coll = Collection(conn, None)
+        try:
+            jsoncoll = readdocument(self.service.maxbodysize)
+        except ValueError:
+            messdict = {'code': 0,
+                        'message': 'Invalid JSON document'}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(400, message)
 
+        # An existing Collection with the same ID makes the insert fail
         try:
             # It is important to call insert inline with an empty Collection!
+            coll = self.service.engine.Collection(self.service.conn, collid, fetch=False)
             insertedid = coll.insert(jsoncoll)
             if isinstance(insertedid, bytes):
                 insertedid = insertedid.decode('utf-8')
-
-            coll = Collection(conn, insertedid)
         except Exception:
             # Send Error 400
             messdict = {'code': 0,
                         'message': 'Collection could not be inserted'}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.log(message, traceback=True)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(400, message)
 
         cherrypy.response.status = '201 Collection %s created' % insertedid
-        cherrypy.response.headers['Content-Type'] = 'application/json'
+        setetag(collectionetag(coll._id, coll.version))
 
-        result = json.dumps(coll.document, cls=DCEncoder)
-        return result.encode('utf-8')
+        # The inserted document is returned without reading it again
+        return senddocument(coll.document)
 
     # @checktokensoft
     def get(self, collid=None, **kwargs):
         cherrypy.response.headers['Content-Type'] = 'application/json'
 
+        fields = getprojection(kwargs)
+
         if collid is None:
+            pagesize, cursor, sort = pagination(kwargs, self.service.limit)
             try:
                 # If no ID is given iterate through all collections in cursor
-                colls = Collections(conn)
-            except Exception:
+                colls = self.service.engine.Collections(self.service.readconn, limit=pagesize,
+                                                        cursor=cursor, sort=sort,
+                                                        batchsize=self.service.batchsize,
+                                                        fields=fields)
+            except Exception as e:
                 messdict = {'code': 0,
-                            'message': 'Collection %s not found' % collid}
-                message = json.dumps(messdict, cls=DCEncoder)
-                raise cherrypy.HTTPError(404, message)
+                            'message': str(e)}
+                message = dumps(messdict)
+                raise cherrypy.HTTPError(400, message)
 
-            return dumps(colls).encode('utf-8')
+            # Send the collections while they are read from the cursor
+            return sendpage(colls, self.service.flushsize)
 
         try:
-            coll = Collection(conn, collid=collid)
+            coll = self.service.engine.Collection(self.service.readconn, collid=collid,
+                                                  fields=fields)
         except Exception:
             messdict = {'code': 0,
                         'message': 'Collection ID %s not found' % collid}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(404, message)
 
-        cherrypy.response.headers['Content-Type'] = 'application/json'
-        result = json.dumps(coll.document, cls=DCEncoder)
-        return result.encode('utf-8')
+        checketag(collectionetag(coll._id, coll.version, kwargs.get('fields')))
+
+        return senddocument(coll.document)
 
 
 class DownloadMemberAPI(object):
+    def __init__(self, service):
+        self.service = service
+
     @cherrypy.expose
     def index(self, collid, memberid, **kwargs):
-        url = Member(collid, memberid).download()
-        raise cherrypy.HTTPRedirect(url, 301)
+        """Send the content of a member or redirect the client to it.
+
+        :param collid: Collection ID.
+        :type collid: str
+        :param memberid: Member ID.
+        :type memberid: str
+        :returns: Iterable object which downloads the content of the member.
+        :rtype: :class:`~datacoll.dcproxy.urlFile`
+        :raises: cherrypy.HTTPError, cherrypy.HTTPRedirect
+        """
+        try:
+            member = self.service.engine.Member(self.service.readconn, collid, memberid)
+        except Exception:
+            messdict = {'code': 0,
+                        'message': 'Member %s or Collection %s not found'
+                        % (memberid, collid)}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(404, message)
+
+        url = member.download()
+        if url is None:
+            messdict = {'code': 0,
+                        'message': 'Member %s has no location' % memberid}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(404, message)
+
+        options = self.service.download
+        if options['mode'] == 'redirect' or not canproxy(url):
+            # The location changes only if the member is updated
+            cherrypy.response.headers['Cache-Control'] = 'public, max-age=%d' % options['maxage']
+            cherrypy.response.headers['ETag'] = downloadetag(collid, member._id, member.version)
+            cptools.validate_etags()
+            raise cherrypy.HTTPRedirect(url, 307)
+
+        cache = self.service.contentcache
+        key = cachekey(member.document) if cache is not None else None
+        if key is not None and cherrypy.request.method == 'GET':
+            try:
+                path = cache.fetch(key, url, member.document['checksum'])
+            except Exception as e:
+                cherrypy.log('Member %s not cached: %s' % (memberid, e))
+            else:
+                try:
+                    # The file can be removed from the cache once it is open
+                    cached = open(path, 'rb')
+                except OSError as e:
+                    cached = None
+                    cherrypy.log('Member %s not read from the cache: %s' % (memberid, e))
+                finally:
+                    cache.release(key)
+                if cached is not None:
+                    # The ranges are served from the file
+                    return static.serve_fileobj(cached, contenttype(member.document, url))
+
+        upstream = urlFile(url, forwarded(cherrypy.request.headers), options['chunksize'],
+                           options['timeout'], 'HEAD' if cherrypy.request.method == 'HEAD' else 'GET')
+        try:
+            upstream.open()
+        except Exception as e:
+            messdict = {'code': 0,
+                        'message': 'Content of member %s could not be retrieved: %s'
+                        % (memberid, e)}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(502, message)
+
+        # The content is sent as received, also a part of it (206)
+        cherrypy.response.status = upstream.status
+        cherrypy.response.headers.update(upstream.headers)
+        return upstream
+
+    # The content is streamed and never compressed, so that the ranges are kept
+    index._cp_config = {'response.stream': True,
+                        'tools.compress.on': False}
 
 
 @cherrypy.popargs('memberid')
 class MemberAPI(object):
-    def __init__(self):
+    def __init__(self, service):
         """Constructor of the DataColl object."""
-        self.download = DownloadMemberAPI()
+        self.service = service
+        self.download = DownloadMemberAPI(service)
 
     @cherrypy.expose
     def properties(self, collid, memberid):
@@ -394,6 +971,7 @@ class MemberAPI(object):
         return 'Not implemented!'
 
     @cherrypy.expose
+    @requesterrors
     def index(self, collid, memberid=None, **kwargs):
         cherrypy.response.headers['Content-Type'] = 'application/json'
         if cherrypy.request.method == 'GET':
@@ -410,40 +988,62 @@ class MemberAPI(object):
 
         messdict = {'code': 0,
                     'message': 'Method %s not recognized/implemented!' % cherrypy.request.method}
-        message = json.dumps(messdict, cls=DCEncoder)
+        message = dumps(messdict)
         raise cherrypy.HTTPError(400, message)
 
     # @checktokensoft
     def get(self, collid, memberid, **kwargs):
         cherrypy.response.headers['Content-Type'] = 'application/json'
 
+        fields = getprojection(kwargs)
+
         if memberid is None:
             try:
-                memblist = Members(conn, collid=collid)
+                coll = self.service.engine.Collection(self.service.readconn, collid=collid)
             except Exception:
                 messdict = {'code': 0,
                             'message': 'Collection %s not found' % collid}
-                message = json.dumps(messdict, cls=DCEncoder)
+                message = dumps(messdict)
                 raise cherrypy.HTTPError(404, message)
 
-            # If no ID is given iterate through all collections in cursor
-            return dumps(memblist).encode('utf-8')
+            pagesize, cursor, sort, filters = memberspage(kwargs, self.service.limit,
+                                                          coll.document)
+
+            try:
+                memblist = self.service.engine.Members(self.service.readconn, collid=collid,
+                                                       limit=pagesize, cursor=cursor, sort=sort,
+                                                       batchsize=self.service.batchsize,
+                                                       fields=fields, filters=filters)
+            except Exception:
+                messdict = {'code': 0,
+                            'message': 'Collection %s not found' % collid}
+                message = dumps(messdict)
+                raise cherrypy.HTTPError(404, message)
+
+            # The list changes only if the members of the collection change
+            checketag(membersetag(collid, memblist.mversion, kwargs, sort))
+
+            # If no ID is given send the members while they are read from the cursor
+            return sendpage(memblist, self.service.flushsize)
 
         try:
-            member = Member(conn, collid=collid, memberid=memberid)
+            member = self.service.engine.Member(self.service.readconn, collid=collid,
+                                                memberid=memberid, fields=fields)
         except Exception:
             messdict = {'code': 0,
                         'message': 'Member %s or Collection %s not found'
                         % (memberid, collid)}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             raise cherrypy.HTTPError(404, message)
 
-        result = json.dumps(member.document, cls=DCEncoder)
-        return result.encode('utf-8')
+        checketag(memberetag(collid, member._id, member.version, kwargs.get('fields')))
+
+        return senddocument(member.document)
 
     # @checktokenhard
     def post(self, collid, memberid, **kwargs):
-        jsonmemb = json.loads(cherrypy.request.body.fp.read())
+        body = readbody(self.service.maxbodysize)
+        jsonmemb = readmembers(body, cherrypy.request.headers.get('Content-Type', ''))
 
         # _id must always be a str
         if isinstance(collid, bytes):
@@ -454,83 +1054,102 @@ class MemberAPI(object):
             raise Exception('Cannot add Member to Collection None!')
 
         try:
-            coll = Collection(conn, collid=collid)
+            coll = self.service.engine.Collection(self.service.conn, collid=collid)
         except Exception:
             # Send Error 404
             messdict = {'code': 0,
                         'message': 'Collection %s not found!' % collid}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.log(message, traceback=True)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(404, message)
 
-        # _id must always be a str
-        if isinstance(memberid, bytes):
-            memberid = memberid.decode('utf-8')
-
-        if memberid is not None:
-            memberid = str(memberid)
-
+        # Members inserted in the middle of an ordered collection take the
+        # positions between the given member and the previous one
+        if kwargs.get('before') is not None:
+            documents = beforedocuments(coll.document, collid, jsonmemb)
             try:
-                # This should raise an Exception if the Member does not exist
-                m = Member(conn, collid, memberid)
-
-                # Otherwise send Error 400
-                msg = 'Member with this ID already exists! (%s, %s)'
+                for document, key in zip(documents, coll.keysbefore(kwargs['before'],
+                                                                    len(documents))):
+                    setindex(document, key)
+            except Exception as e:
                 messdict = {'code': 0,
-                            'message': msg % (collid, memberid)}
-                message = json.dumps(messdict, cls=DCEncoder)
-                cherrypy.log(message, traceback=True)
+                            'message': str(e)}
+                message = dumps(messdict)
                 cherrypy.response.headers['Content-Type'] = 'application/json'
                 raise cherrypy.HTTPError(400, message)
-            except Exception:
-                pass
 
-        else:
-            m = Member(conn, collid, None)
+        if isinstance(jsonmemb, list):
+            return self.postmany(coll, jsonmemb, **kwargs)
 
+        # _id must always be a str
+        if isinstance(memberid, bytes):
+            memberid = memberid.decode('utf-8')
+
+        # An existing Member with the same ID makes the insert fail
         # FIXME Here we need to set also the datatype after checking the restrictedToType attribute in the collection
         try:
-            insertedid = m.insert(jsonmemb)
+            memb = self.service.engine.Member(self.service.conn, collid, memberid, fetch=False)
+            insertedid = memb.insert(jsonmemb)
             if isinstance(insertedid, bytes):
                 insertedid = insertedid.decode('utf-8')
-
-            memb = Member(conn, collid, insertedid)
+        except CollectionFull as e:
+            messdict = {'code': 0,
+                        'message': str(e)}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(409, message)
         except Exception:
             msg = 'Member could not be inserted'
             messdict = {'code': 0,
                         'message': msg}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.log(message, traceback=True)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(400, msg)
 
         cherrypy.response.status = '201 Member created (%s)' % insertedid
-        cherrypy.response.headers['Content-Type'] = 'application/json'
-        result = json.dumps(memb.document, cls=DCEncoder)
-        return result.encode('utf-8')
+        setetag(memberetag(collid, memb._id, memb.version))
+
+        # The inserted document is returned without reading it again
+        return senddocument(memb.document)
+
+    def postmany(self, coll, documents, **kwargs):
+        """Insert many members in a collection with a single request.
+
+        :param coll: Collection where the members must be inserted.
+        :type coll: :class:`~Collection`
+        :param documents: Members to insert.
+        :type documents: list
+        :returns: IDs of the members created and errors found in JSON format.
+        :rtype: string
+        """
+        inserted, errors = coll.insertmembers(documents, ordered=orderedinsert(kwargs))
+
+        status, reason, result = insertedresult(inserted, errors)
+        cherrypy.response.status = status if reason is None else '%d %s' % (status, reason)
+        return senddocument(result)
 
     # @checktokenhard
     def put(self, collid, memberid, **kwargs):
         if (collid is None) or (memberid is None):
             messdict = {'code': 0,
                         'message': 'No member or collection ID was received!'}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(400, message)
 
-        jsonmemb = json.loads(cherrypy.request.body.fp.read())
-
         try:
-            member = Member(conn, collid=collid, memberid=memberid)
-        except Exception:
-            msg = 'Member %s from Collection %s not found!'
+            jsonmemb = readdocument(self.service.maxbodysize)
+        except ValueError:
             messdict = {'code': 0,
-                        'message': msg % (memberid, collid)}
-            message = json.dumps(messdict, cls=DCEncoder)
+                        'message': 'Member is not a valid JSON document'}
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(400, message)
 
+        checkid(jsonmemb, memberid, 'Member')
+
         # Check that the index does not collide with existent IDs
         # if index != memberid:
         #     try:
@@ -539,7 +1158,7 @@ class MemberAPI(object):
         #         msg = 'Index %s is already used for Collection %s !'
         #         messDict = {'code': 0,
         #                     'message': msg % (index, collid)}
-        #         message = json.dumps(messDict, cls=DCEncoder)
+        #         message = dumps(messDict)
         #         cherrypy.response.headers['Content-Type'] = 'application/json'
         #         raise cherrypy.HTTPError(400, message)
         #     except:
@@ -551,12 +1170,22 @@ class MemberAPI(object):
         #     msg = 'Datatype error! Collection only accepts %s'
         #     messDict = {'code': 0,
         #                 'message': msg % coll.restrictedtotype}
-        #     message = json.dumps(messDict, cls=DCEncoder)
+        #     message = dumps(messDict)
         #     cherrypy.response.headers['Content-Type'] = 'application/json'
         #     raise cherrypy.HTTPError(400, message)
 
-        # TODO I must check if the object is being updated as in the DB!
-        member.update(jsonmemb)
+        # The update returns the new version of the document
+        try:
+            member = self.service.engine.Member(self.service.conn, collid=collid,
+                                                memberid=memberid, fetch=False)
+            member.update(jsonmemb)
+        except Exception:
+            msg = 'Member %s from Collection %s not found!'
+            messdict = {'code': 0,
+                        'message': msg % (memberid, collid)}
+            message = dumps(messdict)
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            raise cherrypy.HTTPError(404, message)
 
         # Read the member
         # try:
@@ -566,41 +1195,200 @@ class MemberAPI(object):
         #     msg = 'Member seems not to be properly saved.'
         #     messDict = {'code': 0,
         #                 'message': msg}
-        #     message = json.dumps(messDict, cls=DCEncoder)
+        #     message = dumps(messDict)
         #     cherrypy.response.headers['Content-Type'] = 'application/json'
         #     raise cherrypy.HTTPError(400, message)
 
-        cherrypy.response.headers['Content-Type'] = 'application/json'
-        return member.document
+        setetag(memberetag(collid, member._id, member.version))
+        return senddocument(member.document)
 
     # @checktokenhard
     def delete(self, collid, memberid, **kwargs):
         if (collid is None) or (memberid is None):
             messdict = {'code': 0,
                         'message': 'No member or collection ID was received!'}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(400, message)
 
+        # The Member is not read before deleting it
         try:
-            member = Member(conn, collid=collid, memberid=memberid)
+            member = self.service.engine.Member(self.service.conn, collid=collid,
+                                                memberid=memberid, fetch=False)
+            member.delete()
         except Exception:
             msg = 'Member ID %s within collection ID %s not found'
             messdict = {'code': 0,
                         'message': msg % (memberid, collid)}
-            message = json.dumps(messdict, cls=DCEncoder)
+            message = dumps(messdict)
             cherrypy.response.headers['Content-Type'] = 'application/json'
             raise cherrypy.HTTPError(404, message)
 
-        member.delete()
-
         return ""
 
 
+def create_app(config=None, script_name='/rda/datacoll'):
+    """Create an instance of the service.
+
+    No connection is opened until the first request is served, so the
+    application can be created before forking the workers of a server.
+    The result can be mounted in the CherryPy tree or called directly by any
+    WSGI server. Several instances with different configurations can be
+    used in the same process, although the cache of collections and the
+    serializer are shared.
+
+    :param config: Configuration of the service or its file. By default,
+        datacoll.cfg in the directory of this module.
+    :type config: configparser.RawConfigParser or str
+    :param script_name: Path where the API is mounted.
+    :type script_name: str
+    :returns: The application, which is also a WSGI callable.
+    :rtype: cherrypy.Application
+    """
+    if not isinstance(config, configparser.RawConfigParser):
+        config = readconfig(config)
+
+    # JSON library used to serialize the responses
+    setserializer(config.get('Service', 'serializer', fallback='auto'))
+
+    # Responses are compressed if any content coding is enabled
+    options = compressoptions(config)
+    appconfig = {'tools.trailing_slash.on': False,
+                 'tools.compress.on': len(options['codings']) > 0}
+    for key, value in options.items():
+        appconfig['tools.compress.%s' % key] = value
+
+    service = Service(config)
+    return cherrypy.Application(Application(service), script_name, {'/': appconfig})
+
+
+def serveworker(app, host, port, threads):
+    """Serve the application in a worker process until it is terminated.
+
+    Each worker binds its own listening socket with SO_REUSEPORT, so that
+    the kernel distributes the connections among the workers.
+
+    :param app: Application created by :func:`create_app`.
+    :type app: cherrypy.Application
+    :param host: Address where the service listens.
+    :type host: str
+    :param port: Port where the service listens.
+    :type port: int
+    :param threads: Number of threads serving requests in the worker.
+    :type threads: int
+    """
+    # The connections of this process are opened before accepting requests
+    app.root.service.connect()
+
+    server = wsgi.Server((host, port), app, numthreads=threads, reuse_port=True)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.safe_start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.stop()
+
+
+def prefork(app, host, port, workers, threads):
+    """Fork the workers serving the application and restart the ones which die.
+
+    The parent process does not serve any request. It finishes after all
+    workers have finished when it receives SIGINT or SIGTERM.
+
+    :param app: Application created by :func:`create_app`.
+    :type app: cherrypy.Application
+    :param host: Address where the service listens.
+    :type host: str
+    :param port: Port where the service listens.
+    :type port: int
+    :param workers: Number of worker processes.
+    :type workers: int
+    :param threads: Number of threads serving requests in each worker.
+    :type threads: int
+    """
+    # PID and start time of each worker
+    children = dict()
+    stopping = list()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                serveworker(app, host, port, threads)
+            except Exception:
+                cherrypy.log('Worker %d failed' % os.getpid(), traceback=True)
+                status = 1
+            finally:
+                os._exit(status)
+        children[pid] = time.time()
+        cherrypy.log('Worker %d started' % pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        spawn()
+
+    while len(children):
+        try:
+            pid, status = os.wait()
+        except InterruptedError:
+            continue
+        except ChildProcessError:
+            break
+
+        started = children.pop(pid, None)
+        if started is None or len(stopping):
+            continue
+
+        cherrypy.log('Worker %d exited with status %d. Starting a new one.'
+                     % (pid, os.waitstatus_to_exitcode(status)))
+        # Do not restart a worker which cannot start (e.g. the port is in use) in a loop
+        if time.time() - started < 1:
+            time.sleep(1)
+        spawn()
+
+
 def main():
-    config = {'/': {'tools.trailing_slash.on': False}}
-    cherrypy.server.socket_host = "0.0.0.0"
-    cherrypy.quickstart(Application(), script_name='/rda/datacoll', config=config)
+    parser = argparse.ArgumentParser(description='Data Collection Service')
+    parser.add_argument('-c', '--config', default=None,
+                        help='Configuration file of the service')
+    parser.add_argument('-H', '--host', default='0.0.0.0',
+                        help='Address where the service listens')
+    parser.add_argument('-p', '--port', type=int, default=8080,
+                        help='Port where the service listens')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='Number of worker processes. With 0, the service runs in '
+                             'a single process.')
+    parser.add_argument('-t', '--threads', type=int, default=10,
+                        help='Number of threads serving requests in each worker')
+    parser.add_argument('-V', '--version', action='version', version='%(prog)s ' + version,
+                        help='Show version information.')
+    args = parser.parse_args()
+
+    app = create_app(args.config)
+    if args.workers > 0:
+        # Each worker opens its own connections after the fork
+        prefork(app, args.host, args.port, args.workers, args.threads)
+        return
+
+    # A single process serves the API. Fail at startup if the DB is not available.
+    app.root.service.connect()
+    cherrypy.server.socket_host = args.host
+    cherrypy.server.socket_port = args.port
+    cherrypy.server.thread_pool = args.threads
+    cherrypy.quickstart(app)
 
 
 if __name__ == '__main__':
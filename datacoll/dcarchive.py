@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Archive with the content of all Members of a Collection
+
+The content of the Members is fetched from their locations by a pool of
+threads with a fixed number of workers, shared by all requests. A few
+Members are fetched in advance while the previous one is sent, and each one
+is kept in a spooled temporary file, which is moved from memory to disk if it
+is larger than spoolsize. The files are added to a tar or zip archive in the
+order of the list of Members, and the archive is streamed while it is built.
+Members found in the cache of the content (see :mod:`datacoll.dccache`) are
+read from their file instead.
+
+A Member which cannot be fetched does not stop the archive. Every Member is
+listed in the last entry of the archive (manifest.json) with its name in the
+archive and size, or with the error found.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import io
+import os
+import time
+import tarfile
+import zipfile
+import tempfile
+import posixpath
+import urllib.parse
+from collections import deque
+from datacoll.dcjson import dumpb
+from datacoll.dccache import cachekey
+from datacoll.dcproxy import urlFile
+from datacoll.dcproxy import canproxy
+from datacoll.dcproxy import downloadurl
+
+# Media types of the archives supported
+archiveFormats = {'tar': 'application/x-tar',
+                  'zip': 'application/zip'}
+
+# Name of the entry listing the Members in the archive
+manifestName = 'manifest.json'
+
+
+def fetchmember(document, options, cache=None):
+    """Fetch the content of a Member into a spooled temporary file.
+
+    If the Member is in the cache of the content, its file is used instead.
+
+    :param document: Member.
+    :type document: dict
+    :param options: Options of the download (see
+        :func:`~datacoll.dcproxy.downloadoptions`).
+    :type options: dict
+    :param cache: Cache of the content of the Members.
+    :type cache: :class:`~datacoll.dccache.ContentCache`
+    :returns: The file positioned at its start and its size in bytes.
+    :rtype: tuple
+    :raises: Exception
+    """
+    url = downloadurl(document)
+    if url is None:
+        raise Exception('Member has no location')
+    if not canproxy(url):
+        raise Exception('Location %s cannot be fetched by the service' % url)
+
+    key = cachekey(document) if cache is not None else None
+    if key is not None:
+        try:
+            path = cache.fetch(key, url, document['checksum'])
+        except Exception:
+            # e.g. the checksum does not match. The content is fetched again.
+            pass
+        else:
+            try:
+                # The file can be removed from the cache once it is open
+                cached = open(path, 'rb')
+            except OSError:
+                cached = None
+            finally:
+                cache.release(key)
+            if cached is not None:
+                return cached, os.fstat(cached.fileno()).st_size
+
+    upstream = urlFile(url, {'Accept-Encoding': 'identity'}, options['chunksize'],
+                       options['timeout']).open()
+    if upstream.status != 200:
+        upstream.response.close()
+        raise Exception('%s returned the status %d' % (url, upstream.status))
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=options['spoolsize'])
+    try:
+        for chunk in upstream:
+            spooled.write(chunk)
+        size = spooled.tell()
+        spooled.seek(0)
+    except Exception:
+        spooled.close()
+        raise
+    return spooled, size
+
+
+def discard(future):
+    """Close the file of a fetch whose result will not be used."""
+    if not future.cancelled() and future.exception() is None:
+        future.result()[0].close()
+
+
+class ChunkWriter(object):
+    """File-like object keeping the data written until it is sent."""
+
+    def __init__(self):
+        self.chunks = list()
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return the data written since the last call."""
+        chunks = self.chunks
+        self.chunks = list()
+        return chunks
+
+
+class ArchiveBuilder(object):
+    """Build a tar or zip archive as a sequence of chunks.
+
+    The entries are written while their content is read, so no file is kept
+    in memory. Zip entries are stored without compression.
+    """
+
+    def __init__(self, fmt='tar', chunksize=1048576):
+        """Constructor of the archive.
+
+        :param fmt: tar or zip.
+        :type fmt: str
+        :param chunksize: Size in bytes of the chunks read from each file.
+        :type chunksize: int
+        :raises: Exception
+        """
+        if fmt not in archiveFormats:
+            raise Exception('Archive format must be %s' % ' or '.join(sorted(archiveFormats)))
+        self.format = fmt
+        self.chunksize = chunksize
+        self.entries = list()
+        self.__used = {manifestName}
+        self.__offset = 0
+        self.__writer = ChunkWriter()
+        self.__zip = zipfile.ZipFile(self.__writer, 'w') if fmt == 'zip' else None
+
+    def entryname(self, document):
+        """Return a unique name in the archive for the content of a Member.
+
+        The last part of the path of its location is used if possible.
+        """
+        location = document.get('location')
+        path = urllib.parse.urlsplit(location).path if isinstance(location, str) else ''
+        name = posixpath.basename(path)
+        if name in ('', '.', '..'):
+            name = str(document['_id'])
+        if name in self.__used:
+            name = '%s_%s' % (document['_id'], name)
+        self.__used.add(name)
+        return name
+
+    def __tarchunk(self, data):
+        self.__offset += len(data)
+        return data
+
+    def add(self, name, fileobj, size):
+        """Add a file to the archive.
+
+        :param name: Name of the entry.
+        :type name: str
+        :param fileobj: File to read the content from.
+        :type fileobj: file
+        :param size: Size in bytes of the file.
+        :type size: int
+        :returns: Generator of the chunks of the archive.
+        """
+        mtime = time.time()
+        if self.format == 'tar':
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = mtime
+            info.mode = 0o644
+            yield self.__tarchunk(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+            while True:
+                data = fileobj.read(self.chunksize)
+                if not len(data):
+                    break
+                yield self.__tarchunk(data)
+            # The content is padded to a whole block
+            if size % tarfile.BLOCKSIZE:
+                yield self.__tarchunk(tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+            return
+
+        info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+        info.file_size = size
+        info.compress_type = zipfile.ZIP_STORED
+        info.external_attr = 0o644 << 16
+        with self.__zip.open(info, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as dest:
+            while True:
+                data = fileobj.read(self.chunksize)
+                if not len(data):
+                    break
+                dest.write(data)
+                yield from self.__writer.drain()
+        yield from self.__writer.drain()
+
+    def member(self, document, fetched):
+        """Add the content of a Member to the archive and to the manifest.
+
+        :param document: Member.
+        :type document: dict
+        :param fetched: Result of :func:`fetchmember` or the exception raised.
+        :type fetched: tuple or Exception
+        :returns: Generator of the chunks of the archive.
+        """
+        entry = {'_id': document['_id'], 'location': downloadurl(document)}
+        self.entries.append(entry)
+        if isinstance(fetched, Exception):
+            entry['error'] = str(fetched)
+            return
+
+        fileobj, size = fetched
+        try:
+            name = self.entryname(document)
+            yield from self.add(name, fileobj, size)
+        finally:
+            fileobj.close()
+        entry['name'] = name
+        entry['size'] = size
+
+    def finish(self, collid):
+        """Add the manifest and close the archive.
+
+        :param collid: Collection ID.
+        :type collid: str
+        :returns: Generator of the last chunks of the archive.
+        """
+        failed = len([e for e in self.entries if 'error' in e])
+        manifest = dumpb({'collection': collid,
+                          'members': self.entries,
+                          'failed': failed})
+        yield from self.add(manifestName, io.BytesIO(manifest), len(manifest))
+
+        if self.format == 'tar':
+            # Two empty blocks and padding to a whole record
+            end = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+            remainder = (self.__offset + len(end)) % tarfile.RECORDSIZE
+            if remainder:
+                end += tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+            yield self.__tarchunk(end)
+            return
+
+        self.__zip.close()
+        yield from self.__writer.drain()
+
+
+def archivechunks(documents, builder, executor, workers, options, collid, cache=None):
+    """Generate an archive with the content of a list of Members.
+
+    The Members are fetched by the executor, at most workers of them ahead of
+    the one being sent, and added to the archive in the order of the list.
+
+    :param documents: Members in the order of the archive.
+    :type documents: iterable
+    :param builder: Archive.
+    :type builder: :class:`~ArchiveBuilder`
+    :param executor: Pool of threads fetching the Members.
+    :type executor: concurrent.futures.Executor
+    :param workers: Number of Members fetched in advance.
+    :type workers: int
+    :param options: Options of the download (see :func:`fetchmember`).
+    :type options: dict
+    :param collid: Collection ID.
+    :type collid: str
+    :param cache: Cache of the content of the Members.
+    :type cache: :class:`~datacoll.dccache.ContentCache`
+    :returns: Generator of the chunks of the archive.
+    """
+    window = deque()
+    try:
+        for document in documents:
+            window.append((document, executor.submit(fetchmember, document, options,
+                                                          cache)))
+            if len(window) > workers:
+                document, future = window.popleft()
+                yield from builder.member(document, outcome(future))
+
+        while len(window):
+            document, future = window.popleft()
+            yield from builder.member(document, outcome(future))
+    finally:
+        # The client closed the connection. The pending files are removed.
+        for document, future in window:
+            future.cancel()
+            future.add_done_callback(discard)
+
+    yield from builder.finish(collid)
+
+
+def outcome(future):
+    """Wait for a fetch and return its result or the exception raised."""
+    try:
+        return future.result()
+    except Exception as e:
+        return e
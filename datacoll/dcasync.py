@@ -0,0 +1,1059 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - asynchronous serving mode
+
+The same API as :mod:`datacoll.datacoll` is served by an asyncio event loop
+(aiohttp) instead of the thread pool of CherryPy. The data are read with the
+asyncio driver of pymongo (see :mod:`datacoll.dcasyncmongo`), or with a
+synchronous backend running in a pool of threads (see :class:`ThreadedStore`).
+Both front ends read the requests and build the responses with
+:mod:`datacoll.dcrequest`, so only the glue with aiohttp is here.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import asyncio
+import logging
+import importlib
+import argparse
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datacoll import __version__ as version
+from datacoll.dcbase import engines
+from datacoll.dcbase import loadengine
+from datacoll.dcbase import readconfig
+from datacoll.dcbase import CollectionFull
+from datacoll.dccompress import compress
+from datacoll.dccompress import compressoptions
+from datacoll.dccompress import compressibleTypes
+from datacoll.dccompress import compressor
+from datacoll.dccompress import codedetag
+from datacoll.dccompress import negotiate
+from datacoll.dccache import cachekey
+from datacoll.dccache import contentcache
+from datacoll.dccache import contenttype
+from datacoll.dcarchive import archiveFormats
+from datacoll.dcarchive import ArchiveBuilder
+from datacoll.dcarchive import discard
+from datacoll.dcarchive import fetchmember
+from datacoll.dcproxy import canproxy
+from datacoll.dcproxy import downloadoptions
+from datacoll.dcproxy import downloadurl
+from datacoll.dcproxy import forwarded
+from datacoll.dcproxy import relayed
+from datacoll.dcproxy import relayStatus
+from datacoll.dcjson import dumpb
+from datacoll.dcjson import setserializer
+from datacoll.dcformat import jsontype
+from datacoll.dcformat import canonicaltype
+from datacoll.dcformat import selectformat
+from datacoll.dcformat import encode
+from datacoll.dcformat import decode
+from datacoll.dcformat import addvary
+from datacoll.dcmodel import indexField
+from datacoll.dcmodel import isordered
+from datacoll.dcmodel import setindex
+from datacoll.dcrequest import RequestError
+from datacoll.dcrequest import archiveformat
+from datacoll.dcrequest import beforedocuments
+from datacoll.dcrequest import checkid
+from datacoll.dcrequest import checkmatch
+from datacoll.dcrequest import collcapabilities
+from datacoll.dcrequest import collectionetag
+from datacoll.dcrequest import collstats
+from datacoll.dcrequest import downloadetag
+from datacoll.dcrequest import errorbody
+from datacoll.dcrequest import etagmatches
+from datacoll.dcrequest import features
+from datacoll.dcrequest import getprojection
+from datacoll.dcrequest import insertedresult
+from datacoll.dcrequest import memberetag
+from datacoll.dcrequest import membersetag
+from datacoll.dcrequest import memberspage
+from datacoll.dcrequest import opsoptions
+from datacoll.dcrequest import orderedinsert
+from datacoll.dcrequest import pagination
+from datacoll.dcrequest import readmembers
+from datacoll.dcrequest import representationetag
+
+try:
+    import aiohttp
+    from aiohttp import web
+    from aiohttp.web_protocol import RequestPayloadError
+except ImportError:
+    web = None
+
+
+class ThreadedPage(object):
+    """Read a page of a synchronous backend in batches from a pool of threads."""
+
+    def __init__(self, store, page):
+        """Constructor of the page.
+
+        :param store: Store running the page.
+        :type store: :class:`~ThreadedStore`
+        :param page: Page of a synchronous backend with a fetchone method.
+        :type page: :class:`~datacoll.dcbase.PageBase`
+        """
+        self.store = store
+        self.page = page
+        self.next_cursor = None
+        self.__buffer = list()
+        self.__finished = False
+
+    def __fill(self):
+        """Read the next batch of documents from the synchronous page."""
+        batch = list()
+        while len(batch) < self.store.batchsize:
+            document = self.page.fetchone()
+            if document is None:
+                self.__finished = True
+                break
+            batch.append(document)
+        return batch
+
+    async def fetchone(self):
+        """Retrieve the next document like a cursor.
+
+        :returns: The next document or None if the page is finished.
+        :rtype: dict
+        """
+        if not len(self.__buffer) and not self.__finished:
+            self.__buffer = await self.store.run(self.__fill)
+            self.__buffer.reverse()
+
+        if not len(self.__buffer):
+            self.next_cursor = getattr(self.page, 'next_cursor', None)
+            return None
+        return self.__buffer.pop()
+
+
+class ThreadedStore(object):
+    """Run a synchronous backend (e.g. :mod:`datacoll.dcmongo`) in a pool of threads.
+
+    The event loop is never blocked by the backend, but the number of
+    concurrent operations on the DB is limited by the number of threads.
+    """
+
+    def __init__(self, backend, conn, batchsize=100, deletebatch=1000, workers=None,
+                 readconn=None):
+        """Constructor of the store.
+
+        :param backend: Module with the classes Collection, Collections,
+            Member and Members.
+        :type backend: module
+        :param conn: Connection passed to the classes of the backend.
+        :type conn: object
+        :param batchsize: Number of documents of a list read in each thread call.
+        :type batchsize: int
+        :param deletebatch: Number of Members removed in each operation when
+            a Collection is deleted.
+        :type deletebatch: int
+        :param workers: Number of threads of the pool.
+        :type workers: int
+        :param readconn: Connection of the requests which only read documents.
+            By default conn is used.
+        :type readconn: object
+        """
+        self.backend = backend
+        self.conn = conn
+        self.readconn = conn if readconn is None else readconn
+        self.batchsize = batchsize
+        self.deletebatch = deletebatch
+        self.executor = ThreadPoolExecutor(workers)
+        # Cache of the Collections of the backend or None
+        self.collectioncache = backend.collectionCache
+
+    async def run(self, func, *args, **kwargs):
+        """Run a function in the pool of threads and wait for the result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(func, *args, **kwargs))
+
+    async def collections(self, limit=None, cursor=None, sort=None, fields=None):
+        page = await self.run(self.backend.Collections, self.readconn, limit=limit,
+                              cursor=cursor, sort=sort, batchsize=self.batchsize,
+                              fields=fields)
+        return ThreadedPage(self, page)
+
+    async def getcollection(self, collid, fields=None, primary=False):
+        conn = self.conn if primary else self.readconn
+        coll = await self.run(self.backend.Collection, conn, collid, fields=fields)
+        return coll.document, coll.version
+
+    async def insertcollection(self, collid, document):
+        def insert():
+            coll = self.backend.Collection(self.conn, collid, fetch=False)
+            coll.insert(document)
+            return coll.document, coll.version
+        return await self.run(insert)
+
+    async def updatecollection(self, collid, document):
+        def update():
+            coll = self.backend.Collection(self.conn, collid, fetch=False)
+            coll.update(document)
+            return coll.document, coll.version
+        return await self.run(update)
+
+    async def deletecollection(self, collid, progress=None):
+        coll = self.backend.Collection(self.conn, collid, fetch=False)
+        return await self.run(coll.delete, batchsize=self.deletebatch, progress=progress)
+
+    async def insertmembers(self, collid, documents, ordered=True):
+        coll = self.backend.Collection(self.conn, collid, fetch=False)
+        return await self.run(coll.insertmembers, documents, ordered=ordered)
+
+    async def counters(self, collid):
+        coll = self.backend.Collection(self.conn, collid, fetch=False)
+        return await self.run(coll.counters)
+
+    async def keysbefore(self, collid, memberid, count=1):
+        coll = self.backend.Collection(self.conn, collid, fetch=False)
+        return await self.run(coll.keysbefore, memberid, count)
+
+    async def findmatch(self, collid, document):
+        coll = self.backend.Collection(self.readconn, collid, fetch=False)
+        page = await self.run(coll.findmatch, document, batchsize=self.batchsize)
+        return ThreadedPage(self, page)
+
+    async def intersection(self, collid, otherid, field='checksum'):
+        coll = self.backend.Collection(self.readconn, collid, fetch=False)
+        page = await self.run(coll.intersection, otherid, field, batchsize=self.batchsize)
+        return ThreadedPage(self, page)
+
+    async def union(self, collid, otherid, field='checksum'):
+        coll = self.backend.Collection(self.readconn, collid, fetch=False)
+        page = await self.run(coll.union, otherid, field, batchsize=self.batchsize)
+        return ThreadedPage(self, page)
+
+    async def flatten(self, collid, depth=4):
+        coll = self.backend.Collection(self.readconn, collid, fetch=False)
+        page = await self.run(coll.flatten, depth, batchsize=self.batchsize)
+        return ThreadedPage(self, page)
+
+    async def members(self, collid, limit=None, cursor=None, sort=None, fields=None,
+                      filters=None):
+        page = await self.run(self.backend.Members, self.readconn, collid, limit=limit,
+                              cursor=cursor, sort=sort, batchsize=self.batchsize,
+                              fields=fields, filters=filters)
+        return ThreadedPage(self, page), page.mversion
+
+    async def getmember(self, collid, memberid, fields=None):
+        member = await self.run(self.backend.Member, self.readconn, collid, memberid,
+                                fields=fields)
+        return member.document, member.version
+
+    async def insertmember(self, collid, memberid, document):
+        def insert():
+            member = self.backend.Member(self.conn, collid, memberid, fetch=False)
+            member.insert(document)
+            return member.document, member.version
+        return await self.run(insert)
+
+    async def updatemember(self, collid, memberid, document):
+        def update():
+            member = self.backend.Member(self.conn, collid, memberid, fetch=False)
+            member.update(document)
+            return member.document, member.version
+        return await self.run(update)
+
+    async def deletemember(self, collid, memberid):
+        member = self.backend.Member(self.conn, collid, memberid, fetch=False)
+        await self.run(member.delete)
+
+
+def httperror(cls, message, **kwargs):
+    """Build an HTTP error of aiohttp with a message in JSON format.
+
+    :param cls: Class of the error (e.g. web.HTTPNotFound).
+    :type cls: type
+    :param message: Description of the error.
+    :type message: str
+    :returns: The error to be raised.
+    :rtype: aiohttp.web.HTTPException
+    """
+    return cls(text=errorbody(message),
+               content_type='application/json', **kwargs)
+
+
+def jsonresponse(document, status=200, reason=None, etag=None):
+    """Build a response with a document in JSON format."""
+    headers = {'ETag': etag} if etag is not None else None
+    return web.Response(body=dumpb(document), status=status,
+                        reason=reason, headers=headers,
+                        content_type='application/json')
+
+
+def documentresponse(request, document, status=200, reason=None, etag=None):
+    """Build a response with a document in the format requested by the client."""
+    mediatype = selectformat(request.headers.get('Accept'))
+    headers = {'Vary': 'Accept'}
+    if etag is not None:
+        headers['ETag'] = representationetag(etag, request.headers.get('Accept'))
+    return web.Response(body=encode(document, mediatype), status=status,
+                        reason=reason, headers=headers, content_type=mediatype)
+
+
+def checketag(request, etag):
+    """Check the conditions of the request against the ETag of the response.
+
+    :param request: Request received.
+    :type request: aiohttp.web.Request
+    :param etag: Quoted entity tag of the representation to send.
+    :type etag: str
+    :raises: aiohttp.web.HTTPNotModified
+    """
+    # The tag includes the format and the content coding negotiated for the response
+    etag = representationetag(etag, request.headers.get('Accept'), request.get('contentcoding'))
+    if etagmatches(request.headers.get('If-None-Match'), etag):
+        raise web.HTTPNotModified(headers={'ETag': etag})
+
+
+async def readbody(request):
+    """Read the body of the request.
+
+    aiohttp decompresses the bodies with a Content-Encoding and rejects the
+    ones larger than the client_max_size of the application.
+
+    :param request: Request received.
+    :type request: aiohttp.web.Request
+    :returns: The decompressed body.
+    :rtype: bytes
+    :raises: aiohttp.web.HTTPBadRequest, aiohttp.web.HTTPRequestEntityTooLarge
+    """
+    try:
+        return await request.read()
+    except web.HTTPRequestEntityTooLarge:
+        maxsize = request.app['maxbodysize']
+        raise httperror(web.HTTPRequestEntityTooLarge,
+                        'Decompressed body is larger than %d bytes' % maxsize,
+                        max_size=maxsize)
+    except RequestPayloadError:
+        raise httperror(web.HTTPBadRequest, 'Body is not valid %s data'
+                        % request.headers.get('Content-Encoding'))
+
+
+async def readdocument(request):
+    """Read a document from the body of the request in the format of its Content-Type.
+
+    :param request: Request received.
+    :type request: aiohttp.web.Request
+    :returns: A document or a list of documents.
+    :rtype: object
+    :raises: ValueError, aiohttp.web.HTTPException
+    """
+    return decode(await readbody(request), canonicaltype(request.content_type))
+
+
+def compressmiddleware(codings, level=6, minsize=1024):
+    """Create a middleware which compresses the JSON responses.
+
+    The coding negotiated is kept in request['contentcoding'], so that the
+    ETag and the streamed lists (see :meth:`AsyncAPI.stream`) can use it.
+
+    :param codings: Content codings enabled in the preferred order.
+    :type codings: tuple
+    :param level: Compression level.
+    :type level: int
+    :param minsize: Minimum size in bytes of a body to compress it.
+    :type minsize: int
+    :returns: The middleware.
+    :rtype: function
+    """
+    @web.middleware
+    async def compression(request, handler):
+        request['contentcoding'] = negotiate(request.headers.get('Accept-Encoding'), codings)
+        request['compresslevel'] = level
+        response = await handler(request)
+
+        # Streamed responses were already compressed while they were sent
+        if response.prepared or response.content_type not in compressibleTypes:
+            return response
+
+        # Caches must keep a version for each coding
+        addvary(response.headers, 'Accept-Encoding')
+
+        coding = request['contentcoding']
+        if coding is None or response.status not in (200, 201):
+            return response
+
+        if 'ETag' in response.headers:
+            response.headers['ETag'] = codedetag(response.headers['ETag'], coding)
+        if response.body is None or len(response.body) < minsize:
+            return response
+        response.body = compress(response.body, coding, level)
+        response.headers['Content-Encoding'] = coding
+        return response
+
+    return compression
+
+
+@web.middleware
+async def requesterrors(request, handler):
+    """Send the errors of an invalid request (see RequestError) in JSON format."""
+    try:
+        return await handler(request)
+    except RequestError as e:
+        return web.Response(text=errorbody(str(e)), status=e.status,
+                            content_type='application/json')
+
+
+def getkwargs(request):
+    """Return the parameters of the query like CherryPy does.
+
+    Repeated parameters are returned as a list.
+    """
+    kwargs = dict()
+    for key in request.query.keys():
+        values = request.query.getall(key)
+        kwargs[key] = values if len(values) > 1 else values[0]
+    return kwargs
+
+
+async def jsonchunks(objlist, flushsize=65536):
+    """Generate the JSON version of a page like :class:`~datacoll.dcformat.JSONFactory`.
+
+    :param objlist: Page with an asynchronous fetchone method.
+    :type objlist: :class:`~AsyncPagedCursor`
+    :param flushsize: Minimum size in bytes of the chunks sent to the client.
+    :type flushsize: int
+    """
+    chunk = [b'{"contents":[']
+    size = 0
+    first = True
+    while True:
+        reg = await objlist.fetchone()
+        if reg is None:
+            break
+
+        tosend = dumpb(reg)
+        if not first:
+            # Send a separator before the record
+            chunk.append(b',')
+        first = False
+        chunk.append(tosend)
+        size += len(tosend)
+
+        if size >= flushsize:
+            yield b''.join(chunk)
+            chunk = list()
+            size = 0
+
+    # There are no records, close the list and add the cursor
+    chunk.append(b'],"next_cursor":%s}' % dumpb(objlist.next_cursor))
+    yield b''.join(chunk)
+
+
+class AsyncAPI(object):
+    """Handlers of the Data Collection API for the asynchronous serving mode."""
+
+    def __init__(self, store, config):
+        """Constructor of the API.
+
+        :param store: Storage of the Collections and Members.
+        :type store: :class:`~datacoll.dcasyncmongo.AsyncMongoStore` or :class:`~ThreadedStore`
+        :param config: Configuration of the service.
+        :type config: configparser.RawConfigParser
+        """
+        self.store = store
+        # Default and maximum number of items returned in one page of a list
+        self.limit = config.getint('mongo', 'limit', fallback=500)
+        # Minimum size in bytes of the chunks streamed to the client
+        self.flushsize = config.getint('Service', 'flushsize', fallback=65536)
+        # Redirect to the content of the Members or stream it (see dcproxy)
+        self.downloadoptions = downloadoptions(config)
+        # Client of the upstream servers, created in the event loop
+        self.session = None
+        # Threads fetching the content of the Members of the archives
+        self.fetchpool = ThreadPoolExecutor(max_workers=self.downloadoptions['fetchworkers'])
+        # Content of the Members fetched by the service (see dccache) or None
+        self.contentcache = contentcache(self.downloadoptions)
+
+    async def client(self):
+        """Return the HTTP client used to proxy the content of the Members."""
+        if self.session is None:
+            timeout = self.downloadoptions['timeout']
+            # The content is relayed as received from the upstream server
+            self.session = aiohttp.ClientSession(auto_decompress=False,
+                                                 timeout=aiohttp.ClientTimeout(total=None,
+                                                                               sock_connect=timeout,
+                                                                               sock_read=timeout))
+        return self.session
+
+    async def close(self, app):
+        """Close the HTTP client and the fetching threads when the application is stopped."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        self.fetchpool.shutdown(wait=False, cancel_futures=True)
+
+    async def stream(self, request, objlist, etag=None):
+        """Send a page of documents while they are read from the store.
+
+        Binary formats need the size of the whole page, so the page is read
+        before it is sent.
+        """
+        if selectformat(request.headers.get('Accept')) != jsontype:
+            contents = list()
+            while True:
+                reg = await objlist.fetchone()
+                if reg is None:
+                    break
+                contents.append(reg)
+            return documentresponse(request, {'contents': contents,
+                                              'next_cursor': objlist.next_cursor},
+                                    etag=etag)
+
+        response = web.StreamResponse()
+        response.content_type = 'application/json'
+        coding = request.get('contentcoding')
+        if etag is not None:
+            response.headers['ETag'] = codedetag(etag, coding)
+        comp = None
+        response.headers['Vary'] = 'Accept'
+        if 'contentcoding' in request:
+            # Caches must keep a version for each coding
+            addvary(response.headers, 'Accept-Encoding')
+        if coding is not None:
+            # Each chunk is flushed, so that the client can decode it at once
+            comp = compressor(coding, request['compresslevel'])
+            response.headers['Content-Encoding'] = coding
+        await response.prepare(request)
+        try:
+            async for chunk in jsonchunks(objlist, self.flushsize):
+                if comp is not None:
+                    chunk = comp.compress(chunk) + comp.flush()
+                await response.write(chunk)
+            if comp is not None:
+                await response.write(comp.finish())
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client closed the connection before reading the whole list
+            pass
+        return response
+
+    async def index(self, request):
+        return web.Response(text='<body><h1>Data Collections Service</h1></body>.',
+                            content_type='text/html')
+
+    async def version(self, request):
+        return web.Response(text=version, content_type='text/plain')
+
+    async def features(self, request):
+        return jsonresponse(features)
+
+    async def stats(self, request):
+        result = dict()
+        if self.store.collectioncache is not None:
+            result['collectionCache'] = self.store.collectioncache.stats()
+        if self.contentcache is not None:
+            result['contentCache'] = self.contentcache.stats()
+        return jsonresponse(result)
+
+    async def capabilities(self, request):
+        collid = request.match_info['collid']
+        try:
+            document, docversion = await self.store.getcollection(collid)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection ID %s not found' % collid)
+
+        return documentresponse(request, collcapabilities(document))
+
+    async def collstats(self, request):
+        collid = request.match_info['collid']
+        try:
+            document, docversion = await self.store.getcollection(collid)
+            count, size = await self.store.counters(collid)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection ID %s not found' % collid)
+
+        return documentresponse(request, collstats(document, count, size))
+
+    async def getcollection(self, request):
+        collid = request.match_info.get('collid')
+        kwargs = getkwargs(request)
+        fields = getprojection(kwargs)
+
+        if collid is None:
+            pagesize, cursor, sort = pagination(kwargs, self.limit)
+            try:
+                colls = await self.store.collections(limit=pagesize, cursor=cursor,
+                                                     sort=sort, fields=fields)
+            except Exception as e:
+                raise httperror(web.HTTPBadRequest, str(e))
+            return await self.stream(request, colls)
+
+        try:
+            document, docversion = await self.store.getcollection(collid, fields)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection ID %s not found' % collid)
+
+        etag = collectionetag(collid, docversion, kwargs.get('fields'))
+        checketag(request, etag)
+        return documentresponse(request, document, etag=etag)
+
+    async def postcollection(self, request):
+        collid = request.match_info.get('collid')
+        try:
+            jsoncoll = await readdocument(request)
+        except ValueError:
+            raise httperror(web.HTTPBadRequest, 'Invalid JSON document')
+
+        # An existing Collection with the same ID makes the insert fail
+        try:
+            document, docversion = await self.store.insertcollection(collid, jsoncoll)
+        except Exception:
+            raise httperror(web.HTTPBadRequest, 'Collection could not be inserted')
+
+        collid = str(document['_id'])
+        return documentresponse(request, document, status=201,
+                                reason='Collection %s created' % collid,
+                                etag=collectionetag(collid, docversion))
+
+    async def putcollection(self, request):
+        collid = request.match_info['collid']
+        try:
+            jsoncoll = await readdocument(request)
+        except ValueError:
+            raise httperror(web.HTTPBadRequest, 'Invalid JSON document')
+
+        checkid(jsoncoll, collid, 'Collection')
+
+        try:
+            document, docversion = await self.store.updatecollection(collid, jsoncoll)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection ID %s not found' % collid)
+
+        return documentresponse(request, document, etag=collectionetag(collid, docversion))
+
+    async def deletecollection(self, request):
+        collid = request.match_info['collid']
+        try:
+            await self.store.deletecollection(collid)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection ID %s not found' % collid)
+
+        return web.Response(text='')
+
+    async def getmember(self, request):
+        collid = request.match_info['collid']
+        memberid = request.match_info.get('memberid')
+        kwargs = getkwargs(request)
+        fields = getprojection(kwargs)
+
+        if memberid is None:
+            try:
+                coll, collversion = await self.store.getcollection(collid)
+            except Exception:
+                raise httperror(web.HTTPNotFound, 'Collection %s not found' % collid)
+
+            pagesize, cursor, sort, filters = memberspage(kwargs, self.limit, coll)
+
+            try:
+                memblist, mversion = await self.store.members(collid, limit=pagesize,
+                                                              cursor=cursor, sort=sort,
+                                                              fields=fields,
+                                                              filters=filters)
+            except Exception:
+                raise httperror(web.HTTPNotFound, 'Collection %s not found' % collid)
+
+            # The list changes only if the members of the collection change
+            etag = membersetag(collid, mversion, kwargs, sort)
+            checketag(request, etag)
+            return await self.stream(request, memblist, etag)
+
+        try:
+            document, docversion = await self.store.getmember(collid, memberid, fields)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Member %s or Collection %s not found'
+                            % (memberid, collid))
+
+        etag = memberetag(collid, memberid, docversion, kwargs.get('fields'))
+        checketag(request, etag)
+        return documentresponse(request, document, etag=etag)
+
+    async def postmember(self, request):
+        collid = request.match_info['collid']
+        memberid = request.match_info.get('memberid')
+        kwargs = getkwargs(request)
+        jsonmemb = readmembers(await readbody(request), request.content_type)
+
+        try:
+            coll, collversion = await self.store.getcollection(collid, primary=True)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection %s not found!' % collid)
+
+        # Members inserted in the middle of an ordered collection take the
+        # positions between the given member and the previous one
+        if kwargs.get('before') is not None:
+            documents = beforedocuments(coll, collid, jsonmemb)
+            try:
+                keys = await self.store.keysbefore(collid, kwargs['before'], len(documents))
+            except Exception as e:
+                raise httperror(web.HTTPBadRequest, str(e))
+            for document, key in zip(documents, keys):
+                setindex(document, key)
+
+        if isinstance(jsonmemb, list):
+            inserted, errors = await self.store.insertmembers(collid, jsonmemb,
+                                                              ordered=orderedinsert(kwargs))
+            status, reason, result = insertedresult(inserted, errors)
+            return documentresponse(request, result, status=status, reason=reason)
+
+        try:
+            document, docversion = await self.store.insertmember(collid, memberid,
+                                                                 jsonmemb)
+        except CollectionFull as e:
+            raise httperror(web.HTTPConflict, str(e))
+        except Exception:
+            raise httperror(web.HTTPBadRequest, 'Member could not be inserted')
+
+        memberid = str(document['_id'])
+        return documentresponse(request, document, status=201,
+                                reason='Member created (%s)' % memberid,
+                                etag=memberetag(collid, memberid, docversion))
+
+    async def putmember(self, request):
+        collid = request.match_info['collid']
+        memberid = request.match_info['memberid']
+        try:
+            jsonmemb = await readdocument(request)
+        except ValueError:
+            raise httperror(web.HTTPBadRequest, 'Member is not a valid JSON document')
+
+        checkid(jsonmemb, memberid, 'Member')
+
+        try:
+            document, docversion = await self.store.updatemember(collid, memberid,
+                                                                 jsonmemb)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Member %s from Collection %s not found!'
+                            % (memberid, collid))
+
+        return documentresponse(request, document,
+                                etag=memberetag(collid, memberid, docversion))
+
+    async def deletemember(self, request):
+        collid = request.match_info['collid']
+        memberid = request.match_info['memberid']
+        try:
+            await self.store.deletemember(collid, memberid)
+        except Exception:
+            raise httperror(web.HTTPNotFound,
+                            'Member ID %s within collection ID %s not found'
+                            % (memberid, collid))
+
+        return web.Response(text='')
+
+    async def findmatch(self, request):
+        collid = request.match_info['collid']
+        try:
+            document = await readdocument(request)
+        except ValueError:
+            raise httperror(web.HTTPBadRequest, 'Invalid JSON document')
+        checkmatch(document)
+
+        try:
+            result = await self.store.findmatch(collid, document)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection %s not found' % collid)
+        return await self.stream(request, result)
+
+    async def intersection(self, request):
+        collid = request.match_info['collid']
+        otherid = request.match_info['otherid']
+        field, depth = opsoptions(getkwargs(request))
+        try:
+            result = await self.store.intersection(collid, otherid, field)
+        except Exception:
+            raise httperror(web.HTTPNotFound,
+                            'Collection %s or %s not found' % (collid, otherid))
+        return await self.stream(request, result)
+
+    async def union(self, request):
+        collid = request.match_info['collid']
+        otherid = request.match_info['otherid']
+        field, depth = opsoptions(getkwargs(request))
+        try:
+            result = await self.store.union(collid, otherid, field)
+        except Exception:
+            raise httperror(web.HTTPNotFound,
+                            'Collection %s or %s not found' % (collid, otherid))
+        return await self.stream(request, result)
+
+    async def flatten(self, request):
+        collid = request.match_info['collid']
+        field, depth = opsoptions(getkwargs(request))
+        try:
+            result = await self.store.flatten(collid, depth)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection %s not found' % collid)
+        return await self.stream(request, result)
+
+    async def collarchive(self, request):
+        """Send an archive with the content of all Members of a Collection.
+
+        See :func:`datacoll.dcarchive.archivechunks`. The Members are fetched
+        by the threads of fetchpool and the archive is built in the default
+        executor, so that no file is read in the event loop.
+        """
+        collid = request.match_info['collid']
+        fmt = archiveformat(getkwargs(request))
+
+        try:
+            coll, version = await self.store.getcollection(collid)
+            # Members of an ordered Collection are added by their position
+            page, mversion = await self.store.members(collid, sort=indexField if isordered(coll)
+                                                      else None)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Collection ID %s not found' % collid)
+
+        options = self.downloadoptions
+        builder = ArchiveBuilder(fmt, options['chunksize'])
+        loop = asyncio.get_running_loop()
+
+        async def send(chunks):
+            while True:
+                chunk = await loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                await response.write(chunk)
+
+        response = web.StreamResponse(headers={'Content-Type': archiveFormats[fmt],
+                                               'Content-Disposition': 'attachment; filename="%s.%s"'
+                                               % (collid, fmt)})
+        await response.prepare(request)
+        window = deque()
+        try:
+            while True:
+                document = await page.fetchone()
+                if document is not None:
+                    window.append((document, self.fetchpool.submit(fetchmember, document,
+                                                                   options, self.contentcache)))
+                    if len(window) <= options['fetchworkers']:
+                        continue
+                if not len(window):
+                    break
+
+                document, future = window.popleft()
+                try:
+                    fetched = await asyncio.wrap_future(future)
+                except Exception as e:
+                    fetched = e
+                await send(builder.member(document, fetched))
+
+            await send(builder.finish(collid))
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client closed the connection before reading the whole archive
+            pass
+        finally:
+            for document, future in window:
+                future.cancel()
+                future.add_done_callback(discard)
+        return response
+
+    async def download(self, request):
+        collid = request.match_info['collid']
+        memberid = request.match_info['memberid']
+        try:
+            document, docversion = await self.store.getmember(collid, memberid)
+        except Exception:
+            raise httperror(web.HTTPNotFound, 'Member %s or Collection %s not found'
+                            % (memberid, collid))
+
+        url = downloadurl(document)
+        if url is None:
+            raise httperror(web.HTTPNotFound, 'Member %s has no location' % memberid)
+
+        options = self.downloadoptions
+        if options['mode'] == 'redirect' or not canproxy(url):
+            # The location changes only if the Member is updated
+            etag = downloadetag(collid, memberid, docversion)
+            # The redirection has no format nor content coding
+            if etagmatches(request.headers.get('If-None-Match'), etag):
+                raise web.HTTPNotModified(headers={'ETag': etag})
+            raise web.HTTPTemporaryRedirect(url, headers={'ETag': etag,
+                                                          'Cache-Control': 'public, max-age=%d'
+                                                          % options['maxage']})
+
+        key = cachekey(document) if self.contentcache is not None else None
+        if key is not None and request.method == 'GET':
+            loop = asyncio.get_running_loop()
+            try:
+                # Concurrent requests of the same content wait in the threads
+                path = await loop.run_in_executor(None, self.contentcache.fetch, key, url,
+                                                  document['checksum'])
+            except Exception as e:
+                # e.g. the checksum does not match. The content is proxied.
+                logging.warning('Member %s not cached: %s' % (memberid, e))
+            else:
+                # The file is not removed from the cache until it is sent
+                try:
+                    response = web.FileResponse(path, chunk_size=options['chunksize'],
+                                                headers={'Content-Type': contenttype(document,
+                                                                                     url)})
+                    await response.prepare(request)
+                    return response
+                finally:
+                    self.contentcache.release(key)
+
+        # The event loop serves other requests while the content is transferred
+        session = await self.client()
+        try:
+            upstream = await session.request(request.method, url,
+                                             headers=forwarded(request.headers))
+        except Exception as e:
+            raise httperror(web.HTTPBadGateway, 'Content of member %s could not be retrieved: %s'
+                            % (memberid, e))
+
+        try:
+            if upstream.status not in relayStatus:
+                raise httperror(web.HTTPBadGateway, '%s returned the error %d'
+                                % (url, upstream.status))
+
+            # The content is sent as received, also a part of it (206)
+            response = web.StreamResponse(status=upstream.status, headers=relayed(upstream.headers))
+            await response.prepare(request)
+            try:
+                async for chunk in upstream.content.iter_chunked(options['chunksize']):
+                    await response.write(chunk)
+                await response.write_eof()
+            except ConnectionResetError:
+                # The client closed the connection before reading the whole content
+                pass
+            return response
+        finally:
+            upstream.release()
+
+    async def properties(self, request):
+        # TODO Implement properties method
+        return web.Response(text='Not implemented!')
+
+
+def makeapp(store, config, prefix='/rda/datacoll'):
+    """Create the aiohttp application serving the Data Collection API.
+
+    :param store: Storage of the Collections and Members.
+    :type store: :class:`~datacoll.dcasyncmongo.AsyncMongoStore` or :class:`~ThreadedStore`
+    :param config: Configuration of the service.
+    :type config: configparser.RawConfigParser
+    :param prefix: Path where the API is mounted.
+    :type prefix: str
+    :returns: The application.
+    :rtype: aiohttp.web.Application
+    """
+    if web is None:
+        raise Exception('The asynchronous serving mode requires aiohttp')
+
+    api = AsyncAPI(store, config)
+    colls = prefix + '/collections'
+    coll = colls + '/{collid}'
+    membs = coll + '/members'
+    memb = membs + '/{memberid}'
+
+    # Responses are compressed if any content coding is enabled
+    options = compressoptions(config)
+    middlewares = list()
+    if len(options['codings']):
+        middlewares.append(compressmiddleware(**options))
+    # Errors of the invalid requests are sent in JSON format
+    middlewares.append(requesterrors)
+
+    # Maximum size in bytes of a request body after decompressing it
+    maxbodysize = config.getint('Service', 'maxbodysize', fallback=104857600)
+    app = web.Application(middlewares=middlewares, client_max_size=maxbodysize)
+    app['maxbodysize'] = maxbodysize
+    app.add_routes([web.get(prefix, api.index),
+                    web.get(prefix + '/', api.index),
+                    web.get(prefix + '/version', api.version),
+                    web.get(prefix + '/features', api.features),
+                    web.get(prefix + '/stats', api.stats),
+                    web.get(colls, api.getcollection),
+                    web.post(colls, api.postcollection),
+                    web.get(coll, api.getcollection),
+                    web.post(coll, api.postcollection),
+                    web.put(coll, api.putcollection),
+                    web.delete(coll, api.deletecollection),
+                    web.get(coll + '/capabilities', api.capabilities),
+                    web.get(coll + '/stats', api.collstats),
+                    web.post(coll + '/ops/findMatch', api.findmatch),
+                    web.get(coll + '/ops/intersection/{otherid}', api.intersection),
+                    web.get(coll + '/ops/union/{otherid}', api.union),
+                    web.get(coll + '/ops/flatten', api.flatten),
+                    web.get(coll + '/download', api.collarchive),
+                    web.get(membs, api.getmember),
+                    web.post(membs, api.postmember),
+                    web.get(memb, api.getmember),
+                    web.post(memb, api.postmember),
+                    web.put(memb, api.putmember),
+                    web.delete(memb, api.deletemember),
+                    web.get(memb + '/download', api.download),
+                    web.get(memb + '/properties', api.properties)])
+    app.on_cleanup.append(api.close)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data Collection Service with an asyncio event loop')
+    parser.add_argument('-c', '--config', default=None,
+                        help='Configuration file of the service')
+    parser.add_argument('-H', '--host', default='0.0.0.0',
+                        help='Address where the service listens')
+    parser.add_argument('-p', '--port', type=int, default=8080,
+                        help='Port where the service listens')
+    parser.add_argument('--threaded', action='store_true',
+                        help='Use the synchronous engine in a pool of threads also for MongoDB')
+    parser.add_argument('-V', '--version', action='version', version='%(prog)s ' + version,
+                        help='Show version information.')
+    args = parser.parse_args()
+
+    config = readconfig(args.config)
+
+    # Startup tasks are done with the synchronous engine before serving
+    engine = loadengine(config)
+    syncconn = engine.connect(config)
+    if config.getboolean('mongo', 'ensureindexes', fallback=False):
+        engine.ensureindexes(syncconn)
+        # Counters of Members of the Collections created by a previous version
+        engine.recount(syncconn)
+
+    # Size and time to live of the cache of collections
+    if engine.collectionCache is not None:
+        engine.collectionCache.size = config.getint('cache', 'size', fallback=1000)
+        engine.collectionCache.ttl = config.getfloat('cache', 'ttl', fallback=60)
+    # JSON library used to serialize the responses
+    setserializer(config.get('Service', 'serializer', fallback='auto'))
+    warmids = config.get('cache', 'warm', fallback='')
+    if len(warmids.strip()):
+        engine.warmcache(syncconn, [collid.strip() for collid in warmids.split(',')])
+
+    # Only MongoDB has an asyncio driver. It is imported only if it is used.
+    if args.threaded or engine.__name__ != engines['mongo']:
+        store = ThreadedStore(engine, syncconn,
+                              batchsize=config.getint('mongo', 'batchsize', fallback=100),
+                              deletebatch=config.getint('mongo', 'deletebatch', fallback=1000),
+                              readconn=engine.readconnection(syncconn, config))
+    else:
+        store = importlib.import_module('datacoll.dcasyncmongo').AsyncMongoStore(config)
+
+    web.run_app(makeapp(store, config), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
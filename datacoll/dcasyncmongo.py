@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Storage in MongoDB with the asyncio driver of pymongo
+
+Used by the asynchronous serving mode (:mod:`datacoll.dcasync`) when the
+engine is MongoDB. It is only imported in that case, so that the other
+engines do not need pymongo. The operations on the documents are the steps
+of :mod:`datacoll.dcmongo` (see :class:`~datacoll.dcmongo.Call`), so only the
+calls to the driver are awaited here.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import inspect
+from bson.objectid import ObjectId
+from datacoll.dcmongo import aggregatesteps
+from datacoll.dcmongo import clientkwargs
+from datacoll.dcmongo import collectionCache
+from datacoll.dcmongo import collectionsteps
+from datacoll.dcmongo import counterssteps
+from datacoll.dcmongo import deletecollectionsteps
+from datacoll.dcmongo import deletemembersteps
+from datacoll.dcmongo import insertcollectionsteps
+from datacoll.dcmongo import insertmembersteps
+from datacoll.dcmongo import insertmemberssteps
+from datacoll.dcmongo import intersectionsteps
+from datacoll.dcmongo import keysbeforesteps
+from datacoll.dcmongo import matchpipeline
+from datacoll.dcmongo import membersteps
+from datacoll.dcmongo import mversionsteps
+from datacoll.dcmongo import readpreference
+from datacoll.dcmongo import updatecollectionsteps
+from datacoll.dcmongo import updatemembersteps
+from datacoll.dcmodel import encodecursor
+from datacoll.dcmodel import matchclause
+from datacoll.dcmodel import matchfield
+from datacoll.dcmodel import pagedquery
+from datacoll.dcmodel import publicfields
+from datacoll.dcmodel import subcollection
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    AsyncMongoClient = None
+
+
+class AsyncPagedCursor(object):
+    """Asynchronous version of :class:`~datacoll.dcmongo.PagedCursor`."""
+
+    def __init__(self, collection, clause, limit=None, cursor=None, sort=None,
+                 batchsize=None, fields=None):
+        """Constructor of the paged cursor.
+
+        :param collection: Mongo collection to query.
+        :type collection: pymongo.asynchronous.collection.AsyncCollection
+        :param clause: Filter of the query.
+        :type clause: dict
+        :param limit: Maximum number of documents in the page.
+        :type limit: int
+        :param cursor: Opaque token pointing to the start of the page.
+        :type cursor: str
+        :param sort: Field to sort by. A leading "-" means descending order.
+        :type sort: str
+        :param batchsize: Number of documents retrieved in each round trip.
+        :type batchsize: int
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :raise: Exception
+        """
+        self.limit = limit
+        self.sort = sort if sort is not None else '_id'
+        self.next_cursor = None
+        self.__last = None
+        self.__count = 0
+
+        clause, fields, order = pagedquery(clause, self.sort, cursor, fields)
+        self.cursor = collection.find(clause, fields).sort(order)
+        if limit:
+            self.cursor = self.cursor.limit(limit + 1)
+        if batchsize:
+            self.cursor = self.cursor.batch_size(batchsize)
+
+    async def fetchone(self):
+        """Retrieve the next document like a cursor.
+
+        :returns: The next document or None if the page is finished.
+        :rtype: dict
+        """
+        if self.next_cursor is not None:
+            return None
+
+        try:
+            document = await self.cursor.next()
+        except StopAsyncIteration:
+            return None
+
+        self.__count += 1
+        if self.limit and self.__count > self.limit:
+            # There are more documents. Point to the last one sent
+            self.next_cursor = encodecursor(self.sort, self.__last)
+            await self.cursor.close()
+            return None
+        self.__last = document
+        return document
+
+
+class AsyncResultPage(object):
+    """Asynchronous version of :class:`~datacoll.dcbase.ResultPage`."""
+
+    def __init__(self, documents):
+        """Constructor of the page.
+
+        :param documents: Asynchronous iterable of documents (e.g. a cursor).
+        :type documents: object
+        """
+        self.next_cursor = None
+        self.__documents = documents.__aiter__()
+
+    async def fetchone(self):
+        """Retrieve the next document like a cursor.
+
+        :returns: The next document or None if the result is finished.
+        :rtype: dict
+        """
+        try:
+            return await self.__documents.__anext__()
+        except StopAsyncIteration:
+            return None
+
+
+async def runsteps(conn, steps):
+    """Run the steps of an operation with the asyncio driver.
+
+    See :func:`datacoll.dcmongo.runsteps`.
+    """
+    result = None
+    error = None
+    while True:
+        try:
+            call = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as e:
+            return e.value
+
+        try:
+            result = call.bind(conn)(*call.args, **call.kwargs)
+            # The cursors are returned without waiting
+            if inspect.isawaitable(result):
+                result = await result
+            if call.listed:
+                result = [document async for document in result]
+            error = None
+        except Exception as e:
+            result = None
+            error = e
+
+
+async def chainpages(*pages):
+    """Generate the documents of several pages one after the other."""
+    for page in pages:
+        while True:
+            document = await page.fetchone()
+            if document is None:
+                break
+            yield document
+
+
+async def expandpage(readmembers, page, depth, visited):
+    """Asynchronous version of :func:`datacoll.dcmodel.expandpage`."""
+    while True:
+        document = await page.fetchone()
+        if document is None:
+            break
+
+        child = subcollection(document)
+        if child is None or depth <= 0:
+            yield document
+            continue
+        if child in visited:
+            # Its Members are already part of the result
+            continue
+
+        try:
+            childpage = await readmembers(child)
+        except Exception:
+            yield document
+            continue
+        visited.add(child)
+        async for member in expandpage(readmembers, childpage, depth - 1, visited):
+            yield member
+
+
+class AsyncMongoStore(object):
+    """Storage of the Collections and Members with the asyncio driver of MongoDB.
+
+    The documents are stored in the same way as in :mod:`datacoll.dcmongo`,
+    so both serving modes can share the same database.
+    """
+
+    def __init__(self, config):
+        """Constructor of the store.
+
+        :param config: Configuration with a [mongo] section.
+        :type config: configparser.RawConfigParser
+        :raises: Exception
+        """
+        if AsyncMongoClient is None:
+            raise Exception('The asyncio driver of MongoDB requires pymongo>=4.9')
+
+        args, kwargs = clientkwargs(config)
+        client = AsyncMongoClient(*args, **kwargs)
+        self.conn = client[config.get('mongo', 'db')]
+        # The GET requests may be served by the replicas
+        preference = readpreference(config)
+        if preference is None:
+            self.readconn = self.conn
+        else:
+            self.readconn = self.conn.with_options(read_preference=preference)
+        self.batchsize = config.getint('mongo', 'batchsize', fallback=100)
+        self.deletebatch = config.getint('mongo', 'deletebatch', fallback=1000)
+        # Shared with the synchronous engine, which also changes the Collections
+        self.collectioncache = collectionCache
+
+    async def counters(self, collid):
+        """Return the number of Members of a Collection and the sum of their sizes."""
+        return await runsteps(self.conn, counterssteps(collid))
+
+    async def keysbefore(self, collid, memberid, count=1):
+        """Return the positions of Members inserted before another one."""
+        return await runsteps(self.conn, keysbeforesteps(collid, memberid, count))
+
+    async def findmatch(self, collid, document):
+        """Return the Members with the same values as the fields of a document."""
+        page, mversion = await self.members(collid, filters=matchclause(document))
+        return page
+
+    async def intersection(self, collid, otherid, field='checksum'):
+        """Return the Members with the same value of a field in another Collection.
+
+        See :meth:`datacoll.dcmongo.Collection.intersection`.
+        """
+        return AsyncResultPage(await runsteps(self.readconn,
+                                              intersectionsteps(collid, otherid, field,
+                                                                self.batchsize)))
+
+    async def union(self, collid, otherid, field='checksum'):
+        """Return the Members of a Collection and the ones of another which are not there.
+
+        See :meth:`datacoll.dcmongo.Collection.union`.
+        """
+        matchfield(field)
+        own, mversion = await self.members(collid)
+        others, mversion = await self.members(otherid,
+                                              filters={field: {'$not': {'$type': 'string'}}})
+        notfound = await runsteps(self.readconn,
+                                  aggregatesteps(matchpipeline(otherid, collid, field,
+                                                               found=False),
+                                                 self.batchsize))
+        return AsyncResultPage(chainpages(own, AsyncResultPage(notfound), others))
+
+    async def flatten(self, collid, depth=4):
+        """Return the Members of a Collection and of the Collections it contains.
+
+        See :func:`datacoll.dcmodel.flattenmembers`.
+        """
+        async def readmembers(cid):
+            page, mversion = await self.members(cid)
+            return page
+
+        page = await readmembers(collid)
+        return AsyncResultPage(expandpage(readmembers, page, depth, {str(collid)}))
+
+    async def collections(self, limit=None, cursor=None, sort=None, fields=None):
+        """Return one page of the list of Collections."""
+        return AsyncPagedCursor(self.readconn.Collection, dict(), limit, cursor, sort,
+                                self.batchsize, fields)
+
+    async def getcollection(self, collid, fields=None, primary=False):
+        """Return the document of a Collection and its version.
+
+        With primary, the document is read from the primary, like in the
+        requests which modify the Collection or its Members.
+        """
+        document = await runsteps(self.conn if primary else self.readconn,
+                                  collectionsteps(collid, fields))
+        return publicfields(document), document.get('_version', 0)
+
+    async def insertcollection(self, collid, document):
+        """Insert a Collection and return its document and version."""
+        return await runsteps(self.conn, insertcollectionsteps(collid, document)), 0
+
+    async def updatecollection(self, collid, document):
+        """Update a Collection and return its new document and version."""
+        auxdoc = await runsteps(self.conn, updatecollectionsteps(collid, document))
+        return publicfields(auxdoc), auxdoc.get('_version', 0)
+
+    async def deletecollection(self, collid, progress=None):
+        """Delete a Collection and its Members in batches.
+
+        :returns: Number of Members deleted.
+        :rtype: int
+        :raises: Exception
+        """
+        return await runsteps(self.conn, deletecollectionsteps(collid, self.deletebatch,
+                                                               progress))
+
+    async def insertmembers(self, collid, documents, ordered=True):
+        """Insert a list of Members with a single request.
+
+        :returns: IDs of the Members inserted and errors found.
+        :rtype: tuple
+        """
+        return await runsteps(self.conn, insertmemberssteps(collid, documents, ordered))
+
+    async def members(self, collid, limit=None, cursor=None, sort=None, fields=None,
+                      filters=None):
+        """Return one page of the Members of a Collection.
+
+        :returns: The page and the counter of changes in the Members.
+        :rtype: tuple
+        :raises: Exception
+        """
+        clause = {'_collectionId': ObjectId(collid)}
+        if filters is not None:
+            clause = {'$and': [clause, filters]}
+
+        # Not cached like the Collection, as it changes with every write of Members
+        mversion = await runsteps(self.readconn, mversionsteps(collid))
+        page = AsyncPagedCursor(self.readconn.Member, clause, limit, cursor, sort,
+                                self.batchsize, fields)
+        return page, mversion
+
+    async def getmember(self, collid, memberid, fields=None):
+        """Return the document of a Member and its version."""
+        document = await runsteps(self.readconn, membersteps(collid, memberid, fields))
+        return publicfields(document), document.get('_version', 0)
+
+    async def insertmember(self, collid, memberid, document):
+        """Insert a Member and return its document and version."""
+        return await runsteps(self.conn, insertmembersteps(collid, memberid, document)), 0
+
+    async def updatemember(self, collid, memberid, document):
+        """Update a Member and return its new document and version."""
+        auxdoc = await runsteps(self.conn, updatemembersteps(collid, memberid, document))
+        return publicfields(auxdoc), auxdoc.get('_version', 0)
+
+    async def deletemember(self, collid, memberid):
+        """Delete a Member of a Collection."""
+        await runsteps(self.conn, deletemembersteps(collid, memberid))
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Interface of the storage backends
+
+A storage engine is a module providing:
+
+* connect(config): return the connection passed to all classes.
+* readconnection(conn, config): return the connection used by the requests
+  which only read documents (e.g. sent to the replicas of a DB).
+* ensureindexes(conn): create the indexes needed by the service.
+* warmcache(conn, collids): load the given Collections in memory.
+* collectionCache: the :class:`~datacoll.dcmodel.CollectionCache` of the
+  Collections read from the DB, or None if the engine does not need one.
+* recount(conn, collids=None): compute again the counters of Members of the
+  given Collections, or of the ones which do not have them yet.
+* Collection, Collections, Member and Members: subclasses of the abstract
+  classes defined here.
+
+The engine is selected with the option `engine` of the [Service] section in
+the configuration file (see :func:`loadengine`). The engines and the front
+ends share the functions handling the documents, filters and cursors of
+:mod:`datacoll.dcmodel`, so only the module of the engine selected (and its
+driver) is imported.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import importlib
+import configparser
+from abc import ABC
+from abc import abstractmethod
+from datacoll.dcproxy import downloadurl
+
+# Modules implementing each storage engine
+engines = {
+           'mongo': 'datacoll.dcmongo',
+           'memory': 'datacoll.dcmemory',
+           'sqlite': 'datacoll.dcsqlite'
+          }
+
+# Configuration file in the directory of the package
+cfgfile = 'datacoll.cfg'
+
+
+def readconfig(path=None):
+    """Read the configuration of the service.
+
+    :param path: Configuration file. By default, datacoll.cfg in the
+        directory of this module.
+    :type path: str
+    :returns: The configuration read.
+    :rtype: configparser.RawConfigParser
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(__file__), cfgfile)
+    config = configparser.RawConfigParser()
+    config.read(path)
+    return config
+
+
+def loadengine(config):
+    """Import the storage engine selected in the configuration.
+
+    :param config: Configuration of the service.
+    :type config: configparser.RawConfigParser
+    :returns: The module of the engine.
+    :rtype: module
+    :raises: Exception
+    """
+    name = config.get('Service', 'engine', fallback='mongo')
+    if name not in engines:
+        raise Exception('Unknown storage engine %s' % name)
+    return importlib.import_module(engines[name])
+
+
+class CollectionFull(Exception):
+    """A Member cannot be inserted because the Collection reached its maxLength."""
+
+
+class PageBase(ABC):
+    """One page of a sorted list of documents.
+
+    The page is read with :meth:`fetchone` or by iterating over it. When it
+    is finished, :attr:`next_cursor` points to the next page or is None if
+    this was the last one.
+    """
+
+    next_cursor = None
+
+    def __iter__(self):
+        """Iterative method."""
+        return self
+
+    def __next__(self):
+        """Return the next document of the page.
+
+        :raises: StopIteration
+        """
+        document = self.fetchone()
+        if document is None:
+            raise StopIteration
+        return document
+
+    @abstractmethod
+    def fetchone(self):
+        """Retrieve the next document like a cursor.
+
+        :returns: The next document or None if the page is finished.
+        :rtype: dict
+        """
+
+
+class ResultPage(PageBase):
+    """Documents generated by an operation on Collections (e.g. an intersection).
+
+    The whole result is sent in a single page while it is generated, so
+    :attr:`next_cursor` is always None.
+    """
+
+    def __init__(self, documents):
+        """Constructor of the page.
+
+        :param documents: Iterable of documents (e.g. a cursor of the DB).
+        :type documents: iterable
+        """
+        self.__documents = iter(documents)
+
+    def fetchone(self):
+        """Retrieve the next document like a cursor.
+
+        :returns: The next document or None if the result is finished.
+        :rtype: dict
+        """
+        return next(self.__documents, None)
+
+
+class CollectionsBase(PageBase):
+    """List of Collections.
+
+    The constructor receives (conn, limit=None, cursor=None, sort=None,
+    batchsize=None, fields=None).
+    """
+
+
+class MembersBase(PageBase):
+    """List of the Members of a Collection.
+
+    The constructor receives (conn, collid, limit=None, cursor=None,
+    sort=None, batchsize=None, fields=None, filters=None) and raises an
+    Exception if the Collection does not exist.
+
+    :ivar mversion: Counter of changes in the Members when the list was read.
+    """
+
+    mversion = 0
+
+
+class CollectionBase(ABC):
+    """A Collection.
+
+    The constructor receives (conn, collid=None, fields=None, fetch=True).
+    Without ID it creates an empty Collection to be inserted. Otherwise the
+    document is read, unless fetch is False, and an Exception is raised if it
+    does not exist.
+
+    :ivar _id: ID of the Collection as a string.
+    :ivar document: Public fields of the Collection.
+    :ivar version: Number of updates of the document.
+    """
+
+    @abstractmethod
+    def insert(self, document=None):
+        """Insert the Collection and return its ID as bytes."""
+
+    @abstractmethod
+    def update(self, document=None):
+        """Update the Collection keeping its new document in this object.
+
+        :raises: Exception
+        """
+
+    @abstractmethod
+    def delete(self, batchsize=1000, progress=None):
+        """Delete the Collection and its Members.
+
+        :returns: Number of Members deleted.
+        :rtype: int
+        :raises: Exception
+        """
+
+    @abstractmethod
+    def insertmembers(self, documents, ordered=True):
+        """Insert a list of Members in this Collection.
+
+        The Members which do not fit in the maxLength of the Collection are
+        reported as errors.
+
+        :returns: IDs of the Members inserted and errors found.
+        :rtype: tuple
+        """
+
+    @abstractmethod
+    def keysbefore(self, memberid, count=1):
+        """Return the positions of Members inserted before another one.
+
+        In an ordered Collection, Members without a position (mappings.index)
+        are appended at the end. The positions returned here are between the
+        ones of two Members, so that no other Member is renumbered.
+
+        :rtype: list
+        :raises: Exception
+        """
+
+    @abstractmethod
+    def counters(self):
+        """Return the number of Members and the sum of their declared sizes.
+
+        The counters are kept in the Collection and updated with every change
+        of its Members, so they are read without counting the Members.
+
+        :rtype: tuple
+        :raises: Exception
+        """
+
+    @abstractmethod
+    def findmatch(self, document, batchsize=None):
+        """Return the Members with the same values as the fields of a document.
+
+        :rtype: :class:`PageBase`
+        :raises: Exception
+        """
+
+    @abstractmethod
+    def intersection(self, otherid, field='checksum', batchsize=None):
+        """Return the Members with the same value of a field in another Collection.
+
+        Members are compared by one of the indexed fields (checksum or
+        location). The ones without that field never match.
+
+        :rtype: :class:`PageBase`
+        :raises: Exception
+        """
+
+    @abstractmethod
+    def union(self, otherid, field='checksum', batchsize=None):
+        """Return the Members of this Collection and the ones of another which are not here.
+
+        :rtype: :class:`PageBase`
+        :raises: Exception
+        """
+
+    @abstractmethod
+    def flatten(self, depth=4, batchsize=None):
+        """Return the Members of this Collection and of the Collections it contains.
+
+        :rtype: :class:`PageBase`
+        :raises: Exception
+        """
+
+
+class MemberBase(ABC):
+    """A Member of a Collection.
+
+    The constructor receives (conn, collid, memberid=None, fields=None,
+    fetch=True) and behaves like the one of :class:`CollectionBase`.
+
+    :ivar _id: ID of the Member as a string.
+    :ivar document: Public fields of the Member.
+    :ivar version: Number of updates of the document.
+    """
+
+    @abstractmethod
+    def insert(self, document=None):
+        """Insert the Member and return its ID as bytes.
+
+        :raises: CollectionFull, Exception
+        """
+
+    @abstractmethod
+    def update(self, document=None):
+        """Update the Member keeping its new document in this object.
+
+        :raises: Exception
+        """
+
+    @abstractmethod
+    def delete(self):
+        """Delete the Member.
+
+        :raises: Exception
+        """
+
+    def download(self):
+        """Return the URL of the content of the Member.
+
+        :returns: The URL resolving its PID or its location, or None.
+        :rtype: str
+        """
+        return downloadurl(self.document)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Cache in the local disk of the content of the Members
+
+The content proxied by the service is kept in a directory, with one file per
+object named after the checksum of the Member, so that Members of different
+Collections with the same checksum share it. A checksum which cannot be
+verified (see :func:`checksumdigest`) is combined with the URL of the
+content, so that it is shared only by Members with the same location. Members
+without checksum are not cached.
+
+An object is fetched completely from the upstream server into a temporary
+file, which is given its final name only when it is complete. If the
+checksum is in the form algorithm:hexdigest (e.g. md5:...) and the algorithm
+is known, the content is checked before it is kept. Concurrent requests of
+an object which is being fetched wait for that fetch instead of starting
+another one.
+
+The total size of the files is limited. The least recently used files are
+removed when a new one is added, except the ones being sent at that moment.
+The directory itself is the index of the cache, so it can be shared by all
+processes of the service and the limit applies to all of them together. The
+files being sent are locked (flock) by the process sending them, so that no
+process removes them, and the files being fetched are locked by the process
+fetching them, so that only the ones left by a process which died are removed.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import re
+import fcntl
+import hashlib
+import tempfile
+import threading
+import mimetypes
+import urllib.parse
+from datacoll.dcproxy import urlFile
+from datacoll.dcproxy import downloadurl
+
+# Names of the files of the cache (sha256 of the checksum and maybe the URL)
+keyPattern = re.compile('^[0-9a-f]{64}$')
+
+# Suffix of the files being fetched
+partSuffix = '.part'
+
+# File locked by the process removing files from the directory
+lockName = '.lock'
+
+
+def cachekey(document):
+    """Return the key of the content of a Member in the cache.
+
+    :param document: Member.
+    :type document: dict
+    :returns: The key or None if the Member has no checksum nor URL.
+    :rtype: str
+    """
+    checksum = document.get('checksum')
+    url = downloadurl(document)
+    if not isinstance(checksum, str) or not len(checksum.strip()) or url is None:
+        return None
+    verify = checksumdigest(checksum)
+    if verify is not None:
+        # The content is verified, so it can be shared by any location
+        name = '%s:%s' % verify
+    else:
+        # Otherwise the checksum of a Member cannot replace the content of another
+        name = '%s\n%s' % (checksum.strip(), url)
+    return hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+
+def checksumdigest(checksum):
+    """Split a checksum in the algorithm and the digest if they can be verified.
+
+    :param checksum: Checksum of a Member (e.g. md5:d41d8cd98f00b204e9800998ecf8427e).
+    :type checksum: str
+    :returns: The name of the algorithm in hashlib and the digest in lowercase,
+        or None if the checksum cannot be verified.
+    :rtype: tuple
+    """
+    algorithm, sep, digest = checksum.strip().partition(':')
+    algorithm = algorithm.strip().lower().replace('-', '')
+    digest = digest.strip().lower()
+    if not sep or algorithm not in hashlib.algorithms_guaranteed or algorithm.startswith('shake'):
+        return None
+    if not re.match('^[0-9a-f]+$', digest) or len(digest) != 2 * hashlib.new(algorithm).digest_size:
+        return None
+    return algorithm, digest
+
+
+def contenttype(document, url):
+    """Return the media type of the content of a Member sent from the cache."""
+    mimetype = document.get('mimetype')
+    if isinstance(mimetype, str) and len(mimetype):
+        return mimetype
+    return mimetypes.guess_type(urllib.parse.urlsplit(url).path, strict=False)[0] or \
+        'application/octet-stream'
+
+
+class ContentFill(object):
+    """Fetch of an object in progress, shared by all requests of the object."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class ContentCache(object):
+    """Cache of the content of the Members in a directory of the local disk."""
+
+    def __init__(self, directory, maxsize, chunksize=1048576, timeout=30.0):
+        """Constructor of the cache.
+
+        The files of a previous run are kept, ordered by their modification
+        time. Files of incomplete fetches are removed if no process is still
+        writing them.
+
+        :param directory: Directory of the files, maybe shared with other processes.
+        :type directory: str
+        :param maxsize: Maximum size in bytes of all files in the directory.
+        :type maxsize: int
+        :param chunksize: Size in bytes of the chunks read from the upstream server.
+        :type chunksize: int
+        :param timeout: Timeout in seconds of the connection to the upstream server.
+        :type timeout: float
+        """
+        self.directory = directory
+        self.maxsize = maxsize
+        self.chunksize = chunksize
+        self.timeout = timeout
+        # Counters of this process
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.failures = 0
+        self.evictions = 0
+        # Number and size of the files found in the last scan of the directory
+        self.entries = 0
+        self.bytes = 0
+        # Number of requests sending each file and the file locked meanwhile
+        self.__pins = dict()
+        # Fetches in progress
+        self.__fills = dict()
+        self.__lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.__dirlock = open(os.path.join(directory, lockName), 'ab')
+        with self.__lock:
+            self.__sweep()
+            self.__evict()
+
+    def path(self, key):
+        """Return the path of the file of an object."""
+        return os.path.join(self.directory, key)
+
+    def fetch(self, key, url, checksum):
+        """Return the path of the file of an object, fetching it if needed.
+
+        The file is not removed until :meth:`release` is called, so it must
+        be called once the file has been opened or sent.
+
+        :param key: Key of the object (see :func:`cachekey`).
+        :type key: str
+        :param url: URL of the content.
+        :type url: str
+        :param checksum: Checksum of the Member.
+        :type checksum: str
+        :returns: Path of the file.
+        :rtype: str
+        :raises: Exception if the object cannot be fetched or kept in the cache.
+        """
+        with self.__lock:
+            fill = self.__fills.get(key)
+            hit = fill is None and self.__pin(key)
+            if hit:
+                self.hits += 1
+            else:
+                owner = fill is None
+                if owner:
+                    fill = self.__fills[key] = ContentFill()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+
+        if hit:
+            try:
+                # The order of use is kept after a restart and seen by other processes
+                os.utime(self.path(key))
+            except OSError:
+                pass
+            return self.path(key)
+
+        if not owner:
+            fill.done.wait()
+            if fill.error is not None:
+                raise Exception(fill.error)
+            with self.__lock:
+                if not self.__pin(key):
+                    raise Exception('Object %s was removed from the cache' % key)
+            return self.path(key)
+
+        try:
+            part = self.__fill(key, url, checksum)
+            with self.__lock:
+                self.__publish(key, part)
+        except Exception as e:
+            with self.__lock:
+                self.failures += 1
+                fill.error = str(e)
+                del self.__fills[key]
+            fill.done.set()
+            raise
+
+        with self.__lock:
+            del self.__fills[key]
+            self.__evict()
+        fill.done.set()
+        return self.path(key)
+
+    def release(self, key):
+        """Allow the file of an object to be removed (see :meth:`fetch`)."""
+        with self.__lock:
+            pin = self.__pins.get(key)
+            if pin is None:
+                return
+            pin[0] -= 1
+            if pin[0] > 0:
+                return
+            del self.__pins[key]
+            pin[1].close()
+            # The cap may have been exceeded while the file was pinned
+            if self.bytes > self.maxsize:
+                self.__evict()
+
+    def __pin(self, key):
+        """Lock the file of an object while it is sent and return whether it exists."""
+        pin = self.__pins.get(key)
+        if pin is not None:
+            pin[0] += 1
+            return True
+        try:
+            fileobj = open(self.path(key), 'rb')
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fileobj, fcntl.LOCK_SH)
+            # It may have been removed by another process before it was locked
+            if not os.path.samestat(os.fstat(fileobj.fileno()), os.stat(self.path(key))):
+                raise FileNotFoundError(self.path(key))
+        except OSError:
+            fileobj.close()
+            return False
+        self.__pins[key] = [1, fileobj]
+        return True
+
+    def __fill(self, key, url, checksum):
+        """Fetch an object into a temporary file and return it open and locked."""
+        upstream = urlFile(url, {'Accept-Encoding': 'identity'}, self.chunksize,
+                           self.timeout).open()
+        if upstream.status != 200:
+            upstream.response.close()
+            raise Exception('%s returned the status %d' % (url, upstream.status))
+        length = upstream.headers.get('Content-Length')
+        if length is not None and length.isdigit() and int(length) > self.maxsize:
+            upstream.response.close()
+            raise Exception('%s is larger than the cache' % url)
+
+        verify = checksumdigest(checksum)
+        digest = hashlib.new(verify[0]) if verify is not None else None
+        part = tempfile.NamedTemporaryFile(dir=self.directory, prefix=key, suffix=partSuffix,
+                                           delete=False)
+        try:
+            # The file is not removed by other processes while it is written
+            fcntl.flock(part, fcntl.LOCK_EX)
+            size = 0
+            for chunk in upstream:
+                size += len(chunk)
+                if size > self.maxsize:
+                    raise Exception('%s is larger than the cache' % url)
+                part.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+            if digest is not None and digest.hexdigest() != verify[1]:
+                raise Exception('Content of %s does not match its checksum' % url)
+            part.flush()
+        except Exception:
+            part.close()
+            os.remove(part.name)
+            raise
+        return part
+
+    def __publish(self, key, part):
+        """Give its final name to the file of an object, which stays pinned.
+
+        If another process fetched the object meanwhile, its file is kept, as
+        it may be being sent.
+        """
+        fcntl.flock(self.__dirlock, fcntl.LOCK_EX)
+        try:
+            try:
+                # The object is visible only when it is complete
+                os.link(part.name, self.path(key))
+            except FileExistsError:
+                part.close()
+                os.remove(part.name)
+                if not self.__pin(key):
+                    raise Exception('Object %s was removed from the cache' % key)
+                return
+            os.remove(part.name)
+            # No process removes it until it is released
+            fcntl.flock(part, fcntl.LOCK_SH)
+        except Exception:
+            part.close()
+            if os.path.exists(part.name):
+                os.remove(part.name)
+            raise
+        finally:
+            fcntl.flock(self.__dirlock, fcntl.LOCK_UN)
+        self.__pins[key] = [1, part]
+
+    def __sweep(self):
+        """Remove the files of the fetches which were interrupted."""
+        fcntl.flock(self.__dirlock, fcntl.LOCK_EX)
+        try:
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith(partSuffix):
+                    continue
+                try:
+                    with open(entry.path, 'rb') as part:
+                        # The process fetching it keeps it locked until it ends
+                        fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+        finally:
+            fcntl.flock(self.__dirlock, fcntl.LOCK_UN)
+
+    def __evict(self):
+        """Remove the least recently used files until the cap is respected.
+
+        The directory is read again, so that the files added and removed by
+        other processes are considered.
+        """
+        fcntl.flock(self.__dirlock, fcntl.LOCK_EX)
+        try:
+            found = list()
+            for entry in os.scandir(self.directory):
+                if not keyPattern.match(entry.name):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+            self.entries = len(found)
+            self.bytes = sum(size for mtime, key, size in found)
+
+            for mtime, key, size in sorted(found):
+                if self.bytes <= self.maxsize:
+                    break
+                try:
+                    with open(self.path(key), 'rb') as fileobj:
+                        # The files being sent by any process are locked
+                        fcntl.flock(fileobj, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.remove(self.path(key))
+                    self.evictions += 1
+                except BlockingIOError:
+                    continue
+                except FileNotFoundError:
+                    pass
+                self.entries -= 1
+                self.bytes -= size
+        finally:
+            fcntl.flock(self.__dirlock, fcntl.LOCK_UN)
+
+    def stats(self):
+        """Return the counters of this process and the size of the whole cache."""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'failures': self.failures,
+                'evictions': self.evictions,
+                'entries': self.entries,
+                'bytes': self.bytes,
+                'maxsize': self.maxsize}
+
+
+def contentcache(options):
+    """Create the cache of the content of the Members if it is configured.
+
+    It is used whenever the service fetches the content, i.e. the downloads in
+    proxy mode and the archives of the Collections.
+
+    :param options: Options of the download (see
+        :func:`~datacoll.dcproxy.downloadoptions`).
+    :type options: dict
+    :returns: The cache or None.
+    :rtype: :class:`~ContentCache`
+    """
+    if not len(options['cachedir']):
+        return None
+    return ContentCache(options['cachedir'], options['cachesize'], options['chunksize'],
+                        options['timeout'])
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Compression of the request and response bodies
+
+The content codings gzip and deflate are always available. zstd is available
+if the zstandard package is installed.
+
+Responses are compressed with the coding preferred by the server among the
+ones accepted by the client (Accept-Encoding). Lists are compressed while
+they are streamed: each chunk is flushed, so that the client can decode it
+as soon as it arrives. Request bodies with a Content-Encoding are
+decompressed up to a maximum size.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import io
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Content codings supported in the preferred order of the server
+codings = ('zstd', 'gzip', 'deflate') if zstandard is not None else ('gzip', 'deflate')
+
+# Media types of the responses which are compressed
+compressibleTypes = ('application/json', 'application/x-ndjson', 'application/ndjson',
+                     'application/bson', 'application/msgpack')
+
+
+def compressoptions(config):
+    """Read the options of the compression of the responses.
+
+    :param config: Configuration of the service.
+    :type config: configparser.RawConfigParser
+    :returns: Content codings enabled in the preferred order, compression
+        level and minimum size in bytes of a body to compress it.
+    :rtype: dict
+    """
+    enabled = config.get('Service', 'compression', fallback=', '.join(codings))
+    enabled = tuple(coding.strip().lower() for coding in enabled.split(',') if coding.strip())
+    for coding in enabled:
+        if coding not in codings:
+            raise Exception('Content coding %s is not available' % coding)
+    return {'codings': enabled,
+            'level': config.getint('Service', 'compresslevel', fallback=6),
+            'minsize': config.getint('Service', 'compressminsize', fallback=1024)}
+
+
+class ZlibCompressor(object):
+    """Compressor of the gzip and deflate content codings."""
+
+    def __init__(self, coding, level):
+        # gzip has a gzip header while deflate is the zlib format (RFC 9110)
+        wbits = 16 + zlib.MAX_WBITS if coding == 'gzip' else zlib.MAX_WBITS
+        self.compressobj = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+    def compress(self, data):
+        return self.compressobj.compress(data)
+
+    def flush(self):
+        """Return the pending data so that it can be decoded by the client."""
+        return self.compressobj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressobj.flush(zlib.Z_FINISH)
+
+
+class ZstdCompressor(object):
+    """Compressor of the zstd content coding."""
+
+    def __init__(self, coding, level):
+        self.compressobj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressobj.compress(data)
+
+    def flush(self):
+        """Return the pending data so that it can be decoded by the client."""
+        return self.compressobj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self.compressobj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def compressor(coding, level=6):
+    """Create a compressor of a content coding.
+
+    :param coding: Content coding (e.g. gzip).
+    :type coding: str
+    :param level: Compression level.
+    :type level: int
+    :returns: Object with the methods compress, flush and finish.
+    :rtype: object
+    """
+    if coding == 'zstd':
+        return ZstdCompressor(coding, level)
+    return ZlibCompressor(coding, level)
+
+
+def negotiate(acceptencoding, accepted=codings):
+    """Select the content coding of a response.
+
+    :param acceptencoding: Value of the Accept-Encoding header of the request.
+    :type acceptencoding: str
+    :param accepted: Content codings enabled in the server in the preferred order.
+    :type accepted: tuple
+    :returns: The content coding or None to send the response uncompressed.
+    :rtype: str
+    """
+    if not acceptencoding:
+        return None
+
+    qvalues = dict()
+    for item in acceptencoding.split(','):
+        params = item.strip().split(';')
+        coding = params[0].strip().lower()
+        qvalue = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[coding] = qvalue
+
+    # The client preference is respected and the server one breaks the ties
+    best = None
+    for coding in accepted:
+        if coding not in codings:
+            continue
+        qvalue = qvalues.get(coding, qvalues.get('*', 0.0))
+        if qvalue > 0 and (best is None or qvalue > best[1]):
+            best = (coding, qvalue)
+    return best[0] if best is not None else None
+
+
+def compress(data, coding, level=6):
+    """Compress a whole body.
+
+    :param data: Body to compress.
+    :type data: bytes
+    :param coding: Content coding.
+    :type coding: str
+    :param level: Compression level.
+    :type level: int
+    :returns: The compressed body.
+    :rtype: bytes
+    """
+    comp = compressor(coding, level)
+    return comp.compress(data) + comp.finish()
+
+
+def compressiter(chunks, coding, level=6):
+    """Compress a body while it is streamed.
+
+    :param chunks: Chunks of the body.
+    :type chunks: iterable
+    :param coding: Content coding.
+    :type coding: str
+    :param level: Compression level.
+    :type level: int
+    :returns: Generator of compressed chunks.
+    :rtype: generator
+    """
+    comp = compressor(coding, level)
+    for chunk in chunks:
+        data = comp.compress(chunk) + comp.flush()
+        if len(data):
+            yield data
+    yield comp.finish()
+
+
+def codedetag(etag, coding):
+    """Return the entity tag of the representation in a content coding.
+
+    The same document compressed with different codings is a different
+    representation, so its strong entity tag must be different too.
+
+    :param etag: Quoted entity tag of the uncompressed representation.
+    :type etag: str
+    :param coding: Content coding or None.
+    :type coding: str
+    :returns: Quoted entity tag.
+    :rtype: str
+    """
+    if coding is None or etag.endswith('-%s"' % coding):
+        return etag
+    return '%s-%s"' % (etag[:-1], coding)
+
+
+def decompress(data, coding, maxsize):
+    """Decompress the body of a request.
+
+    :param data: Body received.
+    :type data: bytes
+    :param coding: Value of the Content-Encoding header. Several codings can
+        be given in the order they were applied.
+    :type coding: str
+    :param maxsize: Maximum size in bytes of the decompressed body.
+    :type maxsize: int
+    :returns: The decompressed body.
+    :rtype: bytes
+    :raises: LookupError if the coding is not supported, ValueError if the
+        body is not valid and OverflowError if it is larger than maxsize.
+    """
+    applied = [c.strip().lower() for c in (coding or '').split(',') if c.strip()]
+    for current in reversed(applied):
+        if current == 'identity':
+            continue
+        if current not in codings:
+            raise LookupError('Content-Encoding %s is not supported' % current)
+
+        try:
+            if current == 'zstd':
+                # Stop as soon as the limit is exceeded
+                reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+                parts = list()
+                size = 0
+                while size <= maxsize:
+                    part = reader.read(65536)
+                    if not len(part):
+                        break
+                    parts.append(part)
+                    size += len(part)
+                data = b''.join(parts)
+            else:
+                # gzip and zlib headers are detected automatically
+                decomp = zlib.decompressobj(32 + zlib.MAX_WBITS)
+                # Stop as soon as the limit is exceeded
+                data = decomp.decompress(data, maxsize + 1)
+                if not decomp.eof and not decomp.unconsumed_tail:
+                    raise ValueError('Body in %s format is truncated' % current)
+        except (zlib.error, getattr(zstandard, 'ZstdError', zlib.error)) as e:
+            raise ValueError('Body is not valid %s data: %s' % (current, e))
+
+        if len(data) > maxsize:
+            raise OverflowError('Decompressed body is larger than %d bytes' % maxsize)
+    return data
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Formats of the request and response bodies
+
+Documents are exchanged in JSON by default. Clients can also request BSON
+(application/bson) or, if the msgpack package is installed, MessagePack
+(application/msgpack) with the Accept header, and send their bodies in the
+same format with the Content-Type header.
+
+BSON keeps the types of the documents read from MongoDB (ObjectId, datetime),
+so they are encoded without any conversion. A list is sent as one document
+with the same structure as in JSON ({"contents": [...], "next_cursor": ...}).
+A request body in BSON can contain several documents one after the other,
+which are read as a list (e.g. many Members).
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import json
+import bson
+from datacoll.dcjson import default
+from datacoll.dcjson import dumpb
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+jsontype = 'application/json'
+bsontype = 'application/bson'
+msgpacktype = 'application/msgpack'
+
+# Other names used for MessagePack
+msgpackAliases = ('application/x-msgpack', 'application/vnd.msgpack')
+
+# Media types supported in the preferred order of the server
+mediatypes = (jsontype, bsontype, msgpacktype) if msgpack is not None else (jsontype, bsontype)
+
+# Suffix of the entity tags of each representation. JSON has none.
+etagSuffix = {bsontype: 'bson', msgpacktype: 'msgpack'}
+
+
+def canonicaltype(contenttype):
+    """Return the media type of a Content-Type without parameters or aliases.
+
+    :param contenttype: Value of a Content-Type header.
+    :type contenttype: str
+    :returns: The media type in lowercase.
+    :rtype: str
+    """
+    mediatype = (contenttype or '').split(';')[0].strip().lower()
+    return msgpacktype if mediatype in msgpackAliases else mediatype
+
+
+def selectformat(accept):
+    """Select the media type of a response.
+
+    JSON is selected if the client does not send an Accept header or if it
+    does not accept any of the media types supported.
+
+    :param accept: Value of the Accept header of the request.
+    :type accept: str
+    :returns: One of the values of mediatypes.
+    :rtype: str
+    """
+    if not accept:
+        return jsontype
+
+    qvalues = dict()
+    for item in accept.split(','):
+        params = item.strip().split(';')
+        mediatype = canonicaltype(params[0])
+        qvalue = 1.0
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        qvalues[mediatype] = max(qvalue, qvalues.get(mediatype, 0.0))
+
+    # Wildcards only match JSON, so that binary formats must be explicitly requested
+    wildcard = max(qvalues.get('*/*', 0.0), qvalues.get('application/*', 0.0))
+    best = (jsontype, qvalues.get(jsontype, wildcard))
+    for mediatype in mediatypes[1:]:
+        if qvalues.get(mediatype, 0.0) > best[1]:
+            best = (mediatype, qvalues[mediatype])
+    return best[0]
+
+
+def encode(document, mediatype):
+    """Serialize a document in a media type.
+
+    :param document: Document to serialize.
+    :type document: dict
+    :param mediatype: One of the values of mediatypes.
+    :type mediatype: str
+    :returns: The serialized document.
+    :rtype: bytes
+    """
+    if mediatype == bsontype:
+        return bson.encode(document)
+    if mediatype == msgpacktype:
+        # ObjectId and datetime are sent as in JSON
+        return msgpack.packb(document, default=default, use_bin_type=True)
+    return dumpb(document)
+
+
+def decode(body, mediatype):
+    """Read a document from a request body.
+
+    Media types which are not supported are read as JSON.
+
+    :param body: Body of the request.
+    :type body: bytes
+    :param mediatype: Media type of the body (see :func:`canonicaltype`).
+    :type mediatype: str
+    :returns: A document or a list of documents.
+    :rtype: object
+    :raises: ValueError
+    """
+    if mediatype == bsontype:
+        try:
+            documents = bson.decode_all(body)
+        except Exception as e:
+            raise ValueError('Invalid BSON document: %s' % e)
+        # Several documents one after the other are a list
+        if len(documents) == 1:
+            return documents[0]
+        return documents
+
+    if mediatype == msgpacktype and msgpack is not None:
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError('Invalid MessagePack document: %s' % e)
+
+    return json.loads(body)
+
+
+def pagedocument(objlist):
+    """Read a whole page of a list in the structure sent to the client.
+
+    :param objlist: List of objects with a fetchone method (e.g. :class:`~datacoll.dcbase.MembersBase`)
+    :type objlist: :class:`~datacoll.dcbase.PageBase`
+    :returns: Document with the items of the page and the cursor of the next one.
+    :rtype: dict
+    """
+    contents = list()
+    while True:
+        reg = objlist.fetchone()
+        if reg is None:
+            break
+        contents.append(reg)
+    return {'contents': contents, 'next_cursor': objlist.next_cursor}
+
+
+class JSONFactory(object):
+    """Iterable object which provides JSON version of different objects.
+
+     For instance, Members or Collections.
+
+    Records are grouped in chunks of at least `flushsize` bytes, so that the
+    response can be streamed to the client while the cursor is still open.
+
+    :param objlist: List of objects with a fetchone method (e.g. :class:`~datacoll.dcbase.MembersBase`)
+    :type objlist: :class:`~datacoll.dcbase.PageBase`
+    :param flushsize: Minimum size in bytes of the chunks sent to the client
+    :type flushsize: int
+    """
+
+    def __init__(self, objlist, flushsize=65536):
+        """Constructor of the JSONFactory."""
+        self.cursor = objlist
+        self.flushsize = flushsize
+        # 0: Header must be sent; 1: Send 1st collection; 2: Send more items
+        # 3: Headers have been closed and StopIteration should be raised
+        self.status = 0
+        self.content_type = 'application/json'
+
+    def __iter__(self):
+        """Iterative method."""
+        return self
+
+    def next(self):
+        """Return the next chunk of the JSON document.
+
+        Tuples are read from the cursor and returned in JSON format. A veriable
+        "status" is defined to track in which state are we. Meanings are:
+        0 = Header must be sent ('{"contents":[').
+        1 = Send 1st element.
+        2 = Send the rest of the elements.
+        3 = Headers have been closed and StopIteration should be raised.
+
+        :raises: StopIteration
+        """
+        # Headers have been closed. Raise StopIteration
+        if self.status == 3:
+            raise StopIteration
+
+        chunk = list()
+        size = 0
+
+        # Send headers
+        if self.status == 0:
+            self.status = 1
+            chunk.append(b'{"contents":[')
+
+        while size < self.flushsize:
+            # Load a record
+            reg = self.cursor.fetchone()
+
+            if reg is None:
+                # There are no records, close the list and add the cursor
+                self.status = 3
+                nextcursor = getattr(self.cursor, 'next_cursor', None)
+                chunk.append(b'],"next_cursor":%s}' % dumpb(nextcursor))
+                break
+
+            tosend = dumpb(reg)
+            if self.status == 2:
+                # Send a separator before the record
+                chunk.append(b',')
+            self.status = 2
+            chunk.append(tosend)
+            size += len(tosend)
+
+        return b''.join(chunk)
+
+    __next__ = next
+
+
+def addvary(headers, name):
+    """Add a header of the request to the Vary header of a response.
+
+    :param headers: Headers of the response.
+    :type headers: dict
+    :param name: Name of the header of the request (e.g. Accept).
+    :type name: str
+    """
+    vary = headers.get('Vary')
+    if vary is None:
+        headers['Vary'] = name
+    elif name.lower() not in [item.strip().lower() for item in vary.split(',')]:
+        headers['Vary'] = '%s, %s' % (vary, name)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Serialization of the responses in JSON format
+
+All documents sent by the service are serialized by :func:`dumps` or
+:func:`dumpb`. ObjectId are sent as strings, datetime in ISO format and bytes
+decoded as UTF-8. NaN and Infinity, which are not valid JSON, are sent as null.
+The output is compact (no spaces after separators) and UTF-8 encoded, and it
+is the same whichever serializer is used.
+
+The serializer is selected with :func:`setserializer`. `orjson` is used if it
+is installed, otherwise the json module of the standard library.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import re
+import json
+import datetime
+from bson.objectid import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(obj):
+    """Convert the objects which are not supported by JSON.
+
+    :param obj: Object found in a document.
+    :type obj: object
+    :returns: The JSON version of the object.
+    :rtype: str
+    :raises: TypeError
+    """
+    # Objects like IDs probably
+    if isinstance(obj, ObjectId):
+        return str(obj)
+
+    # Bytes to str
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+
+    # Datetime type to ISO format (str)
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+# Encoders of the standard library. They are created once and shared by all
+# calls. The second one is only used if there are NaN or Infinity.
+stdencoder = json.JSONEncoder(default=default, separators=(',', ':'), ensure_ascii=False,
+                              allow_nan=False)
+nanencoder = json.JSONEncoder(default=default, separators=(',', ':'), ensure_ascii=False)
+
+# Strings (kept as they are), NaN and Infinity, and the exponents of the floats
+# written by the standard library
+floatPattern = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*")|(-?Infinity|NaN)|e\+?(-?)0*(?=\d)')
+
+
+def orjsonfloat(match):
+    """Write a float like orjson: NaN and Infinity as null and 1e16 instead of 1e+16."""
+    if match.group(1) is not None:
+        return match.group(1)
+    if match.group(2) is not None:
+        return 'null'
+    return 'e' + match.group(3)
+
+
+def stddumpb(obj):
+    """Serialize an object with the json module of the standard library.
+
+    The floats are written like orjson does, so that the output is the same
+    with both serializers.
+    """
+    try:
+        text = stdencoder.encode(obj)
+    except ValueError:
+        text = floatPattern.sub(orjsonfloat, nanencoder.encode(obj))
+    else:
+        # Only repr writes exponents like 1e+16 or 1e-07
+        if 'e+' in text or 'e-0' in text:
+            text = floatPattern.sub(orjsonfloat, text)
+    return text.encode('utf-8')
+
+
+def orjsondumpb(obj):
+    """Serialize an object with orjson.
+
+    orjson converts datetime in the same way as datetime.isoformat. Objects it
+    does not support (e.g. integers with more than 64 bits or keys which are
+    not strings) are serialized by the standard library.
+    """
+    try:
+        return orjson.dumps(obj, default=default)
+    except TypeError:
+        return stddumpb(obj)
+
+
+# Available serializers
+serializers = {'json': stddumpb}
+if orjson is not None:
+    serializers['orjson'] = orjsondumpb
+
+# Serializer in use
+serializer = serializers.get('orjson', stddumpb)
+
+
+def setserializer(name='auto'):
+    """Select the serializer of the responses.
+
+    :param name: One of the keys of serializers or 'auto' for the fastest one
+        installed.
+    :type name: str
+    :raises: Exception
+    """
+    global serializer
+
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in serializers else 'json'
+    if name not in serializers:
+        raise Exception('Serializer %s is not available' % name)
+    serializer = serializers[name]
+
+
+def dumpb(obj):
+    """Serialize an object in JSON format encoded in UTF-8.
+
+    :param obj: Document or list of documents.
+    :type obj: object
+    :returns: The document in JSON format.
+    :rtype: bytes
+    """
+    return serializer(obj)
+
+
+def dumps(obj):
+    """Serialize an object in JSON format.
+
+    :param obj: Document or list of documents.
+    :type obj: object
+    :returns: The document in JSON format.
+    :rtype: str
+    """
+    return serializer(obj).decode('utf-8')
@@ -0,0 +1,809 @@
+#!/usr/bin/env python
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - In-memory storage engine
+
+Collections and Members are kept in dictionaries of the process, so the
+service can be run and benchmarked without a MongoDB server. Documents are
+stored as in :mod:`datacoll.dcmongo` and the same filters (built by
+:mod:`datacoll.dcmodel`) are understood.
+A delay can be added to every read and write to emulate the round trips to
+a DB server.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import re
+import copy
+import math
+import time
+import threading
+from collections import OrderedDict
+from bson import json_util
+from bson.objectid import ObjectId
+from datacoll.dcbase import PageBase
+from datacoll.dcbase import ResultPage
+from datacoll.dcbase import CollectionsBase
+from datacoll.dcbase import MembersBase
+from datacoll.dcbase import CollectionBase
+from datacoll.dcbase import MemberBase
+from datacoll.dcbase import CollectionFull
+from datacoll.dcmodel import assignindexes
+from datacoll.dcmodel import cacheProjection
+from datacoll.dcmodel import declaredsize
+from datacoll.dcmodel import encodecursor
+from datacoll.dcmodel import fullerrors
+from datacoll.dcmodel import flattenmembers
+from datacoll.dcmodel import fullmessage
+from datacoll.dcmodel import getfield
+from datacoll.dcmodel import indexrange
+from datacoll.dcmodel import insertresult
+from datacoll.dcmodel import internalprojection
+from datacoll.dcmodel import matchclause
+from datacoll.dcmodel import matchfield
+from datacoll.dcmodel import isordered
+from datacoll.dcmodel import maxlength
+from datacoll.dcmodel import memberindex
+from datacoll.dcmodel import memberdocuments
+from datacoll.dcmodel import pagedquery
+from datacoll.dcmodel import project
+from datacoll.dcmodel import publicfields
+from datacoll.dcmodel import sortBrackets
+from datacoll.dcmodel import spacedkeys
+from datacoll.dcmodel import typebracket
+
+# The documents are always read from memory. There is no cache of Collections.
+collectionCache = None
+
+class MemoryDB(object):
+    """Dictionaries with the Collections and Members of the service.
+
+    Members are indexed by the ID of their Collection. All operations on the
+    dictionaries must be done holding :attr:`lock`.
+    """
+
+    def __init__(self, readlatency=0.0, writelatency=0.0):
+        """Constructor of the DB.
+
+        :param readlatency: Seconds added to every read operation.
+        :type readlatency: float
+        :param writelatency: Seconds added to every write operation.
+        :type writelatency: float
+        """
+        self.readlatency = readlatency
+        self.writelatency = writelatency
+        self.collections = OrderedDict()
+        self.members = dict()
+        # Secondary index: Collection ID -> IDs of its Members in insertion order
+        self.bycollection = dict()
+        self.lock = threading.RLock()
+
+    def wait(self, write=False):
+        """Emulate the round trip of an operation to a DB server."""
+        delay = self.writelatency if write else self.readlatency
+        if delay > 0:
+            time.sleep(delay)
+
+    def addmember(self, document):
+        """Store a new Member and index it by its Collection.
+
+        :raises: Exception
+        """
+        if document['_id'] in self.members:
+            raise Exception('Duplicate key: Member %s already exists' % document['_id'])
+        self.members[document['_id']] = copy.deepcopy(document)
+        self.bycollection.setdefault(document['_collectionId'], OrderedDict())[document['_id']] = None
+
+    def removemember(self, memberid):
+        """Remove a Member and its entry in the index."""
+        document = self.members.pop(memberid)
+        index = self.bycollection.get(document['_collectionId'])
+        if index is not None:
+            index.pop(memberid, None)
+            if not len(index):
+                del self.bycollection[document['_collectionId']]
+
+
+def connect(config):
+    """Create an empty DB with the latency defined in the configuration.
+
+    :param config: Configuration with an optional [memory] section.
+    :type config: configparser.RawConfigParser
+    :returns: The DB of this process.
+    :rtype: :class:`~MemoryDB`
+    """
+    return MemoryDB(config.getfloat('memory', 'readlatency', fallback=0.0),
+                    config.getfloat('memory', 'writelatency', fallback=0.0))
+
+
+def readconnection(conn, config):
+    """Reads and writes share the same DB. It is returned unchanged."""
+    return conn
+
+
+def ensureindexes(conn):
+    """The index by Collection is always kept up to date. Nothing is created."""
+    return list()
+
+
+def warmcache(conn, collids):
+    """All documents are already in memory. Nothing is loaded."""
+    pass
+
+
+def touch(conn, collid, count=0, size=0):
+    """Increase the counter of changes in the Members of a Collection.
+
+    The number of Members and their bytes are increased by count and size.
+    """
+    with conn.lock:
+        document = conn.collections.get(ObjectId(collid))
+        if document is not None:
+            document['_mversion'] = document.get('_mversion', 0) + 1
+            document['_count'] = document.get('_count', 0) + count
+            document['_bytes'] = document.get('_bytes', 0) + size
+
+
+def recount(conn, collids=None):
+    """The counters are always kept with the Collections. Nothing is computed."""
+    return 0
+
+
+def positions(conn, collid, documents):
+    """Append the Members without a position at the end of an ordered Collection.
+
+    It must be called holding the lock of the DB.
+
+    :param conn: DB in memory.
+    :type conn: :class:`~MemoryDB`
+    :param collid: Collection ID.
+    :type collid: str
+    :param documents: Members to insert.
+    :type documents: list
+    """
+    coll = conn.collections[ObjectId(collid)]
+    if not isordered(coll):
+        return
+
+    if '_nextIndex' not in coll:
+        # Collections made ordered after their Members were inserted
+        indexes = [memberindex(conn.members[memberid])
+                   for memberid in conn.bycollection.get(ObjectId(collid), ())]
+        indexes = [index for index in indexes if index is not None]
+        coll['_nextIndex'] = math.floor(max(indexes)) + 1 if len(indexes) else 0
+
+    missing, minimum = indexrange(documents)
+    first = max(coll['_nextIndex'], minimum or 0)
+    assignindexes(documents, first)
+    coll['_nextIndex'] = first + missing
+
+
+def room(conn, collid, wanted):
+    """Return how many Members can still be added to a Collection.
+
+    It must be called holding the lock of the DB.
+
+    :param conn: DB in memory.
+    :type conn: :class:`~MemoryDB`
+    :param collid: Collection ID.
+    :type collid: str
+    :param wanted: Number of Members to insert.
+    :type wanted: int
+    :returns: Number of Members which fit and the maxLength (-1 if there is none).
+    :rtype: tuple
+    :raises: Exception
+    """
+    document = conn.collections.get(ObjectId(collid))
+    if document is None:
+        raise Exception('Collection %s does not exist!' % collid)
+    maxlen = maxlength(document)
+    if maxlen < 0:
+        return wanted, maxlen
+    return max(min(wanted, maxlen - document.get('_count', 0)), 0), maxlen
+
+
+# Brackets of types whose values are never compared: null, documents, arrays
+# and the types not known by the service
+uncomparable = (0, sortBrackets.index('object'), sortBrackets.index('array'), len(sortBrackets))
+
+
+def sortkey(value):
+    """Return a key to sort values of different types like MongoDB."""
+    order = typebracket(value)
+    if order in uncomparable[1:]:
+        # Documents and arrays are compared by their content
+        return order, json_util.dumps(value, sort_keys=True)
+    return order, value
+
+
+def equals(value, expected):
+    """Check a value like an equality filter of MongoDB."""
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def compare(value, op, argument):
+    """Check a value with an operator of a MongoDB filter.
+
+    :raises: Exception
+    """
+    if op == '$in':
+        return any(equals(value, arg) for arg in argument)
+    if op == '$regex':
+        return isinstance(value, str) and re.search(argument, value) is not None
+
+    if op == '$type':
+        return typebracket(value) < len(sortBrackets) and sortBrackets[typebracket(value)] == argument
+
+    # Values of different types are never compared
+    if typebracket(value) != typebracket(argument) or typebracket(value) in uncomparable:
+        return False
+    if op == '$gt':
+        return value > argument
+    if op == '$gte':
+        return value >= argument
+    if op == '$lt':
+        return value < argument
+    if op == '$lte':
+        return value <= argument
+    raise Exception('Operator %s is not supported' % op)
+
+
+def matches(document, clause):
+    """Check whether a document is selected by a MongoDB filter.
+
+    Only the operators used by the service are supported ($and, $or, $in,
+    $regex, $type, $gt, $gte, $lt and $lte).
+
+    :param document: Document to check.
+    :type document: dict
+    :param clause: Filter of the query.
+    :type clause: dict
+    :rtype: bool
+    :raises: Exception
+    """
+    for key, condition in clause.items():
+        if key == '$and':
+            if not all(matches(document, c) for c in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, c) for c in condition):
+                return False
+        elif isinstance(condition, dict) and any(k.startswith('$') for k in condition):
+            value = getfield(document, key)
+            if not all(compare(value, op, arg) for op, arg in condition.items()):
+                return False
+        elif not equals(getfield(document, key), condition):
+            return False
+    return True
+
+
+class MemoryPage(PageBase):
+    """One page of the documents selected from a dictionary of the DB."""
+
+    def __init__(self, conn, documents, clause, limit=None, cursor=None, sort=None,
+                 batchsize=None, fields=None):
+        """Constructor of the page.
+
+        :param conn: DB in memory.
+        :type conn: :class:`~MemoryDB`
+        :param documents: Candidate documents (e.g. from an index).
+        :type documents: iterable
+        :param clause: Filter of the query.
+        :type clause: dict
+        :param limit: Maximum number of documents in the page.
+        :type limit: int
+        :param cursor: Opaque token pointing to the start of the page.
+        :type cursor: str
+        :param sort: Field to sort by. A leading "-" means descending order.
+        :type sort: str
+        :param batchsize: Number of documents of each emulated round trip.
+        :type batchsize: int
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :raise: Exception
+        """
+        self.sort = sort if sort is not None else '_id'
+        self.next_cursor = None
+        self.__conn = conn
+        self.__batchsize = batchsize
+        self.__count = 0
+
+        clause, fields, order = pagedquery(clause, self.sort, cursor, fields)
+        (key, direction) = order[0]
+
+        # Ties in the sort key are broken by the _id as in MongoDB
+        selected = [doc for doc in documents if matches(doc, clause)]
+        selected.sort(key=lambda doc: (sortkey(getfield(doc, key)), sortkey(doc['_id'])),
+                      reverse=direction < 0)
+
+        self.__more = limit is not None and len(selected) > limit
+        if limit:
+            selected = selected[:limit]
+        self.__last = selected[-1] if len(selected) else None
+        self.__documents = [project(doc, fields) for doc in reversed(selected)]
+
+    def fetchone(self):
+        """Retrieve the next document like a cursor.
+
+        :returns: The next document or None if the page is finished.
+        :rtype: dict
+        """
+        if not len(self.__documents):
+            if self.__more:
+                self.next_cursor = encodecursor(self.sort, self.__last)
+            return None
+
+        # A new batch is requested to the DB
+        if self.__batchsize and self.__count and not self.__count % self.__batchsize:
+            self.__conn.wait()
+        self.__count += 1
+        return self.__documents.pop()
+
+
+class Collections(MemoryPage, CollectionsBase):
+    """List of the Collections in memory."""
+
+    def __init__(self, conn, limit=None, cursor=None, sort=None, batchsize=None,
+                 fields=None):
+        conn.wait()
+        with conn.lock:
+            super().__init__(conn, conn.collections.values(), dict(), limit, cursor,
+                             sort, batchsize, fields)
+
+
+class Members(MemoryPage, MembersBase):
+    """List of the Members of a Collection in memory."""
+
+    def __init__(self, conn, collid, limit=None, cursor=None, sort=None,
+                 batchsize=None, fields=None, filters=None):
+        conn.wait()
+        collid = ObjectId(collid)
+        with conn.lock:
+            coll = conn.collections.get(collid)
+            if coll is None:
+                raise Exception('Collection %s not found' % collid)
+            # Counter of changes in the Members when the list was read
+            self.mversion = coll.get('_mversion', 0)
+
+            # Only the Members of the Collection are read using the index
+            documents = [conn.members[memberid]
+                         for memberid in conn.bycollection.get(collid, ())]
+            super().__init__(conn, documents, filters or dict(), limit, cursor, sort,
+                             batchsize, fields)
+
+
+class Collection(CollectionBase):
+    """A Collection stored in memory."""
+
+    def __init__(self, conn, collid=None, fields=None, fetch=True):
+        """Constructor of a Collection object.
+
+        :param conn: DB in memory.
+        :type conn: :class:`~MemoryDB`
+        :param collid: Collection ID.
+        :type collid: str
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :param fetch: Read the document. If False, the Collection can only be
+            inserted with this ID, updated or deleted.
+        :type fetch: bool
+        :raises: Exception
+        """
+        self.__conn = conn
+        if collid is None:
+            self.document = dict()
+            self._id = None
+            self.version = 0
+            return
+
+        # _id must always be a str
+        self._id = collid.decode('utf-8') if isinstance(collid, bytes) else str(collid)
+
+        if not fetch:
+            self.document = None
+            self.version = None
+            return
+
+        conn.wait()
+        with conn.lock:
+            document = conn.collections.get(ObjectId(self._id))
+            if document is None:
+                raise Exception('Collection %s does not exist!' % self._id)
+            document = project(document, internalprojection(fields))
+
+        # Number of updates of the document
+        self.version = document.get('_version', 0)
+        self.document = publicfields(document)
+
+    def insert(self, document=None):
+        """Insert a new Collection.
+
+        :param document: Collection.
+        :type document: dict
+        :returns: The ID of the new Collection.
+        :rtype: bytes
+        :raise: Exception
+        """
+        if document is not None:
+            self.document = publicfields(document)
+
+        self.document['_id'] = ObjectId(self._id) if self._id is not None else ObjectId()
+
+        self.__conn.wait(write=True)
+        with self.__conn.lock:
+            if self.document['_id'] in self.__conn.collections:
+                raise Exception('Duplicate key: Collection %s already exists'
+                                % self.document['_id'])
+            # The counters of Members start with the Collection
+            self.__conn.collections[self.document['_id']] = dict(copy.deepcopy(self.document),
+                                                                 _count=0, _bytes=0)
+
+        self._id = str(self.document['_id'])
+        self.version = 0
+        return self._id.encode('utf-8')
+
+    def update(self, document=None):
+        """Update the fields passed as parameters.
+
+        :param document: Collection.
+        :type document: dict
+        :returns: The ID of the updated Collection.
+        :rtype: str
+        :raises: Exception
+        """
+        if '_id' in document and self._id != str(document['_id']):
+            raise Exception('IDs differ!')
+
+        fields = {k: v for k, v in publicfields(document).items() if k != '_id'}
+        self.__conn.wait(write=True)
+        with self.__conn.lock:
+            stored = self.__conn.collections.get(ObjectId(self._id))
+            if stored is None:
+                raise Exception('Collection %s does not exist!' % self._id)
+            stored.update(copy.deepcopy(fields))
+            stored['_version'] = stored.get('_version', 0) + 1
+            auxdoc = project(stored, cacheProjection)
+
+        self.version = auxdoc.get('_version', 0)
+        self.document = publicfields(auxdoc)
+        return self._id
+
+    def delete(self, batchsize=1000, progress=None):
+        """Delete a Collection and all its Members.
+
+        :param batchsize: Number of Members deleted in each operation.
+        :type batchsize: int
+        :param progress: Function called after each batch with the number of
+            Members deleted up to that moment.
+        :type progress: callable
+        :returns: Number of Members deleted.
+        :rtype: int
+        :raises: Exception
+        """
+        collid = ObjectId(self._id)
+        removed = 0
+        while True:
+            self.__conn.wait(write=True)
+            with self.__conn.lock:
+                ids = list(self.__conn.bycollection.get(collid, ()))[:batchsize]
+                for memberid in ids:
+                    self.__conn.removemember(memberid)
+            if not len(ids):
+                break
+
+            removed += len(ids)
+            if progress is not None:
+                progress(removed)
+
+        with self.__conn.lock:
+            deleted = self.__conn.collections.pop(collid, None)
+
+        if deleted is None:
+            raise Exception('Collection not found!')
+        self._id = None
+        self.document = None
+        return removed
+
+    def insertmembers(self, documents, ordered=True):
+        """Insert a list of Members in this Collection.
+
+        :param documents: Members to insert.
+        :type documents: list
+        :param ordered: Stop at the first error or try to insert all Members.
+        :type ordered: bool
+        :returns: IDs of the Members inserted and errors found.
+        :rtype: tuple
+        """
+        valid, errors = memberdocuments(self._id, documents, ordered)
+        if not len(valid):
+            return list(), errors
+
+        writeerrors = list()
+        count = 0
+        size = 0
+        self.__conn.wait(write=True)
+        with self.__conn.lock:
+            # Only the first Members which fit in the Collection are inserted
+            fit, maxlen = room(self.__conn, self._id, len(valid))
+            valid, errors = fullerrors(valid, errors, fit, maxlen, ordered)
+            positions(self.__conn, self._id, [doc for index, doc in valid])
+            for pos, (index, document) in enumerate(valid):
+                document.setdefault('_id', ObjectId())
+                try:
+                    self.__conn.addmember(document)
+                    count += 1
+                    size += declaredsize(document)
+                except Exception as e:
+                    writeerrors.append({'index': pos, 'errmsg': str(e)})
+                    if ordered:
+                        break
+            if count:
+                touch(self.__conn, self._id, count, size)
+
+        inserted, errors = insertresult(valid, errors, writeerrors, ordered)
+        return inserted, errors
+
+    def keysbefore(self, memberid, count=1):
+        """Return the positions of Members inserted before another one.
+
+        :param memberid: ID of the Member which must follow the new ones.
+        :type memberid: str
+        :param count: Number of positions.
+        :type count: int
+        :rtype: list
+        :raises: Exception
+        """
+        self.__conn.wait()
+        with self.__conn.lock:
+            member = self.__conn.members.get(ObjectId(memberid))
+            if member is None or member['_collectionId'] != ObjectId(self._id):
+                member = None
+            high = memberindex(member) if member is not None else None
+            if high is None:
+                raise Exception('Member %s has no position in Collection %s'
+                                % (memberid, self._id))
+            lower = [memberindex(self.__conn.members[other])
+                     for other in self.__conn.bycollection.get(ObjectId(self._id), ())]
+            lower = [index for index in lower if index is not None and index < high]
+
+        return spacedkeys(max(lower) if len(lower) else None, high, count)
+
+    def counters(self):
+        """Return the number of Members and the sum of their declared sizes.
+
+        :returns: Number of Members and bytes.
+        :rtype: tuple
+        :raises: Exception
+        """
+        self.__conn.wait()
+        with self.__conn.lock:
+            document = self.__conn.collections.get(ObjectId(self._id))
+            if document is None:
+                raise Exception('Collection %s does not exist!' % self._id)
+            return document.get('_count', 0), document.get('_bytes', 0)
+
+    def findmatch(self, document, batchsize=None):
+        """Return the Members with the same values as the fields of a document.
+
+        :param document: Member to compare with (see :func:`~datacoll.dcmodel.matchclause`).
+        :type document: dict
+        :param batchsize: Number of documents of each emulated round trip.
+        :type batchsize: int
+        :rtype: :class:`~Members`
+        :raises: Exception
+        """
+        return Members(self.__conn, self._id, batchsize=batchsize,
+                       filters=matchclause(document))
+
+    def __members(self, collid):
+        """Return the Members of a Collection. The lock must be held.
+
+        :raises: Exception
+        """
+        if ObjectId(collid) not in self.__conn.collections:
+            raise Exception('Collection %s does not exist!' % collid)
+        return [self.__conn.members[memberid]
+                for memberid in self.__conn.bycollection.get(ObjectId(collid), ())]
+
+    def intersection(self, otherid, field='checksum', batchsize=None):
+        """Return the Members with the same value of a field in another Collection.
+
+        :param otherid: ID of the other Collection.
+        :type otherid: str
+        :param field: checksum or location.
+        :type field: str
+        :param batchsize: Not used. The result is selected at once.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        matchfield(field)
+        self.__conn.wait()
+        with self.__conn.lock:
+            values = {m[field] for m in self.__members(otherid)
+                      if isinstance(m.get(field), str)}
+            selected = [copy.deepcopy(publicfields(m)) for m in self.__members(self._id)
+                        if isinstance(m.get(field), str) and m[field] in values]
+        return ResultPage(selected)
+
+    def union(self, otherid, field='checksum', batchsize=None):
+        """Return the Members of this Collection and the ones of another which are not here.
+
+        :param otherid: ID of the other Collection.
+        :type otherid: str
+        :param field: checksum or location.
+        :type field: str
+        :param batchsize: Not used. The result is selected at once.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        matchfield(field)
+        self.__conn.wait()
+        with self.__conn.lock:
+            own = self.__members(self._id)
+            values = {m[field] for m in own if isinstance(m.get(field), str)}
+            selected = own + [m for m in self.__members(otherid)
+                              if not isinstance(m.get(field), str) or m[field] not in values]
+            selected = [copy.deepcopy(publicfields(m)) for m in selected]
+        return ResultPage(selected)
+
+    def flatten(self, depth=4, batchsize=None):
+        """Return the Members of this Collection and of the Collections it contains.
+
+        :param depth: Number of levels of Collections expanded.
+        :type depth: int
+        :param batchsize: Number of documents of each emulated round trip.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        return ResultPage(flattenmembers(lambda collid: Members(self.__conn, collid,
+                                                                batchsize=batchsize),
+                                         self._id, depth))
+
+
+class Member(MemberBase):
+    """A Member of a Collection stored in memory."""
+
+    def __init__(self, conn, collid, memberid=None, fields=None, fetch=True):
+        """Constructor of the Member.
+
+        :param conn: DB in memory.
+        :type conn: :class:`~MemoryDB`
+        :param collid: Collection ID.
+        :type collid: str
+        :param memberid: Member ID.
+        :type memberid: str
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :param fetch: Read the document. If False, the Member can only be
+            inserted with this ID, updated or deleted.
+        :type fetch: bool
+        :raises: Exception
+        """
+        self.__conn = conn
+        if collid is None:
+            raise Exception('Empty collection ID!')
+
+        # _id must always be a str
+        self._collectionId = collid.decode('utf-8') if isinstance(collid, bytes) else str(collid)
+        self.document = {'_collectionId': ObjectId(self._collectionId)}
+        self.version = 0
+
+        if memberid is None:
+            self._id = None
+            return
+
+        self._id = memberid.decode('utf-8') if isinstance(memberid, bytes) else str(memberid)
+
+        if not fetch:
+            self.version = None
+            return
+
+        conn.wait()
+        with conn.lock:
+            document = self.__find()
+            if document is None:
+                raise Exception('Member %s does not exist!' % self._id)
+            document = project(document, internalprojection(fields))
+
+        # Number of updates of the document
+        self.version = document.get('_version', 0)
+        self.document = publicfields(document)
+
+    def __find(self):
+        """Return the stored document of this Member or None."""
+        document = self.__conn.members.get(ObjectId(self._id))
+        if document is None or document['_collectionId'] != ObjectId(self._collectionId):
+            return None
+        return document
+
+    def delete(self):
+        """Delete this Member.
+
+        :raises: Exception
+        """
+        self.__conn.wait(write=True)
+        with self.__conn.lock:
+            stored = self.__find()
+            if stored is None:
+                raise Exception('Member not found!')
+            self.__conn.removemember(ObjectId(self._id))
+            touch(self.__conn, self._collectionId, -1, -declaredsize(stored))
+
+        self._id = None
+        self.document = None
+
+    def insert(self, document=None):
+        """Insert this Member in its Collection.
+
+        :param document: Member.
+        :type document: dict
+        :returns: The ID of the new Member.
+        :rtype: bytes
+        :raises: Exception
+        """
+        if document is not None:
+            # Keep _collectionId in the internal document
+            self.document.update(publicfields(document))
+            self.document['_collectionId'] = ObjectId(self._collectionId)
+
+        self.document['_id'] = ObjectId(self._id) if self._id is not None else ObjectId()
+
+        self.__conn.wait(write=True)
+        with self.__conn.lock:
+            fit, maxlen = room(self.__conn, self._collectionId, 1)
+            if not fit:
+                raise CollectionFull(fullmessage(maxlen))
+            positions(self.__conn, self._collectionId, [self.document])
+            self.__conn.addmember(self.document)
+            touch(self.__conn, self._collectionId, 1, declaredsize(self.document))
+
+        self._id = str(self.document['_id'])
+        self.version = 0
+        return self._id.encode('utf-8')
+
+    def update(self, document=None):
+        """Update the fields passed as parameters.
+
+        :param document: Member.
+        :type document: dict
+        :returns: The ID of the updated Member.
+        :rtype: str
+        :raises: Exception
+        """
+        if '_id' in document and self._id != str(document['_id']):
+            raise Exception('IDs differ!')
+
+        fields = {k: v for k, v in publicfields(document).items()
+                  if k not in ('_id', '_collectionId')}
+        self.__conn.wait(write=True)
+        with self.__conn.lock:
+            stored = self.__find()
+            if stored is None:
+                raise Exception('Member %s does not exist!' % self._id)
+            before = declaredsize(stored)
+            stored.update(copy.deepcopy(fields))
+            stored['_version'] = stored.get('_version', 0) + 1
+            auxdoc = copy.deepcopy(stored)
+            touch(self.__conn, self._collectionId, 0, declaredsize(stored) - before)
+
+        self.version = auxdoc.get('_version', 0)
+        self.document = publicfields(auxdoc)
+        return self._id
@@ -0,0 +1,838 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Documents shared by the storage engines and the front ends
+
+The documents of the Collections and Members are stored in the same way by
+all storage engines, and the queries are expressed as MongoDB filters and
+projections, which the engines other than :mod:`datacoll.dcmongo` translate.
+This module builds and reads those documents, filters and cursors without
+depending on any engine, so that the service only imports the driver of the
+engine selected (see :func:`datacoll.dcbase.loadengine`).
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import re
+import copy
+import math
+import time
+import base64
+import zlib
+import hashlib
+import datetime
+import threading
+import multiprocessing
+from collections import OrderedDict
+from bson import json_util
+from bson.objectid import ObjectId
+from bson.decimal128 import Decimal128
+
+# Fields kept in the documents for the internal use of the service. _version
+# counts the updates of a document and _mversion the changes in the Members of
+# a Collection. Both are used to build the entity tags of the responses.
+# _count and _bytes are the number of Members of a Collection and the sum of
+# their declared sizes. _nextIndex is the position of the next Member appended
+# to an ordered Collection.
+internalFields = ('_version', '_mversion', '_count', '_bytes', '_nextIndex')
+
+# Projection of the Collections kept in the cache. The fields changed by the
+# Members would make the cached documents outdated at every change.
+cacheProjection = {'_mversion': 0, '_count': 0, '_bytes': 0, '_nextIndex': 0}
+
+# Field of the Members with their size in bytes
+sizeField = 'size'
+
+# Field of the Members with their position in an ordered Collection
+indexField = 'mappings.index'
+
+# Indexed fields of the Members used to compare the Members of two Collections
+matchFields = ('checksum', 'location')
+
+# Datatype of the Members which are a Collection of this service. The ID of
+# the Collection is the last part of their location.
+collectionType = 'application/vnd.rda.collection'
+
+# Valid names of fields (or subfields) which can be used in queries
+fieldPattern = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z0-9_]+)*$')
+
+# Operators allowed in the filters of a query and the Mongo operator they are
+# translated to. The prefix and in operators are handled separately.
+filterOperators = {
+                   'eq': None,
+                   'prefix': None,
+                   'in': '$in',
+                   'gt': '$gt',
+                   'gte': '$gte',
+                   'lt': '$lt',
+                   'lte': '$lte'
+                  }
+
+# Types of values in the order they are sorted by MongoDB (aliases of $type)
+sortBrackets = ('null', 'number', 'string', 'object', 'array', 'binData', 'objectId',
+                'bool', 'date')
+
+# Python types of the values of each bracket. bool must be checked before int.
+bracketTypes = ((bool, 'bool'),
+                ((int, float, Decimal128), 'number'),
+                (str, 'string'),
+                (dict, 'object'),
+                ((list, tuple), 'array'),
+                (bytes, 'binData'),
+                (ObjectId, 'objectId'),
+                (datetime.datetime, 'date'))
+
+# Types of values which cannot be used to page a list sorted by a field
+unpagedBrackets = ('object', 'array', 'binData')
+
+# Filters are the parameters of a query like f_<field> or f_<field>[<op>]
+filterPattern = re.compile(r'^f_(?P<field>[^\[\]]+)(\[(?P<op>[a-z]+)\])?$')
+
+
+def makeetag(*parts):
+    """Build a strong entity tag from the values identifying a representation.
+
+    :returns: Quoted entity tag to be sent in the ETag header.
+    :rtype: str
+    """
+    content = json_util.dumps(parts, sort_keys=True).encode('utf-8')
+    return '"%s"' % hashlib.md5(content).hexdigest()
+
+
+def declaredsize(document):
+    """Return the size in bytes declared in a Member or 0 if it is not valid.
+
+    :param document: Member.
+    :type document: dict
+    :rtype: int
+    """
+    value = document.get(sizeField)
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    return 0
+
+
+def maxlength(document):
+    """Return the maximum number of Members of a Collection or -1 if there is none.
+
+    The limit is read from the capabilities of the Collection (maxLength).
+
+    :param document: Collection.
+    :type document: dict
+    :rtype: int
+    """
+    capabilities = document.get('capabilities')
+    value = capabilities.get('maxLength') if isinstance(capabilities, dict) else None
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    return -1
+
+
+def insertedcounters(valid, inserted):
+    """Return the number and size of the Members inserted from :func:`memberdocuments`.
+
+    :param valid: Documents sent to the DB with their position in the list.
+    :type valid: list
+    :param inserted: IDs of the Members inserted.
+    :type inserted: list
+    :rtype: tuple
+    """
+    ids = set(inserted)
+    sizes = list()
+    for index, doc in valid:
+        # Only the first Member with a repeated ID is inserted
+        if str(doc['_id']) in ids:
+            ids.discard(str(doc['_id']))
+            sizes.append(declaredsize(doc))
+    return len(sizes), sum(sizes)
+
+
+def fullmessage(maxlen):
+    """Return the error of the Members which do not fit in a Collection."""
+    return 'Collection reached its maxLength of %d Members' % maxlen
+
+
+def fullerrors(valid, errors, room, maxlen, ordered=True):
+    """Keep the Members from :func:`memberdocuments` which fit in a Collection.
+
+    :param valid: Documents to insert with their position in the list.
+    :type valid: list
+    :param errors: Errors found before the insertion.
+    :type errors: list
+    :param room: Number of Members reserved (see :func:`datacoll.dcmongo.reserve`).
+    :type room: int
+    :param maxlen: Maximum number of Members of the Collection.
+    :type maxlen: int
+    :param ordered: Only the first Member which does not fit is reported.
+    :type ordered: bool
+    :returns: Documents to insert and all errors sorted by position.
+    :rtype: tuple
+    """
+    rejected = valid[room:]
+    errors = list(errors) + [{'index': index, 'message': fullmessage(maxlen)}
+                             for index, doc in (rejected[:1] if ordered else rejected)]
+    return valid[:room], sorted(errors, key=lambda e: e['index'])
+
+
+def isordered(document):
+    """Return True if the capabilities of a Collection declare it ordered."""
+    capabilities = document.get('capabilities')
+    return isinstance(capabilities, dict) and capabilities.get('isOrdered') is True
+
+
+def memberindex(document):
+    """Return the position of a Member in an ordered Collection or None.
+
+    :param document: Member.
+    :type document: dict
+    :rtype: int or float
+    """
+    value = getfield(document, indexField)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def setindex(document, value):
+    """Set the position of a Member in an ordered Collection."""
+    mappings = document.get('mappings')
+    document['mappings'] = dict(mappings if isinstance(mappings, dict) else {}, index=value)
+
+
+def spacedkeys(low, high, count=1):
+    """Return the positions of Members inserted between two others.
+
+    The positions of the other Members are not changed. Integers are used while
+    there is a gap between low and high, and fractions afterwards.
+
+    :param low: Position of the previous Member or None if there is none.
+    :type low: int or float
+    :param high: Position of the next Member.
+    :type high: int or float
+    :param count: Number of positions.
+    :type count: int
+    :returns: Sorted list of positions between low and high.
+    :rtype: list
+    :raises: Exception
+    """
+    if low is None:
+        low = math.floor(high) - count - 1
+    if isinstance(low, int) and isinstance(high, int) and high - low > count:
+        keys = [low + (high - low) * i // (count + 1) for i in range(1, count + 1)]
+    else:
+        keys = [low + (high - low) * i / (count + 1) for i in range(1, count + 1)]
+
+    if not all(a < b for a, b in zip([low] + keys, keys + [high])):
+        raise Exception('There is no position left between %s and %s' % (low, high))
+    return keys
+
+
+def assignindexes(documents, first):
+    """Append the Members without a position at the end of an ordered Collection.
+
+    :param documents: Members to insert.
+    :type documents: list
+    :param first: First position reserved (see :func:`datacoll.dcmongo.nextindex`).
+    :type first: int
+    """
+    for document in documents:
+        if memberindex(document) is None:
+            setindex(document, first)
+            first += 1
+
+
+def indexrange(documents):
+    """Return how many Members need a position and the first free one after the others.
+
+    :param documents: Members to insert.
+    :type documents: list
+    :returns: Number of Members without position and the position following
+        the largest one given, or None.
+    :rtype: tuple
+    """
+    given = [memberindex(doc) for doc in documents]
+    missing = sum(1 for index in given if index is None)
+    given = [index for index in given if index is not None]
+    return missing, math.floor(max(given)) + 1 if len(given) else None
+
+
+def publicfields(document):
+    """Return a copy of the document without the fields for internal use."""
+    return {k: v for k, v in document.items() if k not in internalFields}
+
+
+def internalprojection(fields):
+    """Add the fields for internal use to a projection of a document."""
+    if fields is None:
+        return None
+    return dict(fields, **{f: 1 for f in internalFields})
+
+
+def memberdocuments(collid, documents, ordered=True):
+    """Prepare a list of Members to be inserted in a Collection.
+
+    :param collid: Collection ID.
+    :type collid: str
+    :param documents: Members to insert.
+    :type documents: list
+    :param ordered: Stop at the first invalid Member.
+    :type ordered: bool
+    :returns: Valid documents with their position in the list and errors found.
+    :rtype: tuple
+    """
+    errors = list()
+    valid = list()
+    for index, document in enumerate(documents):
+        if not isinstance(document, dict):
+            errors.append({'index': index,
+                           'message': 'Member must be a JSON object'})
+            if ordered:
+                break
+            continue
+
+        # Keep _collectionId in the internal document
+        document = publicfields(document)
+        document['_collectionId'] = ObjectId(collid)
+        valid.append((index, document))
+    return valid, errors
+
+
+def insertresult(valid, errors, writeerrors, ordered=True):
+    """Combine the result of inserting the documents from :func:`memberdocuments`.
+
+    :param valid: Documents sent to the DB with their position in the list.
+    :type valid: list
+    :param errors: Errors found before the insertion.
+    :type errors: list
+    :param writeerrors: Errors reported by the DB in a BulkWriteError.
+    :type writeerrors: list
+    :param ordered: The insertion stopped at the first error.
+    :type ordered: bool
+    :returns: IDs of the Members inserted and all errors sorted by position.
+    :rtype: tuple
+    """
+    errors = list(errors)
+    failed = set()
+    for error in writeerrors:
+        failed.add(error['index'])
+        errors.append({'index': valid[error['index']][0],
+                       'message': error['errmsg']})
+
+    # Nothing after the first failure is inserted in an ordered insertion
+    if ordered and len(failed):
+        valid = valid[:min(failed)]
+
+    inserted = [str(doc['_id']) for pos, (index, doc) in enumerate(valid)
+                if pos not in failed]
+    return inserted, sorted(errors, key=lambda e: e['index'])
+
+
+def parsesort(sort):
+    """Split a sort specification in the field name and its direction.
+
+    :param sort: Field to sort by. A leading "-" means descending order.
+    :type sort: str
+    :returns: Field name and direction (1 or -1).
+    :rtype: tuple
+    :raises: Exception
+    """
+    if sort is None:
+        return '_id', 1
+
+    direction = -1 if sort.startswith('-') else 1
+    key = sort.lstrip('-')
+    if not fieldPattern.match(key):
+        raise Exception('Invalid sort field %s' % key)
+    return key, direction
+
+
+def projection(fields):
+    """Build a Mongo projection from a comma separated list of fields.
+
+    The _id of the documents is always included. The fields for internal use
+    (see internalFields) cannot be retrieved.
+
+    :param fields: Names of the fields to retrieve (e.g. "location,checksum").
+    :type fields: str
+    :returns: Projection to pass to find, or None to retrieve full documents.
+    :rtype: dict
+    :raises: Exception
+    """
+    if fields is None:
+        return None
+
+    result = dict()
+    for field in fields.split(','):
+        field = field.strip()
+        if not fieldPattern.match(field) or field.split('.')[0] in internalFields:
+            raise Exception('Invalid field %s' % field)
+        result[field] = 1
+
+    return result if len(result) else None
+
+
+def number(value):
+    """Convert a value from a query to a number if possible."""
+    for conv in (int, float):
+        try:
+            return conv(value)
+        except ValueError:
+            pass
+    return value
+
+
+def memberfilter(params):
+    """Build a Mongo filter from the filter parameters of a query.
+
+    Parameters like f_<field>=<value> select the Members with that value.
+    Other comparisons are expressed as f_<field>[<op>]=<value>, where op is
+    one of filterOperators. Values of "in" are separated by commas. If a
+    filter is repeated, Members matching any of the values are selected.
+    The parameters from and to select the Members of an ordered Collection
+    with from <= mappings.index < to. Other parameters are ignored.
+
+    :param params: Parameters of the query.
+    :type params: dict
+    :returns: Filter to be combined with the one from the query, or None if
+        there are no filter parameters.
+    :rtype: dict
+    :raises: Exception
+    """
+    conditions = list()
+    for name, values in params.items():
+        match = filterPattern.match(name)
+        if match is None:
+            continue
+
+        field = match.group('field')
+        op = match.group('op') or 'eq'
+        if not fieldPattern.match(field) or field == '_collectionId':
+            raise Exception('Invalid filter field %s' % field)
+        if op not in filterOperators:
+            raise Exception('Invalid filter operator %s' % op)
+
+        options = list()
+        for value in (values if isinstance(values, list) else [values]):
+            if op == 'eq':
+                # The value could have been stored as a string or a number
+                candidates = list({value, number(value)})
+                options.append({field: candidates[0]} if len(candidates) == 1
+                               else {field: {'$in': candidates}})
+            elif op == 'prefix':
+                # An anchored regular expression can use an index
+                options.append({field: {'$regex': '^%s' % re.escape(value)}})
+            elif op == 'in':
+                # Like in eq, each value could have been stored as a string or a number
+                candidates = list()
+                for item in value.split(','):
+                    candidates.extend(c for c in (item, number(item)) if c not in candidates)
+                options.append({field: {'$in': candidates}})
+            else:
+                options.append({field: {filterOperators[op]: number(value)}})
+
+        conditions.append(options[0] if len(options) == 1 else {'$or': options})
+
+    # Range of positions in an ordered Collection, which can use an index
+    bounds = dict()
+    for name, op in (('from', '$gte'), ('to', '$lt')):
+        if name in params:
+            value = number(params[name])
+            if not isinstance(value, (int, float)):
+                raise Exception('%s must be a number' % name)
+            bounds[op] = value
+    if len(bounds):
+        conditions.append({indexField: bounds})
+
+    if not len(conditions):
+        return None
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+
+def matchclause(document):
+    """Build a filter selecting the Members with the same values as a document.
+
+    Nested objects are compared field by field, so that a Member matches if
+    it has at least the values given (e.g. only some of its properties). IDs
+    and internal fields of the document are ignored.
+
+    :param document: Member to compare with.
+    :type document: dict
+    :returns: Filter to be combined with the one of the Collection.
+    :rtype: dict
+    :raises: Exception
+    """
+    if not isinstance(document, dict):
+        raise Exception('Member must be a JSON object')
+
+    clause = dict()
+    pending = [('', {k: v for k, v in document.items()
+                     if k not in ('_id', '_collectionId') + internalFields})]
+    while len(pending):
+        prefix, current = pending.pop()
+        for key, value in current.items():
+            field = prefix + key
+            if not fieldPattern.match(field):
+                raise Exception('Invalid field %s' % field)
+            if isinstance(value, dict):
+                pending.append((field + '.', value))
+            elif isinstance(value, list):
+                raise Exception('Field %s cannot be matched because it is a list' % field)
+            else:
+                clause[field] = value
+
+    if not len(clause):
+        raise Exception('No fields to match were given')
+    return clause
+
+
+def matchfield(field):
+    """Check that Members can be compared by a field.
+
+    :param field: One of matchFields.
+    :type field: str
+    :returns: The same field.
+    :rtype: str
+    :raises: Exception
+    """
+    if field not in matchFields:
+        raise Exception('Members can only be compared by %s' % ' or '.join(matchFields))
+    return field
+
+
+def subcollection(document):
+    """Return the ID of the Collection referenced by a Member.
+
+    :param document: Member.
+    :type document: dict
+    :returns: Collection ID or None if the Member is not a Collection.
+    :rtype: str
+    """
+    location = document.get('location')
+    if document.get('datatype') != collectionType or not isinstance(location, str):
+        return None
+    collid = location.rstrip('/').rsplit('/', 1)[-1]
+    return collid if ObjectId.is_valid(collid) else None
+
+
+def flattenmembers(readmembers, collid, depth):
+    """Return the Members of a Collection replacing the Collections it contains by their Members.
+
+    Collections are expanded up to depth levels. The Members referencing a
+    Collection at a deeper level or one which does not exist are returned as
+    they are. Each Collection is expanded only once, so that cycles end.
+
+    :param readmembers: Function returning a page with the Members of a
+        Collection ID. It raises an Exception if the Collection does not exist.
+    :type readmembers: callable
+    :param collid: Collection ID.
+    :type collid: str
+    :param depth: Number of levels expanded.
+    :type depth: int
+    :returns: Generator of Members.
+    :raises: Exception if the Collection does not exist.
+    """
+    return expandpage(readmembers, readmembers(collid), depth, {str(collid)})
+
+
+def expandpage(readmembers, page, depth, visited):
+    """Generator of the Members of a page expanding the Collections (see :func:`flattenmembers`)."""
+    for document in iter(page.fetchone, None):
+        child = subcollection(document)
+        if child is None or depth <= 0:
+            yield document
+            continue
+        if child in visited:
+            # Its Members are already part of the result
+            continue
+
+        try:
+            childpage = readmembers(child)
+        except Exception:
+            yield document
+            continue
+        visited.add(child)
+        yield from expandpage(readmembers, childpage, depth - 1, visited)
+
+
+def getfield(document, key):
+    """Return the value of a (possibly dotted) field from a document."""
+    value = document
+    for part in key.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def project(document, fields):
+    """Return a copy of a document with the fields of a MongoDB projection.
+
+    :param document: Document stored.
+    :type document: dict
+    :param fields: Fields to include (1) or to exclude (0), or None for all.
+    :type fields: dict
+    :rtype: dict
+    """
+    if fields is None:
+        return copy.deepcopy(document)
+
+    if not any(fields.values()):
+        return {k: copy.deepcopy(v) for k, v in document.items() if k not in fields}
+
+    result = {'_id': document['_id']}
+    for field in fields:
+        source = document
+        target = result
+        parts = field.split('.')
+        for part in parts[:-1]:
+            source = source.get(part) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(part, dict())
+        else:
+            if isinstance(source, dict) and parts[-1] in source:
+                target[parts[-1]] = copy.deepcopy(source[parts[-1]])
+    return result
+
+
+def encodecursor(sort, document):
+    """Build an opaque cursor pointing to the position after a document.
+
+    :param sort: Sort specification used to retrieve the document.
+    :type sort: str
+    :param document: Last document sent to the client.
+    :type document: dict
+    :returns: A URL-safe token.
+    :rtype: str
+    """
+    key, direction = parsesort(sort)
+    state = {'s': sort, 'i': document['_id'], 'v': getfield(document, key)}
+    token = base64.urlsafe_b64encode(json_util.dumps(state).encode('utf-8'))
+    return token.decode('ascii')
+
+
+def decodecursor(cursor):
+    """Decode a cursor created by :func:`encodecursor`.
+
+    :param cursor: Opaque token received from the client.
+    :type cursor: str
+    :returns: Dictionary with the sort specification (s), last ID (i) and
+        last value of the sort key (v).
+    :rtype: dict
+    :raises: Exception
+    """
+    try:
+        state = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        if not isinstance(state, dict) or set(state) != {'s', 'i', 'v'}:
+            raise ValueError
+    except Exception:
+        raise Exception('Invalid cursor %s' % cursor)
+    return state
+
+
+def typebracket(value):
+    """Return the position of the type of a value in the sort order of MongoDB.
+
+    :param value: Value of a field. None stands also for a missing field.
+    :returns: Index in sortBrackets or its length for other types (e.g. timestamps).
+    :rtype: int
+    """
+    if value is None:
+        return 0
+    for types, name in bracketTypes:
+        if isinstance(value, types):
+            return sortBrackets.index(name)
+    return len(sortBrackets)
+
+
+def keysetclause(sort, cursor):
+    """Build the filter selecting the documents after the cursor position.
+
+    MongoDB compares values only with values of the same type and sorts the
+    types in brackets (see sortBrackets), with the missing fields like null.
+    The filter selects the documents after the cursor in its bracket and all
+    documents in the brackets sorted after it. Fields holding documents or
+    lists cannot be used to page, as they are not compared in the same way
+    by all engines.
+
+    :param sort: Sort specification of the query.
+    :type sort: str
+    :param cursor: Opaque token received from the client.
+    :type cursor: str
+    :returns: Filter to be combined with the one from the query.
+    :rtype: dict
+    :raises: Exception
+    """
+    state = decodecursor(cursor)
+    if state['s'] != sort:
+        raise Exception('Cursor was created with a different sort order')
+
+    key, direction = parsesort(sort)
+    op = '$gt' if direction > 0 else '$lt'
+    if key == '_id':
+        return {'_id': {op: state['i']}}
+
+    value = state['v']
+    bracket = typebracket(value)
+    if bracket == len(sortBrackets) or sortBrackets[bracket] in unpagedBrackets:
+        raise Exception('List cannot be paged by %s, which holds a value of type %s'
+                        % (key, type(value).__name__))
+
+    # Ties in the sort key are broken by the unique _id. null also matches
+    # the missing fields.
+    after = [{key: value, '_id': {op: state['i']}}]
+    if bracket:
+        after.insert(0, {key: {op: value}})
+    following = range(bracket + 1, len(sortBrackets)) if direction > 0 else range(1, bracket)
+    after.extend({key: {'$type': sortBrackets[b]}} for b in following)
+    if direction < 0 and bracket:
+        after.append({key: None})
+    return {'$or': after}
+
+
+def pagedquery(clause, sort, cursor=None, fields=None):
+    """Build the query to retrieve one page of a sorted list.
+
+    :param clause: Filter of the query.
+    :type clause: dict
+    :param sort: Field to sort by. A leading "-" means descending order.
+    :type sort: str
+    :param cursor: Opaque token pointing to the start of the page.
+    :type cursor: str
+    :param fields: Projection of the fields to retrieve.
+    :type fields: dict
+    :returns: Filter, projection and sort order to pass to find.
+    :rtype: tuple
+    :raises: Exception
+    """
+    key, direction = parsesort(sort)
+    if cursor is not None:
+        clause = {'$and': [clause, keysetclause(sort, cursor)]}
+
+    order = [(key, direction)]
+    if key != '_id':
+        order.append(('_id', direction))
+
+    # The sort key is needed to build the cursor to the next page
+    if fields is not None and not any(key == f or key.startswith(f + '.') or
+                                      f.startswith(key + '.') for f in fields):
+        fields = dict(fields)
+        fields[key] = 1
+    elif fields is None:
+        fields = {f: 0 for f in internalFields}
+
+    return clause, fields, order
+
+
+class CollectionCache(object):
+    """Bounded cache of Collection documents with a time to live.
+
+    The least recently used documents are discarded when the cache is full.
+    The documents are kept by each process, but every change of a Collection
+    increases a generation kept in shared memory. The processes forked after
+    the cache was created (e.g. the workers of the service) discard their
+    copy as soon as its generation changes. Other processes only see the
+    change after the time to live has expired.
+    """
+
+    def __init__(self, size=1000, ttl=60, slots=4096):
+        """Constructor of the cache.
+
+        :param size: Maximum number of documents in the cache.
+        :type size: int
+        :param ttl: Seconds after which a document must be read again.
+        :type ttl: float
+        :param slots: Number of generations shared with the forked processes.
+        :type slots: int
+        """
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.__docs = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__generations = multiprocessing.Array('Q', slots)
+
+    def __slot(self, collid):
+        return zlib.crc32(str(collid).encode('utf-8')) % len(self.__generations)
+
+    def generation(self, collid):
+        """Return the generation of a Collection.
+
+        It must be read before the document is read from the database and
+        passed to :meth:`put`, so that a change done in between is detected.
+        """
+        return self.__generations[self.__slot(collid)]
+
+    def get(self, collid):
+        """Return a copy of the cached document or None if it is not valid."""
+        generation = self.generation(collid)
+        with self.__lock:
+            entry = self.__docs.get(collid)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != generation:
+                if entry is not None and entry[1] != generation:
+                    self.stale += 1
+                self.__docs.pop(collid, None)
+                self.misses += 1
+                return None
+
+            self.__docs.move_to_end(collid)
+            self.hits += 1
+            return copy.deepcopy(entry[2])
+
+    def put(self, collid, document, generation):
+        """Store a document in the cache discarding the oldest if needed.
+
+        :param collid: Collection ID.
+        :type collid: str
+        :param document: Collection read from the database.
+        :type document: dict
+        :param generation: Result of :meth:`generation` before the read.
+        :type generation: int
+        """
+        if self.size <= 0:
+            return
+
+        with self.__lock:
+            self.__docs[collid] = (time.monotonic() + self.ttl, generation,
+                                   copy.deepcopy(document))
+            self.__docs.move_to_end(collid)
+            while len(self.__docs) > self.size:
+                self.__docs.popitem(last=False)
+
+    def invalidate(self, collid):
+        """Remove a document from the cache of all the processes.
+
+        It must be called after the Collection has been changed.
+        """
+        with self.__lock:
+            self.__docs.pop(collid, None)
+        with self.__generations.get_lock():
+            self.__generations[self.__slot(collid)] += 1
+
+    def clear(self):
+        """Remove all documents from the cache of this process."""
+        with self.__lock:
+            self.__docs.clear()
+
+    def stats(self):
+        """Return the counters of the cache."""
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'entries': len(self.__docs),
+                'size': self.size}
@@ -19,10 +19,50 @@
 .. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
 """
 
-import json
-import urllib.request as ul
-import datetime
+import math
+import itertools
 from bson.objectid import ObjectId
+from pymongo import MongoClient
+from pymongo import ASCENDING
+from pymongo import DESCENDING
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from pymongo.read_preferences import Primary
+from pymongo.read_preferences import PrimaryPreferred
+from pymongo.read_preferences import Secondary
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo.read_preferences import Nearest
+from datacoll.dcbase import PageBase
+from datacoll.dcbase import ResultPage
+from datacoll.dcbase import CollectionFull
+from datacoll.dcbase import CollectionsBase
+from datacoll.dcbase import MembersBase
+from datacoll.dcbase import CollectionBase
+from datacoll.dcbase import MemberBase
+from datacoll.dcmodel import assignindexes
+from datacoll.dcmodel import cacheProjection
+from datacoll.dcmodel import CollectionCache
+from datacoll.dcmodel import declaredsize
+from datacoll.dcmodel import encodecursor
+from datacoll.dcmodel import flattenmembers
+from datacoll.dcmodel import fullerrors
+from datacoll.dcmodel import fullmessage
+from datacoll.dcmodel import indexField
+from datacoll.dcmodel import indexrange
+from datacoll.dcmodel import insertedcounters
+from datacoll.dcmodel import insertresult
+from datacoll.dcmodel import internalFields
+from datacoll.dcmodel import internalprojection
+from datacoll.dcmodel import isordered
+from datacoll.dcmodel import matchclause
+from datacoll.dcmodel import matchfield
+from datacoll.dcmodel import maxlength
+from datacoll.dcmodel import memberdocuments
+from datacoll.dcmodel import memberindex
+from datacoll.dcmodel import pagedquery
+from datacoll.dcmodel import publicfields
+from datacoll.dcmodel import sizeField
+from datacoll.dcmodel import spacedkeys
 
 # For the time being these are the capabilities for the datasets
 # coming from the user requests.
@@ -34,105 +74,891 @@ capabilitiesFixed = {
                      'metadataIsMutable': False
                     }
 
+# Indexes needed by the queries on each Mongo collection. The compound index
+# on the collection ID also serves the queries filtering only by it. The ones
+# on checksum and location include the collection ID for the joins of
+# intersection and union (see matchpipeline).
+indexSpec = {
+             'Collection': [
+                            [('pid', ASCENDING)],
+                            [('name', ASCENDING)],
+                            [('properties.ownership', ASCENDING)]
+                           ],
+             'Member': [
+                        [('_collectionId', ASCENDING), ('_id', ASCENDING)],
+                        [('pid', ASCENDING)],
+                        [('checksum', ASCENDING), ('_collectionId', ASCENDING)],
+                        [('location', ASCENDING), ('_collectionId', ASCENDING)],
+                        [('_collectionId', ASCENDING), ('datatype', ASCENDING)],
+                        [('_collectionId', ASCENDING), ('mappings.index', ASCENDING)]
+                       ]
+            }
+
+
+# Options of the [mongo] section passed to MongoClient and their types. The
+# ones missing in the configuration keep the default value of pymongo.
+clientOptions = {
+                 'maxpoolsize': ('maxPoolSize', int),
+                 'minpoolsize': ('minPoolSize', int),
+                 'maxidletimems': ('maxIdleTimeMS', int),
+                 'waitqueuetimeoutms': ('waitQueueTimeoutMS', int),
+                 'sockettimeoutms': ('socketTimeoutMS', int),
+                 'connecttimeoutms': ('connectTimeoutMS', int),
+                 'serverselectiontimeoutms': ('serverSelectionTimeoutMS', int),
+                 'compressors': ('compressors', str),
+                 'replicaset': ('replicaSet', str),
+                 'authsource': ('authSource', str)
+                }
+
+# Read preferences which can be used for the GET requests
+readPreferences = {
+                   'primary': Primary,
+                   'primaryPreferred': PrimaryPreferred,
+                   'secondary': Secondary,
+                   'secondaryPreferred': SecondaryPreferred,
+                   'nearest': Nearest
+                  }
+
+# Cache of the Collection documents read by this process and its workers
+collectionCache = CollectionCache()
+
+
+def clientkwargs(config):
+    """Return the arguments of the client of MongoDB defined in the configuration.
+
+    If `uri` is set it is used instead of `host` and `port`, and the options
+    included in it take precedence over the ones of the configuration. The
+    credentials are only sent if `user` is not empty.
+
+    :param config: Configuration with a [mongo] section.
+    :type config: configparser.RawConfigParser
+    :returns: Positional and keyword arguments of MongoClient.
+    :rtype: tuple
+    """
+    uri = config.get('mongo', 'uri', fallback='').strip()
+    if len(uri):
+        args = (uri,)
+    else:
+        args = (config.get('mongo', 'host', fallback='localhost'),
+                config.getint('mongo', 'port', fallback=27017))
+
+    kwargs = dict()
+    for option, (name, cls) in clientOptions.items():
+        value = config.get('mongo', option, fallback='').strip()
+        if len(value):
+            kwargs[name] = cls(value)
+
+    user = config.get('mongo', 'user', fallback='').strip()
+    if len(user):
+        kwargs['username'] = user
+        kwargs['password'] = config.get('mongo', 'password', fallback='')
+        kwargs.setdefault('authSource', config.get('mongo', 'db'))
+    return args, kwargs
+
+
+def connect(config):
+    """Connect to the MongoDB server defined in the configuration.
+
+    :param config: Configuration with a [mongo] section.
+    :type config: configparser.RawConfigParser
+    :returns: datacoll database in MongoDB.
+    :rtype: pymongo.database.Database
+    """
+    args, kwargs = clientkwargs(config)
+    client = MongoClient(*args, **kwargs)
+    return client[config.get('mongo', 'db')]
 
-class DCEncoder(json.JSONEncoder):
-    def default(self, obj):
-        # Objects lie IDs probably
-        if isinstance(obj, ObjectId):
-            return str(obj)
 
-        # Bytes to str
-        if isinstance(obj, bytes):
-            return obj.decode('utf-8')
+def readpreference(config):
+    """Return the read preference of the GET requests defined in the configuration.
 
-        # Datetime type to ISO format (str)
-        if isinstance(obj, datetime.datetime):
-            return obj.isoformat()
+    :param config: Configuration with a [mongo] section.
+    :type config: configparser.RawConfigParser
+    :returns: The read preference or None if the reads go to the primary.
+    :rtype: pymongo.read_preferences.ServerMode
+    :raises: Exception
+    """
+    mode = config.get('mongo', 'readpreference', fallback='primary').strip()
+    if mode not in readPreferences:
+        raise Exception('Unknown read preference %s' % mode)
+    if mode == 'primary':
+        return None
+
+    # An empty value (like in the sample configuration) means no limit
+    maxstaleness = config.get('mongo', 'maxstalenessseconds', fallback='').strip()
+    return readPreferences[mode](max_staleness=int(maxstaleness) if len(maxstaleness) else -1)
+
+
+def readconnection(conn, config):
+    """Return the connection used by the requests which only read documents.
+
+    It shares the pool of connections of conn, but the queries are sent to the
+    servers selected by the read preference of the configuration. Writes, and
+    the reads done while serving a write, always use conn and the primary.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: pymongo.database.Database
+    :param config: Configuration with a [mongo] section.
+    :type config: configparser.RawConfigParser
+    :returns: datacoll database in MongoDB.
+    :rtype: pymongo.database.Database
+    """
+    preference = readpreference(config)
+    if preference is None:
+        return conn
+    return conn.with_options(read_preference=preference)
 
-        # Otherwise the default behaviour
-        return json.JSONEncoder.default(self, obj)
 
+class Call(object):
+    """Call of a method of a Mongo collection requested by the steps of an operation.
 
-class urlFile(object):
-    """Iterable object which retrieves the bitstream pointed by a URL."""
+    The operations on the documents are written as generators (the functions
+    ending in "steps") which yield the calls to the driver and receive their
+    results. They are run by :func:`runsteps` with this driver, or by its
+    asynchronous version in :mod:`datacoll.dcasyncmongo`, so that both serving
+    modes share them.
+    """
 
-    def __init__(self, url):
-        """Create the iterable object.
+    def __init__(self, collname, method, *args, listed=False, **kwargs):
+        """Constructor of the call.
 
-        :param url: URL to download the data from.
-        :type url: string
+        :param collname: Collection or Member.
+        :type collname: str
+        :param method: Method of the Mongo collection.
+        :type method: str
+        :param listed: Read all the documents of the cursor returned.
+        :type listed: bool
         """
-        self.url = url
+        self.collname = collname
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.listed = listed
 
-    def __iter__(self):
-        """Method to iterate on the content."""
-        blocksize = 1024 * 1024
+    def bind(self, conn):
+        """Return the method of the Mongo collection in the given database."""
+        return getattr(conn[self.collname], self.method)
+
+
+def runsteps(conn, steps):
+    """Run the steps of an operation with the synchronous driver.
+
+    The exceptions raised by the driver are raised in the steps, so that
+    they can handle them.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :param steps: Generator of the operation.
+    :type steps: generator
+    :returns: The value returned by the steps.
+    """
+    result = None
+    error = None
+    while True:
+        try:
+            call = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as e:
+            return e.value
 
-        req = ul.Request(self.url)
         try:
-            u = ul.urlopen(req)
-            buf = u.read(blocksize)
-            while len(buf):
-                # Read first block of data
-                yield buf
-                buf = u.read(blocksize)
+            result = call.bind(conn)(*call.args, **call.kwargs)
+            if call.listed:
+                result = list(result)
+            error = None
         except Exception as e:
-            print('Exception %s' % str(e))
+            result = None
+            error = e
 
-        raise StopIteration
 
+def countedquery(collid):
+    """Return the query of a Collection whose counters of Members are kept."""
+    return {'_id': ObjectId(collid), '_count': {'$exists': True}}
 
-class Collections(object):
-    """Abstraction from the DB storage for a list of Collections."""
 
-    def __init__(self, conn, limit=None):
-        """Constructor of the list of collections.
+def touchupdate(count=None, size=0):
+    """Return the update of :func:`touch`. Without count, only _mversion is changed."""
+    if count is None:
+        return {'$inc': {'_mversion': 1}}
+    return {'$inc': {'_mversion': 1, '_count': count, '_bytes': size}}
 
-        :param conn: datacoll database in MongoDB.
-        :type conn: Mongo database
+
+def touchsteps(collid, count=0, size=0):
+    """Steps of :func:`touch`."""
+    # The counters of a Collection without them are computed by recount
+    updated = yield Call('Collection', 'update_one', countedquery(collid),
+                         touchupdate(count, size))
+    if not updated.matched_count:
+        yield Call('Collection', 'update_one', {'_id': ObjectId(collid)}, touchupdate())
+
+
+def touch(conn, collid, count=0, size=0):
+    """Increase the counter of changes in the Members of a Collection.
+
+    It must be called after the Members have been modified, so that a list
+    read in between is never tagged with the new value. The counters of
+    Members are updated in the same operation.
+
+    So a write of Members takes two round trips: the write of the Members
+    and this update of their Collection. They change different documents,
+    which MongoDB only updates together in a transaction, and a transaction
+    needs a replica set and one more round trip to commit it.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :param collid: Collection ID.
+    :type collid: str
+    :param count: Members added (or removed if negative).
+    :type count: int
+    :param size: Bytes added (or removed if negative).
+    :type size: int
+    """
+    runsteps(conn, touchsteps(collid, count, size))
+
+
+def existssteps(collid):
+    """Raise an Exception if a Collection does not exist."""
+    if (yield Call('Collection', 'find_one', {'_id': ObjectId(collid)}, {'_id': 1})) is None:
+        raise Exception('Collection %s does not exist!' % collid)
+
+
+def lastindexsteps(collid):
+    """Return the position following the last Member of a Collection."""
+    last = yield Call('Member', 'find_one', {'_collectionId': ObjectId(collid),
+                                             indexField: {'$type': 'number'}},
+                      {indexField: 1}, sort=[(indexField, DESCENDING)])
+    return math.floor(memberindex(last)) + 1 if last is not None else 0
+
+
+def nextindexsteps(collid, count, minimum=None):
+    """Steps of :func:`nextindex`."""
+    query = {'_id': ObjectId(collid), '_nextIndex': {'$exists': True}}
+    while True:
+        if minimum is not None:
+            yield Call('Collection', 'update_one', query, {'$max': {'_nextIndex': minimum}})
+        coll = yield Call('Collection', 'find_one_and_update', query,
+                          {'$inc': {'_nextIndex': count}}, projection={'_nextIndex': 1},
+                          return_document=ReturnDocument.AFTER)
+        if coll is not None:
+            return coll['_nextIndex'] - count
+
+        start = yield from lastindexsteps(collid)
+        yield Call('Collection', 'update_one',
+                   {'_id': ObjectId(collid), '_nextIndex': {'$exists': False}},
+                   {'$set': {'_nextIndex': start}})
+        yield from existssteps(collid)
+
+
+def nextindex(conn, collid, count, minimum=None):
+    """Reserve the positions of Members appended to an ordered Collection.
+
+    Concurrent insertions never receive the same positions. The Collections
+    created before the positions were kept start after their last Member.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :param collid: Collection ID.
+    :type collid: str
+    :param count: Number of positions to reserve.
+    :type count: int
+    :param minimum: The positions reserved start at least here.
+    :type minimum: int
+    :returns: First position reserved. The others follow it.
+    :rtype: int
+    :raises: Exception
+    """
+    return runsteps(conn, nextindexsteps(collid, count, minimum))
+
+
+def positionsteps(collid, colldoc, documents):
+    """Append the Members without a position at the end of an ordered Collection."""
+    if not isordered(colldoc):
+        return
+    missing, minimum = indexrange(documents)
+    if missing or minimum is not None:
+        first = yield from nextindexsteps(collid, missing, minimum)
+        assignindexes(documents, first)
+
+
+def keysbeforesteps(collid, memberid, count=1):
+    """Steps of :func:`keysbefore`."""
+    member = yield Call('Member', 'find_one', {'_collectionId': ObjectId(collid),
+                                               '_id': ObjectId(memberid)},
+                        {indexField: 1})
+    high = memberindex(member) if member is not None else None
+    if high is None:
+        raise Exception('Member %s has no position in Collection %s' % (memberid, collid))
+
+    previous = yield Call('Member', 'find_one', {'_collectionId': ObjectId(collid),
+                                                 indexField: {'$lt': high}},
+                          {indexField: 1}, sort=[(indexField, DESCENDING)])
+    return spacedkeys(memberindex(previous) if previous is not None else None, high, count)
+
+
+def keysbefore(conn, collid, memberid, count=1):
+    """Return the positions of Members inserted before another one.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :param collid: Collection ID.
+    :type collid: str
+    :param memberid: ID of the Member which must follow the new ones.
+    :type memberid: str
+    :param count: Number of positions.
+    :type count: int
+    :rtype: list
+    :raises: Exception
+    """
+    return runsteps(conn, keysbeforesteps(collid, memberid, count))
+
+
+def recountsteps(collids=None, batchsize=1000):
+    """Steps of :func:`recount`.
+
+    The sizes of the Members are read in batches following the index on the
+    Collection ID, so that a large Collection is never kept in memory.
+    """
+    if collids is None:
+        query = {'_count': {'$exists': False}}
+    else:
+        query = {'_id': {'$in': [ObjectId(collid) for collid in collids]}}
+
+    updated = 0
+    for coll in (yield Call('Collection', 'find', query, {'_id': 1}, listed=True)):
+        count = 0
+        size = 0
+        clause = {'_collectionId': coll['_id']}
+        while True:
+            batch = yield Call('Member', 'find', clause, {sizeField: 1},
+                               sort=[('_collectionId', ASCENDING), ('_id', ASCENDING)],
+                               limit=batchsize, listed=True)
+            count += len(batch)
+            size += sum(declaredsize(member) for member in batch)
+            if len(batch) < batchsize:
+                break
+            clause = {'_collectionId': coll['_id'], '_id': {'$gt': batch[-1]['_id']}}
+
+        yield Call('Collection', 'update_one', {'_id': coll['_id']},
+                   {'$set': {'_count': count, '_bytes': size}})
+        updated += 1
+    return updated
+
+
+def recount(conn, collids=None):
+    """Compute again the counters of Members of some Collections.
+
+    The Collections created before the counters were kept do not have them.
+    They are computed at startup (see ensureindexes in the configuration) or
+    with the dcindexes command.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :param collids: IDs of the Collections. By default, the ones without counters.
+    :type collids: list
+    :returns: Number of Collections updated.
+    :rtype: int
+    """
+    return runsteps(conn, recountsteps(collids))
+
+
+def reservesteps(collid, sizes, maxlen):
+    """Steps of :func:`reserve`."""
+    while True:
+        coll = yield Call('Collection', 'find_one', {'_id': ObjectId(collid)}, {'_count': 1})
+        if coll is None:
+            raise Exception('Collection %s does not exist!' % collid)
+        if '_count' not in coll:
+            yield from recountsteps([collid])
+            continue
+
+        room = max(min(len(sizes), maxlen - coll['_count']), 0)
+        if not room:
+            return 0
+        result = yield Call('Collection', 'update_one',
+                            {'_id': ObjectId(collid), '_count': coll['_count']},
+                            {'$inc': {'_count': room, '_bytes': sum(sizes[:room])}})
+        if result.matched_count:
+            return room
+
+
+def reserve(conn, collid, sizes, maxlen):
+    """Add Members to the counters of a Collection if they fit in its maxLength.
+
+    The counters are only updated if they did not change since they were
+    read, so that concurrent insertions never exceed the limit.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :param collid: Collection ID.
+    :type collid: str
+    :param sizes: Sizes of the Members to insert.
+    :type sizes: list
+    :param maxlen: Maximum number of Members of the Collection.
+    :type maxlen: int
+    :returns: Number of Members reserved, from the start of the list.
+    :rtype: int
+    :raises: Exception
+    """
+    return runsteps(conn, reservesteps(collid, sizes, maxlen))
+
+
+def counterssteps(collid):
+    """Return the number of Members of a Collection and the sum of their sizes."""
+    while True:
+        coll = yield Call('Collection', 'find_one', {'_id': ObjectId(collid)},
+                          {'_count': 1, '_bytes': 1})
+        if coll is None:
+            raise Exception('Collection %s does not exist!' % collid)
+        if '_count' in coll:
+            return coll['_count'], coll.get('_bytes', 0)
+        yield from recountsteps([collid])
+
+
+def mversionsteps(collid):
+    """Return the counter of changes in the Members of a Collection."""
+    coll = yield Call('Collection', 'find_one', {'_id': ObjectId(collid)}, {'_mversion': 1})
+    if coll is None:
+        raise Exception('Collection %s not found' % collid)
+    return coll.get('_mversion', 0)
+
+
+def collectionsteps(collid, fields=None):
+    """Return the document of a Collection with its internal fields.
+
+    Only full documents are kept in the cache of Collections.
+    """
+    document = collectionCache.get(collid) if fields is None else None
+    if document is not None:
+        return document
+
+    generation = collectionCache.generation(collid)
+    # The counters of the Members are not needed here and they would
+    # make the cached documents outdated at every change
+    document = yield Call('Collection', 'find_one', {'_id': ObjectId(collid)},
+                          internalprojection(fields) or cacheProjection)
+    if document is None:
+        raise Exception('Collection %s does not exist!' % collid)
+
+    if fields is None:
+        collectionCache.put(collid, document, generation)
+    return document
+
+
+def insertcollectionsteps(collid, document):
+    """Insert a Collection and return its document. Without collid a new ID is created."""
+    document = publicfields(document)
+    document['_id'] = ObjectId(collid) if collid is not None else ObjectId()
+
+    # The counters of Members start with the Collection
+    yield Call('Collection', 'insert_one', dict(document, _count=0, _bytes=0))
+    return document
+
+
+def updatecollectionsteps(collid, document):
+    """Update the fields of a Collection and return its new document."""
+    if '_id' in document and collid != str(document['_id']):
+        raise Exception('IDs differ!')
+
+    fields = {k: v for k, v in publicfields(document).items() if k != '_id'}
+    auxdoc = yield Call('Collection', 'find_one_and_update', {'_id': ObjectId(collid)},
+                        {'$set': fields, '$inc': {'_version': 1}},
+                        projection=cacheProjection, return_document=ReturnDocument.AFTER)
+
+    # The document is read again by the next request, as a newer change
+    # by another process could be stored here otherwise
+    collectionCache.invalidate(collid)
+    if auxdoc is None:
+        raise Exception('Collection %s does not exist!' % collid)
+    return auxdoc
+
+
+def deletecollectionsteps(collid, batchsize=1000, progress=None):
+    """Delete a Collection and its Members and return the number of Members deleted.
+
+    Members are deleted in batches to avoid long operations on the DB.
+    They are deleted before the Collection, so that the operation can be
+    repeated if it is interrupted.
+    """
+    oid = ObjectId(collid)
+    removed = 0
+    while True:
+        batch = yield Call('Member', 'find', {'_collectionId': oid}, {'_id': 1},
+                           limit=batchsize, listed=True)
+        ids = [doc['_id'] for doc in batch]
+        if not len(ids):
+            break
+
+        deleted = yield Call('Member', 'delete_many', {'_collectionId': oid,
+                                                       '_id': {'$in': ids}})
+        removed += deleted.deleted_count
+        if progress is not None:
+            progress(removed)
+
+    deleted = yield Call('Collection', 'delete_one', {'_id': oid})
+    collectionCache.invalidate(collid)
+
+    # Check this. The value must be 1
+    if deleted.deleted_count != 1:
+        raise Exception('Collection not found!')
+    return removed
+
+
+def insertmemberssteps(collid, documents, ordered=True, colldoc=None):
+    """Insert a list of Members with a single request.
+
+    If the insertion is ordered, it stops at the first invalid Member.
+
+    :param collid: Collection ID.
+    :type collid: str
+    :param documents: Members to insert.
+    :type documents: list
+    :param ordered: Stop at the first error or try to insert all Members.
+    :type ordered: bool
+    :param colldoc: Collection. By default, it is read.
+    :type colldoc: dict
+    :returns: IDs of the Members inserted and errors found. Each error has
+        the position of the Member in the list and a message.
+    :rtype: tuple
+    """
+    valid, errors = memberdocuments(collid, documents, ordered)
+    if not len(valid):
+        return list(), errors
+
+    sizes = [declaredsize(doc) for index, doc in valid]
+    if colldoc is None:
+        colldoc = yield from collectionsteps(collid)
+    maxlen = maxlength(colldoc)
+    if maxlen >= 0:
+        # Only the first Members which fit in the Collection are inserted
+        room = yield from reservesteps(collid, sizes, maxlen)
+        valid, errors = fullerrors(valid, errors, room, maxlen, ordered)
+        if not len(valid):
+            return list(), errors
+
+    # Members without a position are appended in the order of the list
+    yield from positionsteps(collid, colldoc, [doc for index, doc in valid])
+
+    writeerrors = list()
+    try:
+        # The IDs are added to the documents by the driver
+        yield Call('Member', 'insert_many', [doc for index, doc in valid], ordered=ordered)
+    except BulkWriteError as e:
+        writeerrors = e.details['writeErrors']
+
+    inserted, errors = insertresult(valid, errors, writeerrors, ordered)
+    count, size = insertedcounters(valid, inserted)
+    if maxlen >= 0:
+        # The room reserved for the Members not inserted is released
+        yield from touchsteps(collid, count - len(valid), size - sum(sizes[:len(valid)]))
+    elif len(inserted):
+        yield from touchsteps(collid, count, size)
+    return inserted, errors
+
+
+def membersteps(collid, memberid, fields=None):
+    """Return the document of a Member with its internal fields."""
+    document = yield Call('Member', 'find_one', {'_collectionId': ObjectId(collid),
+                                                 '_id': ObjectId(memberid)},
+                          internalprojection(fields))
+    if document is None:
+        raise Exception('Member %s does not exist!' % memberid)
+    return document
+
+
+def insertmembersteps(collid, memberid, document):
+    """Insert a Member and return its document. Without memberid a new ID is created."""
+    document = dict(publicfields(document), _collectionId=ObjectId(collid))
+    if memberid is not None:
+        document['_id'] = ObjectId(memberid)
+
+    size = declaredsize(document)
+    colldoc = yield from collectionsteps(collid)
+    maxlen = maxlength(colldoc)
+    if maxlen >= 0 and not (yield from reservesteps(collid, [size], maxlen)):
+        raise CollectionFull(fullmessage(maxlen))
+
+    # The Member is appended if it has no position
+    yield from positionsteps(collid, colldoc, [document])
+
+    try:
+        inserted = yield Call('Member', 'insert_one', document)
+    except Exception:
+        if maxlen >= 0:
+            yield from touchsteps(collid, -1, -size)
+        raise
+    document['_id'] = inserted.inserted_id
+    if maxlen >= 0:
+        yield from touchsteps(collid)
+    else:
+        yield from touchsteps(collid, 1, size)
+    return document
+
+
+def updatemembersteps(collid, memberid, document):
+    """Update the fields of a Member and return its new document."""
+    if '_id' in document and memberid != str(document['_id']):
+        raise Exception('IDs differ!')
+
+    fields = {k: v for k, v in publicfields(document).items()
+              if k not in ('_id', '_collectionId')}
+    # The previous size is needed to update the bytes of the Collection
+    resized = sizeField in fields
+    returned = ReturnDocument.BEFORE if resized else ReturnDocument.AFTER
+    auxdoc = yield Call('Member', 'find_one_and_update', {'_collectionId': ObjectId(collid),
+                                                          '_id': ObjectId(memberid)},
+                        {'$set': fields, '$inc': {'_version': 1}},
+                        return_document=returned)
+    if auxdoc is None:
+        raise Exception('Member %s does not exist!' % memberid)
+
+    delta = 0
+    if resized:
+        delta = declaredsize(fields) - declaredsize(auxdoc)
+        auxdoc.update(fields)
+        auxdoc['_version'] = auxdoc.get('_version', 0) + 1
+    yield from touchsteps(collid, 0, delta)
+    return auxdoc
+
+
+def deletemembersteps(collid, memberid):
+    """Delete a Member of a Collection."""
+    # The size of the Member is subtracted from the one of the Collection
+    deleted = yield Call('Member', 'find_one_and_delete', {'_collectionId': ObjectId(collid),
+                                                           '_id': ObjectId(memberid)},
+                         projection={sizeField: 1})
+    if deleted is None:
+        raise Exception('Member not found!')
+    yield from touchsteps(collid, -1, -declaredsize(deleted))
+
+
+def indexname(keys):
+    """Return the name given by MongoDB to an index with these keys."""
+    return '_'.join('%s_%s' % (field, direction) for field, direction in keys)
+
+
+def indexreport(conn):
+    """Compare the indexes in the DB with the ones declared in indexSpec.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :returns: For each Mongo collection, the lists of indexes which are
+        missing, not used since the server started, and not declared.
+    :rtype: dict
+    """
+    report = dict()
+    for collname, speclist in indexSpec.items():
+        existing = conn[collname].index_information()
+        declared = [indexname(keys) for keys in speclist]
+
+        # Number of operations which used each index since the server started
+        try:
+            usage = {stat['name']: stat['accesses']['ops']
+                     for stat in conn[collname].aggregate([{'$indexStats': {}}])}
+        except Exception:
+            usage = dict()
+
+        report[collname] = {
+            'missing': [name for name in declared if name not in existing],
+            'unused': [name for name in declared if usage.get(name, 1) == 0],
+            'undeclared': [name for name in existing
+                           if name not in declared and name != '_id_']
+        }
+    return report
+
+
+def ensureindexes(conn):
+    """Create the indexes declared in indexSpec which are missing.
+
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :returns: Names of the indexes created.
+    :rtype: list
+    """
+    created = list()
+    for collname, speclist in indexSpec.items():
+        existing = conn[collname].index_information()
+        for keys in speclist:
+            if indexname(keys) not in existing:
+                created.append(conn[collname].create_index(keys, name=indexname(keys)))
+    return created
+
+
+def matchpipeline(collid, otherid, field, found=True):
+    """Build the aggregation comparing the Members of two Collections by a field.
+
+    Each Member of the first Collection is joined by the index of the field
+    with the Members of the other Collection having the same value, and kept
+    if there is any (or none). Only Members where the field is a string are
+    compared. The join reads at most the _id of one Member of the other
+    Collection, so values repeated in many Members or Collections do not
+    make the aggregation larger.
+
+    :param collid: Collection ID of the Members returned.
+    :type collid: str
+    :param otherid: Collection ID of the Members compared with.
+    :type otherid: str
+    :param field: One of matchFields.
+    :type field: str
+    :param found: Keep the Members with (True) or without (False) a match.
+    :type found: bool
+    :returns: Pipeline to pass to aggregate.
+    :rtype: list
+    """
+    hidden = dict({f: 0 for f in internalFields}, _matches=0)
+    return [{'$match': {'_collectionId': ObjectId(collid), field: {'$type': 'string'}}},
+            {'$lookup': {'from': 'Member', 'localField': field, 'foreignField': field,
+                         'pipeline': [{'$match': {'_collectionId': ObjectId(otherid)}},
+                                      {'$limit': 1},
+                                      {'$project': {'_id': 1}}],
+                         'as': '_matches'}},
+            {'$match': {'_matches': {'$ne': []} if found else []}},
+            {'$project': hidden}]
+
+
+def aggregatesteps(pipeline, batchsize=None):
+    """Return the cursor of an aggregation on the Members.
+
+    The DB is allowed to use temporary files.
+    """
+    if batchsize:
+        return (yield Call('Member', 'aggregate', pipeline, allowDiskUse=True,
+                           batchSize=batchsize))
+    return (yield Call('Member', 'aggregate', pipeline, allowDiskUse=True))
+
+
+def intersectionsteps(collid, otherid, field='checksum', batchsize=None):
+    """Return the cursor of :meth:`Collection.intersection`."""
+    matchfield(field)
+    yield from existssteps(collid)
+    yield from existssteps(otherid)
+    return (yield from aggregatesteps(matchpipeline(collid, otherid, field), batchsize))
+
+
+class PagedCursor(PageBase):
+    """Iterable wrapper around a Mongo cursor retrieving one page of results.
+
+    One document more than the limit is requested from the DB. If it is
+    found, the page is not the last one and :attr:`next_cursor` is set.
+    """
+
+    def __init__(self, collection, clause, limit=None, cursor=None, sort=None,
+                 batchsize=None, fields=None):
+        """Constructor of the paged cursor.
+
+        :param collection: Mongo collection to query.
+        :type collection: pymongo.collection.Collection
+        :param clause: Filter of the query.
+        :type clause: dict
+        :param limit: Maximum number of documents in the page.
+        :type limit: int
+        :param cursor: Opaque token pointing to the start of the page.
+        :type cursor: str
+        :param sort: Field to sort by. A leading "-" means descending order.
+        :type sort: str
+        :param batchsize: Number of documents retrieved in each round trip.
+        :type batchsize: int
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
         :raise: Exception
         """
-
-        clause = dict()
-        # TODO How to implement this?
+        self.limit = limit
+        self.sort = sort if sort is not None else '_id'
+        self.next_cursor = None
+        self.__last = None
+        self.__count = 0
+
+        clause, fields, order = pagedquery(clause, self.sort, cursor, fields)
+        self.cursor = collection.find(clause, fields).sort(order)
         if limit:
-            pass
-
-        self.cursor = conn.Collection.find(clause)
+            self.cursor = self.cursor.limit(limit + 1)
+        if batchsize:
+            self.cursor = self.cursor.batch_size(batchsize)
 
     def __iter__(self):
         """Iterative method."""
         return self
 
     def __next__(self):
-        """Retrieve the next Collection like a cursor.
+        """Retrieve the next document like a cursor.
 
-        :returns: The next member of the collection.
-        :rtype: :class:`~CollectionBase`
+        :returns: The next document of the page.
+        :rtype: dict
+        :raises: StopIteration
         """
-        return self.cursor.next()
+        document = self.cursor.next()
+        self.__count += 1
+        if self.limit and self.__count > self.limit:
+            # There are more documents. Point to the last one sent
+            self.next_cursor = encodecursor(self.sort, self.__last)
+            raise StopIteration
+        self.__last = document
+        return document
 
     def fetchone(self):
-        """Retrieve the next Collection like a cursor."""
-        return self.cursor.next()
+        """Retrieve the next document like a cursor.
+
+        :returns: The next document or None if the page is finished.
+        :rtype: dict
+        """
+        try:
+            return self.__next__()
+        except StopIteration:
+            return None
 
     def __del__(self):
-        """Destructor of the list of Collections."""
+        """Destructor of the cursor."""
         pass # self.cursor.close()
 
 
-class Members(object):
+class Collections(PagedCursor, CollectionsBase):
+    """Abstraction from the DB storage for a list of Collections."""
+
+    def __init__(self, conn, limit=None, cursor=None, sort=None, batchsize=None,
+                 fields=None):
+        """Constructor of the list of collections.
+
+        :param conn: datacoll database in MongoDB.
+        :type conn: Mongo database
+        :param limit: Maximum number of collections to return.
+        :type limit: int
+        :param cursor: Opaque token pointing to the start of the page.
+        :type cursor: str
+        :param sort: Field to sort by. A leading "-" means descending order.
+        :type sort: str
+        :param batchsize: Number of documents retrieved in each round trip.
+        :type batchsize: int
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :raise: Exception
+        """
+
+        clause = dict()
+        super().__init__(conn.Collection, clause, limit, cursor, sort, batchsize,
+                         fields)
+
+
+class Members(PagedCursor, MembersBase):
     """Abstraction from the DB storage for a list of Members."""
 
-    def __init__(self, conn,  collid, limit=None):
+    def __init__(self, conn, collid, limit=None, cursor=None, sort=None,
+                 batchsize=None, fields=None, filters=None):
         """Constructor of the list of Members.
 
-        :param conn: Connection to the MySQL DB.
-        :type conn: MySQLdb.connections.Connection
+        :param conn: datacoll database in MongoDB.
+        :type conn: Mongo database
         :param collid: Collection ID.
         :type collid: str
         :param limit: Limit the number of records from the result.
         :type limit: int
+        :param cursor: Opaque token pointing to the start of the page.
+        :type cursor: str
+        :param sort: Field to sort by. A leading "-" means descending order.
+        :type sort: str
+        :param batchsize: Number of documents retrieved in each round trip.
+        :type batchsize: int
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :param filters: Filter on the Members (see :func:`~datacoll.dcmodel.memberfilter`).
+        :type filters: dict
         :raise: Exception
         """
         clause = dict()
@@ -140,50 +966,48 @@ class Members(object):
         if collid is not None:
             clause['_collectionId'] = ObjectId(collid)
 
-        if not conn.Collection.count({'_id': ObjectId(collid)}):
-            raise Exception('Collection %s not found' % collid)
-
-        # TODO How to implement this?
-        if limit:
-            pass
-
-        self.cursor = conn.Member.find(clause)
+        if filters is not None:
+            clause = {'$and': [clause, filters]}
 
-    def __iter__(self):
-        """Iterative method."""
-        return self
+        # Counter of changes in the Members when the list was read. It is not
+        # in the cache of Collections, as it changes with every write of
+        # Members, so it is read by _id before the page, even if the document
+        # of the Collection was just read from the cache.
+        self.mversion = runsteps(conn, mversionsteps(collid))
 
-    def __next__(self):
-        """Retrieve the next Member like a cursor.
+        super().__init__(conn.Member, clause, limit, cursor, sort, batchsize, fields)
 
-        :returns: The next member of the collection.
-        :rtype: :class:`~MemberBase`
-        """
-        return self.cursor.next()
 
-    def fetchone(self):
-        """Retrieve the next Member like a cursor.
+def warmcache(conn, collids):
+    """Load the documents of the given Collections in the cache.
 
-        :returns: The next member of the collection.
-        :rtype: :class:`~MemberBase`
-        """
-        return self.cursor.next()
-
-    def __del__(self):
-        """Destructor of the list of Members."""
-        pass # self.cursor.close()
+    :param conn: datacoll database in MongoDB.
+    :type conn: Mongo database
+    :param collids: IDs of the Collections to load.
+    :type collids: list
+    """
+    generations = {str(collid): collectionCache.generation(str(collid)) for collid in collids}
+    query = {'_id': {'$in': [ObjectId(collid) for collid in generations]}}
+    for document in conn.Collection.find(query, cacheProjection):
+        collid = str(document['_id'])
+        collectionCache.put(collid, document, generations[collid])
 
 
-class Collection(object):
+class Collection(CollectionBase):
     """Abstraction from the DB storage for the Collection."""
 
-    def __init__(self, conn, collid=None):
+    def __init__(self, conn, collid=None, fields=None, fetch=True):
         """Constructor of a Collection object.
 
         :param conn: Connection to the MySQL DB.
         :type conn: MySQLdb.connections.Connection
         :param collid: Collection ID.
         :type collid: str
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :param fetch: Read the document. If False, the Collection can only be
+            updated or deleted.
+        :type fetch: bool
         :returns: A collection from the DB based on the given parameters.
         :rtype: :class:`~CollectionBase`
         :raises: Exception
@@ -193,6 +1017,7 @@ class Collection(object):
         if collid is None:
             self.document = dict()
             self._id = None
+            self.version = 0
             return
 
         # _id must always be a str
@@ -201,11 +1026,16 @@ class Collection(object):
         else:
             self._id = str(collid)
 
-        self.document = conn.Collection.find_one({'_id': ObjectId(self._id)})
+        if not fetch:
+            self.document = None
+            self.version = None
+            return
+
+        self.document = runsteps(conn, collectionsteps(self._id, fields))
 
-        # If the document do not exist create it in memory first
-        if self.document is None:
-            raise Exception('Collection %s does not exist!' % self._id)
+        # Number of updates of the document
+        self.version = self.document.get('_version', 0)
+        self.document = publicfields(self.document)
 
     def insert(self, document=None):
         """Insert a new collection in the MySQL DB.
@@ -217,52 +1047,162 @@ class Collection(object):
         :raise: Exception
         """
         if document is not None:
-            self.document = document
+            self.document = publicfields(document)
 
-        # TODO What happens if _id is different?
-        inserted = self.__conn.Collection.insert_one(self.document)
-        self._id = str(inserted.inserted_id)
+        # The ID given in the constructor is used for the new Collection
+        self.document = runsteps(self.__conn, insertcollectionsteps(self._id, self.document))
+        self._id = str(self.document['_id'])
+        self.version = 0
         return self._id.encode('utf-8')
 
     def update(self, document=None):
         """Update the fields passed as parameters in the MySQL DB.
 
+        The updated document is kept in this object.
+
         :param document: Collection.
         :type document: dict
-        :returns: The updated collection.
-        :rtype: :class:`~InsertOneResult`
+        :returns: The ID of the updated collection.
+        :rtype: str
         :raises: Exception
         """
-        if '_id' in document and self._id != str(document['_id']):
-            raise Exception('IDs differ!')
+        auxdoc = runsteps(self.__conn, updatecollectionsteps(self._id, document))
+        self.version = auxdoc.get('_version', 0)
+        self.document = publicfields(auxdoc)
+        return self._id
 
-        auxdoc = self.__conn.Collection.find_one_and_update({'_id': ObjectId(self._id)},
-                                                            document)
+    def delete(self, batchsize=1000, progress=None):
+        """Delete a Collection and all its Members from the DB.
 
-        if auxdoc is None:
-            document['_id'] = self._id
-            inserted = self.__conn.Collection.insert_one(document)
-            self._id = str(inserted.inserted_id)
+        Members are deleted in batches to avoid long operations on the DB.
+        They are deleted before the Collection, so that the operation can be
+        repeated if it is interrupted.
 
-        return self._id
+        :param batchsize: Number of Members deleted in each operation.
+        :type batchsize: int
+        :param progress: Function called after each batch with the number of
+            Members deleted up to that moment.
+        :type progress: callable
+        :returns: Number of Members deleted.
+        :rtype: int
+        :raises: Exception
+        """
+        removed = runsteps(self.__conn, deletecollectionsteps(self._id, batchsize, progress))
+        self._id = None
+        self.document = None
+        return removed
 
-    def delete(self):
-        """Delete a Collection from the MySQL DB.
+    def insertmembers(self, documents, ordered=True):
+        """Insert a list of Members in this Collection with a single request.
+
+        If the insertion is ordered, it stops at the first invalid Member.
 
+        :param documents: Members to insert.
+        :type documents: list
+        :param ordered: Stop at the first error or try to insert all Members.
+        :type ordered: bool
+        :returns: IDs of the Members inserted and errors found. Each error has
+            the position of the Member in the list and a message.
+        :rtype: tuple
         """
-        deleted = self.__conn.Collection.delete_one({'_id': ObjectId(self._id)})
+        return runsteps(self.__conn, insertmemberssteps(self._id, documents, ordered,
+                                                        self.document or None))
 
-        # Check this. The value must be 1
-        if deleted.deleted_count != 1:
-            raise Exception('Collection not found!')
-        self._id = None
-        self.document = None
+    def counters(self):
+        """Return the number of Members and the sum of their declared sizes.
+
+        :returns: Number of Members and bytes.
+        :rtype: tuple
+        :raises: Exception
+        """
+        return runsteps(self.__conn, counterssteps(self._id))
+
+    def keysbefore(self, memberid, count=1):
+        """Return the positions of Members inserted before another one.
+
+        :param memberid: ID of the Member which must follow the new ones.
+        :type memberid: str
+        :param count: Number of positions.
+        :type count: int
+        :rtype: list
+        :raises: Exception
+        """
+        return keysbefore(self.__conn, self._id, memberid, count)
+
+    def findmatch(self, document, batchsize=None):
+        """Return the Members with the same values as the fields of a document.
+
+        :param document: Member to compare with (see :func:`~datacoll.dcmodel.matchclause`).
+        :type document: dict
+        :param batchsize: Number of documents retrieved in each round trip.
+        :type batchsize: int
+        :rtype: :class:`~Members`
+        :raises: Exception
+        """
+        return Members(self.__conn, self._id, batchsize=batchsize,
+                       filters=matchclause(document))
+
+    def intersection(self, otherid, field='checksum', batchsize=None):
+        """Return the Members with the same value of a field in another Collection.
+
+        The result is streamed from the cursor of the aggregation, so no
+        temporary collection is created in the DB.
+
+        :param otherid: ID of the other Collection.
+        :type otherid: str
+        :param field: checksum or location.
+        :type field: str
+        :param batchsize: Number of documents retrieved in each round trip.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        return ResultPage(runsteps(self.__conn, intersectionsteps(self._id, otherid, field,
+                                                                  batchsize)))
+
+    def union(self, otherid, field='checksum', batchsize=None):
+        """Return the Members of this Collection and the ones of another which are not here.
+
+        Members of the other Collection are compared by a field. The ones
+        without it are always part of the result.
+
+        :param otherid: ID of the other Collection.
+        :type otherid: str
+        :param field: checksum or location.
+        :type field: str
+        :param batchsize: Number of documents retrieved in each round trip.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        matchfield(field)
+        own = Members(self.__conn, self._id, batchsize=batchsize)
+        others = Members(self.__conn, otherid, batchsize=batchsize,
+                         filters={field: {'$not': {'$type': 'string'}}})
+        notfound = runsteps(self.__conn, aggregatesteps(matchpipeline(otherid, self._id, field,
+                                                                      found=False),
+                                                        batchsize))
+        return ResultPage(itertools.chain(own, notfound, others))
+
+    def flatten(self, depth=4, batchsize=None):
+        """Return the Members of this Collection and of the Collections it contains.
+
+        :param depth: Number of levels of Collections expanded.
+        :type depth: int
+        :param batchsize: Number of documents retrieved in each round trip.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        return ResultPage(flattenmembers(lambda collid: Members(self.__conn, collid,
+                                                                batchsize=batchsize),
+                                         self._id, depth))
 
 
-class Member(object):
+class Member(MemberBase):
     """Abstraction from the DB storage for the Member."""
 
-    def __init__(self, conn, collid, memberid=None):
+    def __init__(self, conn, collid, memberid=None, fields=None, fetch=True):
         """Constructor of the Member.
 
         :param conn: Connection to the MySQL DB.
@@ -271,6 +1211,11 @@ class Member(object):
         :type collid: str
         :param memberid: Member ID.
         :type memberid: str
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :param fetch: Read the document. If False, the Member can only be
+            inserted with this ID, updated or deleted.
+        :type fetch: bool
         :returns: A member from the DB based on the given parameters.
         :rtype: :class:`~MemberBase`
         :raises: Exception
@@ -291,6 +1236,7 @@ class Member(object):
         if memberid is None:
             self.document = {'_collectionId': ObjectId(self._collectionId)}
             self._id = None
+            self.version = 0
             return
 
         # _id must always be a str
@@ -299,60 +1245,22 @@ class Member(object):
         else:
             self._id = str(memberid)
 
-        self.document = conn.Member.find_one({'_id': ObjectId(self._id)})
-        self.document['_collectionId'] = ObjectId(self._collectionId)
-
-        # If the document do not exist create it in memory first
-        if self.document is None:
-            raise Exception('Member %s does not exist!' % self._id)
-
-    # def download(self):
-    #     """Download a Member from the MySQL DB.
-    #
-    #     :param conn: Connection to the MySQL DB.
-    #     :type conn: MySQLdb.connections.Connection
-    #     """
-    #     cursor = self.__conn.cursor()
-    #     query = 'select m.pid, m.url from member as m inner join collection '
-    #     query = query + 'as c on m.cid = c.id'
-    #
-    #     whereClause = list()
-    #     whereClause.append('c.id = %s')
-    #     sqlParams = [self.collid]
-    #
-    #     whereClause.append('m.id = %s')
-    #     sqlParams.append(self.memberid)
-    #
-    #     query = query + ' where ' + ' and '.join(whereClause)
-    #
-    #     try:
-    #         cursor.execute(query, tuple(sqlParams))
-    #     except:
-    #         messDict = {'code': 0,
-    #                     'message': 'Error searching for member %s' % self.memberid}
-    #         message = json.dumps(messDict)
-    #         raise Exception(message)
-    #
-    #     # Get the PID and solve it through Handle
-    #     dbPid, dbUrl = cursor.fetchone()
-    #
-    #     if dbPid is not None:
-    #         url = 'http://hdl.handle.net/%s' % dbPid
-    #     else:
-    #         url = dbUrl
-    #
-    #     cursor.close()
-    #     return url
+        if not fetch:
+            self.document = {'_collectionId': ObjectId(self._collectionId)}
+            self.version = None
+            return
+
+        self.document = runsteps(conn, membersteps(self._collectionId, self._id, fields))
+
+        # Number of updates of the document
+        self.version = self.document.get('_version', 0)
+        self.document = publicfields(self.document)
 
     def delete(self):
         """Delete a Member from the MySQL DB.
 
         """
-        deleted = self.__conn.Member.delete_one({'_id': ObjectId(self._id)})
-
-        # Check this. The value must be 1
-        if deleted.deleted_count != 1:
-            raise Exception('Member not found!')
+        runsteps(self.__conn, deletemembersteps(self._collectionId, self._id))
         self._id = None
         self.document = None
 
@@ -366,98 +1274,29 @@ class Member(object):
         :raises: Exception
         """
         if document is not None:
-            # Keep _collectionId in the internal document
-            self.document.update(document)
+            self.document.update(publicfields(document))
 
-        # TODO What happens if _id is different?
-        inserted = self.__conn.Member.insert_one(self.document)
-        self._id = str(inserted.inserted_id)
+        # The ID given in the constructor is used for the new Member
+        self.document = runsteps(self.__conn, insertmembersteps(self._collectionId, self._id,
+                                                                self.document))
+        self._id = str(self.document['_id'])
+        self.version = 0
         return self._id.encode('utf-8')
 
     def update(self, document=None):
         """Update the fields passed as parameters in the MySQL DB.
 
+        The updated document is kept in this object.
+
         :param document: Member.
         :type document: dict
-        :returns: The updated Member.
-        :rtype: :class:`~InsertOneResult`
+        :returns: The ID of the updated Member.
+        :rtype: str
         :raises: Exception
         """
-        if '_id' in document and self._id != str(document['_id']):
-            raise Exception('IDs differ!')
-
-        auxdoc = self.__conn.Member.find_one_and_update({'_id': ObjectId(self._id)},
-                                                        document)
-
-        if auxdoc is None:
-            document['_id'] = self._id
-            inserted = self.__conn.Member.insert_one(document)
-            self._id = str(inserted.inserted_id)
-
+        auxdoc = runsteps(self.__conn, updatemembersteps(self._collectionId, self._id,
+                                                          document))
+        self.version = auxdoc.get('_version', 0)
+        self.document = publicfields(auxdoc)
         return self._id
 
-
-class JSONFactory(object):
-    """Iterable object which provides JSON version of different objects.
-
-     For instance, :class:`~Member` or :class:`~Collection`.
-
-    :param cursor: MySQL cursor containing the result of a query
-    :type cursor: MySQLdb.cursors.Cursor
-    :param objType: Class which must be used to create the objects returned
-    :type objType: type
-    """
-
-    def __init__(self, objlist):
-        """Constructor of the JSONFactory."""
-        self.cursor = objlist
-        self.index = 0
-        # self.objType = objType
-        # 0: Header must be sent; 1: Send 1st collection; 2: Send more items
-        # 3: Headers have been closed and StopIteration should be raised
-        self.status = 0
-        self.content_type = 'application/json'
-
-    def __iter__(self):
-        """Iterative method."""
-        return self
-
-    def next(self):
-        """Return the next object.
-
-        Tuples are read from the cursor and returned in JSON format. A veriable
-        "status" is defined to track in which state are we. Meanings are:
-        0 = Header must be sent ('{"contents": [').
-        1 = Send 1st element.
-        2 = Send the rest of the elements.
-        3 = Headers have been closed and StopIteration should be raised.
-
-        :raises: StopIteration
-        """
-        # Send headers
-        if self.status == 0:
-            self.status = 1
-            return b'{"contents": ['
-
-        # Headers have been closed. Raise StopIteration
-        if self.status == 3:
-            raise StopIteration
-
-        # Load a record
-        reg = self.cursor.fetchone()
-
-        if reg is None:
-            # There are no records, close cursor and headers, set status = 3
-            self.status = 3
-            return b']}'
-
-        tosend = json.dumps(reg, cls=DCEncoder)
-        if self.status == 1:
-            self.status = 2
-            # Send first collection
-            return tosend.encode('utf-8')
-        else:
-            # Status=2 send a separator and a collection
-            return (', %s' % tosend).encode('utf-8')
-
-    __next__ = next
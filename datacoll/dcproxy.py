@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Download of the content of the Members
+
+The content of a Member is the resource pointed by its PID (resolved by the
+Handle proxy) or by its location. The service can redirect the client to it
+or act as a proxy, streaming the content while it is read from the upstream
+server.
+
+The headers Range and If-Range of the request are forwarded, so that a part
+of a file can be read or a transfer resumed. The status and the headers
+describing the content (e.g. Content-Range) are sent back as received. Only
+http and https locations are proxied. The client is redirected to any other.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import urllib.parse
+import urllib.error
+import urllib.request as ul
+
+# Ways to serve the content of a Member
+downloadModes = ('redirect', 'proxy')
+
+# Schemes of the locations which can be proxied
+proxySchemes = ('http', 'https')
+
+# Headers of the request forwarded to the upstream server
+forwardHeaders = ('Range', 'If-Range')
+
+# Headers of the upstream response sent back to the client
+relayHeaders = ('Content-Type', 'Content-Length', 'Content-Range', 'Accept-Ranges',
+                'ETag', 'Last-Modified', 'Content-Disposition')
+
+# Status of the upstream responses sent back to the client. Other errors are
+# reported as a bad gateway.
+relayStatus = (200, 206, 416)
+
+
+def downloadoptions(config):
+    """Read the options of the download of Members.
+
+    :param config: Configuration of the service.
+    :type config: configparser.RawConfigParser
+    :returns: Mode (redirect or proxy), seconds the redirections can be cached
+        (maxage), size in bytes of the chunks read from the upstream server
+        (chunksize), timeout in seconds of its connection (timeout), number
+        of Members fetched at the same time to build an archive (fetchworkers),
+        size in bytes of a Member kept in memory (spoolsize), directory of the
+        cache of the content (cachedir, empty to disable it) and maximum size
+        in bytes of the cache (cachesize).
+    :rtype: dict
+    :raises: Exception
+    """
+    mode = config.get('download', 'mode', fallback='redirect').strip().lower()
+    if mode not in downloadModes:
+        raise Exception('Unknown download mode %s' % mode)
+    return {'mode': mode,
+            'maxage': config.getint('download', 'maxage', fallback=3600),
+            'chunksize': config.getint('download', 'chunksize', fallback=1048576),
+            'timeout': config.getfloat('download', 'timeout', fallback=30.0),
+            'fetchworkers': max(1, config.getint('download', 'fetchworkers', fallback=4)),
+            'spoolsize': config.getint('download', 'spoolsize', fallback=8388608),
+            'cachedir': config.get('download', 'cachedir', fallback='').strip(),
+            'cachesize': config.getint('download', 'cachesize', fallback=10737418240)}
+
+
+def downloadurl(document):
+    """Return the URL of the content of a Member.
+
+    :param document: Member.
+    :type document: dict
+    :returns: The URL or None if the Member has no PID nor location.
+    :rtype: str
+    """
+    pid = document.get('pid')
+    if isinstance(pid, str) and len(pid):
+        return 'http://hdl.handle.net/%s' % pid
+    location = document.get('location')
+    return location if isinstance(location, str) and len(location) else None
+
+
+def canproxy(url):
+    """Check whether the content of a URL can be streamed through the service."""
+    return urllib.parse.urlsplit(url).scheme.lower() in proxySchemes
+
+
+def forwarded(headers):
+    """Select the headers of a request to forward to the upstream server.
+
+    The content is always requested without a content coding, so that the
+    byte ranges refer to the file itself.
+
+    :param headers: Headers of the request.
+    :type headers: dict
+    :rtype: dict
+    """
+    result = {name: headers[name] for name in forwardHeaders if name in headers}
+    result['Accept-Encoding'] = 'identity'
+    return result
+
+
+def relayed(headers):
+    """Select the headers of an upstream response to send to the client.
+
+    :param headers: Headers of the upstream response.
+    :type headers: dict
+    :rtype: dict
+    """
+    result = {name: headers[name] for name in relayHeaders if name in headers}
+    result.setdefault('Content-Type', 'application/octet-stream')
+    return result
+
+
+class urlFile(object):
+    """Iterable object which retrieves the bitstream pointed by a URL.
+
+    The request is sent by :meth:`open`, so that the status and headers of the
+    response are known before the content is iterated.
+    """
+
+    def __init__(self, url, headers=None, chunksize=1048576, timeout=30.0, method='GET'):
+        """Create the iterable object.
+
+        :param url: URL to download the data from.
+        :type url: string
+        :param headers: Headers of the request (see :func:`forwarded`).
+        :type headers: dict
+        :param chunksize: Size in bytes of the chunks read.
+        :type chunksize: int
+        :param timeout: Timeout in seconds of the connection.
+        :type timeout: float
+        :param method: GET or HEAD.
+        :type method: str
+        """
+        self.url = url
+        self.chunksize = chunksize
+        self.timeout = timeout
+        self.request = ul.Request(url, headers=headers or dict(), method=method)
+        self.status = None
+        self.headers = dict()
+        self.response = None
+
+    def open(self):
+        """Send the request to the upstream server.
+
+        :raises: Exception if the server cannot be reached or it returns an
+            error which is not in relayStatus.
+        """
+        try:
+            self.response = ul.urlopen(self.request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code not in relayStatus:
+                e.close()
+                raise Exception('%s returned the error %d' % (self.url, e.code))
+            self.response = e
+        self.status = self.response.getcode()
+        self.headers = relayed(self.response.headers)
+        return self
+
+    def __iter__(self):
+        """Generate the content in chunks while it is read."""
+        if self.response is None:
+            self.open()
+        try:
+            while True:
+                # Each chunk is sent as read, without copying it to a buffer
+                buf = self.response.read(self.chunksize)
+                if not len(buf):
+                    break
+                yield buf
+        finally:
+            self.response.close()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - Requests and responses of the API
+
+The parameters of the requests are read and the documents of the responses
+are built here, independently of the web framework, so that the CherryPy
+(:mod:`datacoll.datacoll`) and the aiohttp (:mod:`datacoll.dcasync`) front
+ends serve exactly the same API. An invalid request raises
+:class:`RequestError`, which each front end sends as an HTTP error.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import json
+from datacoll.dcarchive import archiveFormats
+from datacoll.dccompress import codedetag
+from datacoll.dcformat import canonicaltype
+from datacoll.dcformat import decode
+from datacoll.dcformat import etagSuffix
+from datacoll.dcformat import mediatypes
+from datacoll.dcformat import selectformat
+from datacoll.dcjson import dumps
+from datacoll.dcmodel import indexField
+from datacoll.dcmodel import isordered
+from datacoll.dcmodel import keysetclause
+from datacoll.dcmodel import makeetag
+from datacoll.dcmodel import matchclause
+from datacoll.dcmodel import matchfield
+from datacoll.dcmodel import memberfilter
+from datacoll.dcmodel import parsesort
+from datacoll.dcmodel import projection
+
+# Content types for a list of JSON documents, one per line
+ndjsontypes = ('application/x-ndjson', 'application/ndjson')
+
+# For the time being these are the capabilities for the immutable datasets
+# coming from the user requests.
+capabilitiesFixed = {
+                      "isOrdered": False,
+                      "appendsToEnd": True,
+                      "supportsRoles": False,
+                      "membershipIsMutable": True,
+                      "metadataIsMutable": True,
+                      "restrictedToType": "string",
+                      "maxLength": -1,
+                      "ruleBasedGeneration": False
+                    }
+
+# Features of the service returned by the features method
+features = {
+            "providesCollectionPids": False,
+            "collectionPidProviderType": "string",
+            "enforcesAccess": False,
+            "supportsPagination": True,
+            "asynchronousActions": False,
+            "ruleBasedGeneration": False,
+            "maxExpansionDepth": 4,
+            "providesVersioning": False,
+            "supportedCollectionOperations": ["findMatch", "intersection", "union", "flatten"],
+            "supportedModelTypes": [],
+            "supportedMediaTypes": list(mediatypes)
+           }
+
+
+class RequestError(Exception):
+    """Invalid request. It is sent to the client with the given HTTP status."""
+
+    def __init__(self, status, message):
+        """Constructor of the error.
+
+        :param status: HTTP status of the response.
+        :type status: int
+        :param message: Description of the error.
+        :type message: str
+        """
+        super().__init__(message)
+        self.status = status
+
+
+def errorbody(message):
+    """Return the body in JSON format of an error response.
+
+    :param message: Description of the error.
+    :type message: str
+    :rtype: str
+    """
+    messdict = {'code': 0,
+                'message': message}
+    return dumps(messdict)
+
+
+def collcapabilities(document):
+    """Return the capabilities of a Collection.
+
+    :param document: Collection.
+    :type document: dict
+    :returns: The fixed capabilities updated with the ones of the Collection.
+    :rtype: dict
+    """
+    capabilities = document.get('capabilities')
+    if not isinstance(capabilities, dict):
+        return capabilitiesFixed.copy()
+    return dict(capabilitiesFixed, **capabilities)
+
+
+def collstats(document, count, size):
+    """Return the statistics of the Members of a Collection.
+
+    :param document: Collection.
+    :type document: dict
+    :param count: Number of Members.
+    :type count: int
+    :param size: Sum of the sizes declared by the Members.
+    :type size: int
+    :rtype: dict
+    """
+    return {'memberCount': count,
+            'memberBytes': size,
+            'maxLength': collcapabilities(document)['maxLength']}
+
+
+def opsoptions(kwargs):
+    """Read the options of an operation on Collections from the query.
+
+    :param kwargs: Parameters of the request.
+    :type kwargs: dict
+    :returns: Field used to compare the Members (by) and number of levels
+        of Collections expanded (depth).
+    :rtype: tuple
+    :raises: RequestError
+    """
+    try:
+        field = matchfield(kwargs.get('by', 'checksum'))
+    except Exception as e:
+        raise RequestError(400, str(e))
+
+    maxdepth = features['maxExpansionDepth']
+    try:
+        depth = int(kwargs.get('depth', maxdepth))
+        if not 0 <= depth <= maxdepth:
+            raise ValueError
+    except ValueError:
+        raise RequestError(400, 'depth must be an integer between 0 and %d' % maxdepth)
+    return field, depth
+
+
+def pagination(kwargs, limit, defaultsort=None):
+    """Read the pagination parameters from the query of a list request.
+
+    :param kwargs: Parameters of the request.
+    :type kwargs: dict
+    :param limit: Default and maximum page size.
+    :type limit: int
+    :param defaultsort: Sort order if none is given (e.g. mappings.index in
+        an ordered Collection). By default, the _id.
+    :type defaultsort: str
+    :returns: Page size, cursor and sort specification.
+    :rtype: tuple
+    :raises: RequestError
+    """
+    try:
+        pagesize = int(kwargs.get('limit', limit))
+        if pagesize <= 0:
+            raise ValueError
+    except ValueError:
+        raise RequestError(400, 'limit must be a positive integer')
+
+    cursor = kwargs.get('cursor')
+    sort = kwargs.get('sort', defaultsort)
+    try:
+        parsesort(sort)
+        # The cursor must point to a value which can be compared like in MongoDB
+        if cursor is not None:
+            keysetclause(sort or '_id', cursor)
+    except Exception as e:
+        raise RequestError(400, str(e))
+
+    # The configured limit is also the maximum page size
+    return min(pagesize, limit), cursor, sort
+
+
+def memberspage(kwargs, limit, coll):
+    """Read the parameters of the request of a list of Members.
+
+    :param kwargs: Parameters of the request.
+    :type kwargs: dict
+    :param limit: Default and maximum page size.
+    :type limit: int
+    :param coll: Collection of the Members.
+    :type coll: dict
+    :returns: Page size, cursor, sort specification and filter.
+    :rtype: tuple
+    :raises: RequestError
+    """
+    # Members of an ordered collection are sent by their position
+    defaultsort = indexField if isordered(coll) else None
+    pagesize, cursor, sort = pagination(kwargs, limit, defaultsort)
+    try:
+        filters = memberfilter(kwargs)
+    except Exception as e:
+        raise RequestError(400, str(e))
+    return pagesize, cursor, sort, filters
+
+
+def getprojection(kwargs):
+    """Read the fields to retrieve from the query of a GET request.
+
+    :param kwargs: Parameters of the request.
+    :type kwargs: dict
+    :returns: Projection of the fields or None to retrieve full documents.
+    :rtype: dict
+    :raises: RequestError
+    """
+    try:
+        return projection(kwargs.get('fields'))
+    except Exception as e:
+        raise RequestError(400, str(e))
+
+
+def archiveformat(kwargs):
+    """Read the format of the archive of a Collection from the query.
+
+    :param kwargs: Parameters of the request.
+    :type kwargs: dict
+    :returns: tar (default) or zip.
+    :rtype: str
+    :raises: RequestError
+    """
+    fmt = kwargs.get('format', 'tar')
+    if fmt not in archiveFormats:
+        raise RequestError(400, 'Archive format must be %s' % ' or '.join(sorted(archiveFormats)))
+    return fmt
+
+
+def readndjson(body):
+    """Read a list of JSON documents, one per line.
+
+    :param body: Content in NDJSON format.
+    :type body: bytes
+    :returns: The documents read. Lines which are not valid JSON are None.
+    :rtype: list
+    """
+    documents = list()
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            documents.append(json.loads(line))
+        except ValueError:
+            documents.append(None)
+    return documents
+
+
+def readmembers(body, contenttype):
+    """Read one Member or a list of them from the body of a POST.
+
+    Many Members can be sent as an array, one after the other in BSON or as
+    one JSON per line.
+
+    :param body: Decompressed body of the request.
+    :type body: bytes
+    :param contenttype: Value of the Content-Type header.
+    :type contenttype: str
+    :returns: A document or a list of documents.
+    :rtype: object
+    :raises: RequestError
+    """
+    if canonicaltype(contenttype) in ndjsontypes:
+        return readndjson(body)
+    try:
+        return decode(body, canonicaltype(contenttype))
+    except ValueError:
+        raise RequestError(400, 'Member is not a valid JSON document')
+
+
+def beforedocuments(coll, collid, jsonmemb):
+    """Return the Members which must be inserted before another one (before=).
+
+    Members inserted in the middle of an ordered Collection take the positions
+    between the given Member and the previous one.
+
+    :param coll: Collection.
+    :type coll: dict
+    :param collid: Collection ID.
+    :type collid: str
+    :param jsonmemb: Member or list of Members of the request.
+    :type jsonmemb: object
+    :returns: The valid documents, which receive their positions in order.
+    :rtype: list
+    :raises: RequestError
+    """
+    if not isordered(coll):
+        raise RequestError(400, 'Collection %s is not ordered' % collid)
+    return [doc for doc in (jsonmemb if isinstance(jsonmemb, list) else [jsonmemb])
+            if isinstance(doc, dict)]
+
+
+def orderedinsert(kwargs):
+    """Return whether the insertion of many Members stops at the first error.
+
+    By default it does, like a sequence of single POSTs.
+    """
+    return kwargs.get('ordered', 'true').lower() != 'false'
+
+
+def insertedresult(inserted, errors):
+    """Return the response to the insertion of many Members.
+
+    :param inserted: IDs of the Members created.
+    :type inserted: list
+    :param errors: Errors found (see :func:`~datacoll.dcmodel.insertresult`).
+    :type errors: list
+    :returns: Status, reason phrase and document of the response.
+    :rtype: tuple
+    """
+    result = {'created': inserted, 'errors': errors}
+    if len(inserted):
+        return 201, '%d Members created' % len(inserted), result
+    return 400, None, result
+
+
+def checkid(document, docid, kind):
+    """Check that the _id of the document of a PUT is the one in the path.
+
+    :param document: Document of the request.
+    :type document: dict
+    :param docid: ID in the path.
+    :type docid: str
+    :param kind: Collection or Member.
+    :type kind: str
+    :raises: RequestError
+    """
+    if '_id' in document and str(document['_id']) != docid:
+        raise RequestError(400, '%s ID in the document differs from %s' % (kind, docid))
+
+
+def checkmatch(document):
+    """Check the Member sent to findMatch.
+
+    :param document: Member to compare with.
+    :type document: dict
+    :raises: RequestError
+    """
+    try:
+        matchclause(document)
+    except Exception as e:
+        raise RequestError(400, 'Invalid member: %s' % e)
+
+
+def collectionetag(collid, version, fields=None):
+    """Return the entity tag of a Collection with the fields requested."""
+    return makeetag(collid, version, fields)
+
+
+def memberetag(collid, memberid, version, fields=None):
+    """Return the entity tag of a Member with the fields requested."""
+    return makeetag(collid, memberid, version, fields)
+
+
+def membersetag(collid, mversion, kwargs, sort):
+    """Return the entity tag of a page of Members.
+
+    The list changes only if the Members of the Collection change.
+    """
+    return makeetag(collid, mversion, sorted(kwargs.items()), sort)
+
+
+def downloadetag(collid, memberid, version):
+    """Return the entity tag of the redirection to the content of a Member.
+
+    The location changes only if the Member is updated.
+    """
+    return makeetag(collid, memberid, version, 'download')
+
+
+def representationetag(etag, accept, coding=None):
+    """Return the entity tag of a document in the format and coding negotiated.
+
+    :param etag: Quoted entity tag of the document.
+    :type etag: str
+    :param accept: Value of the Accept header of the request.
+    :type accept: str
+    :param coding: Content coding of the response.
+    :type coding: str
+    :rtype: str
+    """
+    etag = codedetag(etag, etagSuffix.get(selectformat(accept)))
+    return codedetag(etag, coding)
+
+
+def etagmatches(condition, etag):
+    """Return whether the If-None-Match header of a request matches an entity tag.
+
+    :param condition: Value of the If-None-Match header or None.
+    :type condition: str
+    :param etag: Quoted entity tag of the response.
+    :type etag: str
+    :rtype: bool
+    """
+    if condition is None:
+        return False
+    tags = [tag.strip() for tag in condition.split(',')]
+    return '*' in tags or etag in tags
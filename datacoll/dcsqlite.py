@@ -0,0 +1,1178 @@
+#!/usr/bin/env python
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - SQLite storage engine
+
+Collections and Members are stored as JSON documents in a SQLite file, with
+indexed columns for the fields used by most queries (collection ID, checksum
+and location of the Members). The DB is opened in WAL mode, so that readers
+are not blocked by a writer, and every thread uses its own connection.
+
+The same filters built by :mod:`datacoll.dcmodel` are translated to SQL.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import re
+import json
+import math
+import datetime
+import itertools
+import sqlite3
+import threading
+from contextlib import contextmanager
+from bson import json_util
+from bson.objectid import ObjectId
+from datacoll.dcbase import PageBase
+from datacoll.dcbase import ResultPage
+from datacoll.dcbase import CollectionsBase
+from datacoll.dcbase import MembersBase
+from datacoll.dcbase import CollectionBase
+from datacoll.dcbase import MemberBase
+from datacoll.dcbase import CollectionFull
+from datacoll.dcmodel import project
+from datacoll.dcmodel import assignindexes
+from datacoll.dcmodel import declaredsize
+from datacoll.dcmodel import encodecursor
+from datacoll.dcmodel import fieldPattern
+from datacoll.dcmodel import sortBrackets
+from datacoll.dcmodel import flattenmembers
+from datacoll.dcmodel import fullerrors
+from datacoll.dcmodel import fullmessage
+from datacoll.dcmodel import indexrange
+from datacoll.dcmodel import insertresult
+from datacoll.dcmodel import internalFields
+from datacoll.dcmodel import internalprojection
+from datacoll.dcmodel import isordered
+from datacoll.dcmodel import matchclause
+from datacoll.dcmodel import matchfield
+from datacoll.dcmodel import maxlength
+from datacoll.dcmodel import memberindex
+from datacoll.dcmodel import memberdocuments
+from datacoll.dcmodel import pagedquery
+from datacoll.dcmodel import publicfields
+from datacoll.dcmodel import spacedkeys
+
+schema = (
+    '''CREATE TABLE IF NOT EXISTS collection (
+           id TEXT PRIMARY KEY,
+           version INTEGER NOT NULL DEFAULT 0,
+           mversion INTEGER NOT NULL DEFAULT 0,
+           mcount INTEGER,
+           mbytes INTEGER,
+           nextindex INTEGER,
+           document TEXT NOT NULL
+       )''',
+    '''CREATE TABLE IF NOT EXISTS member (
+           id TEXT PRIMARY KEY,
+           cid TEXT NOT NULL,
+           checksum TEXT,
+           location TEXT,
+           version INTEGER NOT NULL DEFAULT 0,
+           document TEXT NOT NULL
+       )'''
+)
+
+# Columns added to the tables after their first version. NULL counters of
+# Members are computed by recount, and a NULL nextindex when a Member is appended.
+addedColumns = {'collection': (('mcount', 'INTEGER'), ('mbytes', 'INTEGER'),
+                               ('nextindex', 'INTEGER'))}
+
+# Position of a Member in an ordered Collection (see dcmodel.memberindex)
+indexExpr = "json_extract(document, '$.mappings.index')"
+
+
+# Size declared in the document of a Member (see dcmodel.declaredsize)
+sizeExpr = ("CASE WHEN json_type(document, '$.size') = 'integer' "
+            "AND json_extract(document, '$.size') >= 0 "
+            "THEN json_extract(document, '$.size') ELSE 0 END")
+
+# Indexes needed by the queries on each table
+indexSpec = {
+             'collection_pid': "collection (json_extract(document, '$.pid'))",
+             'collection_name': "collection (json_extract(document, '$.name'))",
+             'member_cid_id': 'member (cid, id)',
+             'member_checksum': 'member (checksum)',
+             'member_location': 'member (location)',
+             'member_pid': "member (json_extract(document, '$.pid'))",
+             'member_cid_datatype': "member (cid, json_extract(document, '$.datatype'))",
+             'member_cid_index': "member (cid, json_extract(document, '$.mappings.index'))"
+            }
+
+# Fields of the documents stored in their own columns
+collectionColumns = {'_id': 'id'}
+memberColumns = {'_id': 'id', '_collectionId': 'cid', 'checksum': 'checksum',
+                 'location': 'location'}
+
+# Tables where the documents of each Mongo collection are stored
+tables = {'Collection': 'collection', 'Member': 'member',
+          'collection': 'collection', 'member': 'member'}
+
+# Comparison operators of MongoDB and SQL
+sqlOperators = {'$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}
+
+# Values of json_type of the types of a $type filter
+jsonTypes = {'null': ('null',), 'number': ('integer', 'real'), 'string': ('text',),
+             'object': ('object',), 'array': ('array',), 'bool': ('true', 'false')}
+
+# Keys of the JSON documents storing the values of the BSON types (see
+# bson.json_util). Their content is compared instead of the whole document.
+bsonKeys = {'binData': '$binary', 'objectId': '$oid', 'date': '$date'}
+
+# The documents are read from a local file. There is no cache of Collections.
+collectionCache = None
+
+
+class SQLiteDB(object):
+    """SQLite file shared by the threads of the service.
+
+    Each thread opens its own connection the first time it uses the DB.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        """Constructor of the DB.
+
+        :param path: Path of the SQLite file.
+        :type path: str
+        :param timeout: Seconds to wait for a lock held by another writer.
+        :type timeout: float
+        """
+        self.path = path
+        self.timeout = timeout
+        self.__local = threading.local()
+
+        with self.transaction() as cursor:
+            for statement in schema:
+                cursor.execute(statement)
+            # Files created by a previous version
+            for table, columns in addedColumns.items():
+                existing = {row['name'] for row in cursor.execute('PRAGMA table_info(%s)' % table)}
+                for name, definition in columns:
+                    if name not in existing:
+                        cursor.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, name, definition))
+
+    @property
+    def connection(self):
+        """Connection of the current thread."""
+        connection = getattr(self.__local, 'connection', None)
+        if connection is None:
+            # Transactions are controlled explicitly with transaction()
+            connection = sqlite3.connect(self.path, timeout=self.timeout,
+                                         isolation_level=None,
+                                         check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.create_function('regexp', 2, regexp, deterministic=True)
+            self.__local.connection = connection
+        return connection
+
+    def execute(self, sql, params=()):
+        """Run a statement out of a transaction and return the cursor."""
+        return self.connection.execute(sql, params)
+
+    def fetchone(self, sql, params=()):
+        """Run a query out of a transaction and return its first row.
+
+        The cursor is closed, so that the snapshot of the DB read by the
+        query is not kept by the connection.
+        """
+        cursor = self.connection.execute(sql, params)
+        try:
+            return cursor.fetchone()
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        """Run the statements of a with block in a write transaction.
+
+        The transaction is committed at the end of the block or rolled back
+        if an exception is raised.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+
+
+def regexp(pattern, value):
+    """Implementation of the REGEXP operator of SQLite."""
+    return isinstance(value, str) and re.search(pattern, value) is not None
+
+
+def connect(config):
+    """Open the SQLite file defined in the configuration.
+
+    :param config: Configuration with a [sqlite] section.
+    :type config: configparser.RawConfigParser
+    :returns: The DB.
+    :rtype: :class:`~SQLiteDB`
+    """
+    return SQLiteDB(config.get('sqlite', 'path', fallback='datacoll.db'),
+                    config.getfloat('sqlite', 'timeout', fallback=30.0))
+
+
+def readconnection(conn, config):
+    """Reads and writes share the same file. It is returned unchanged."""
+    return conn
+
+
+def ensureindexes(conn):
+    """Create the indexes declared in indexSpec which are missing.
+
+    :param conn: DB.
+    :type conn: :class:`~SQLiteDB`
+    :returns: Names of the indexes created.
+    :rtype: list
+    """
+    existing = {row['name'] for row in conn.execute("SELECT name FROM sqlite_master "
+                                                    "WHERE type = 'index'")}
+    created = list()
+    with conn.transaction() as cursor:
+        for name, definition in indexSpec.items():
+            if name not in existing:
+                cursor.execute('CREATE INDEX %s ON %s' % (name, definition))
+                created.append(name)
+    return created
+
+
+def warmcache(conn, collids):
+    """Documents are read from a local file. Nothing is loaded."""
+    pass
+
+
+def touch(cursor, collid, count=0, size=0):
+    """Increase the counter of changes in the Members of a Collection.
+
+    The number of Members and their bytes are increased by count and size.
+    They stay NULL until they are computed by :func:`recount`.
+    """
+    cursor.execute('UPDATE collection SET mversion = mversion + 1, mcount = mcount + ?, '
+                   'mbytes = mbytes + ? WHERE id = ?', (count, size, collid))
+
+
+def recountcursor(cursor, collids=None):
+    """Compute the counters of Members inside a transaction (see :func:`recount`)."""
+    if collids is None:
+        collids = [row['id'] for row in cursor.execute('SELECT id FROM collection '
+                                                       'WHERE mcount IS NULL').fetchall()]
+    for collid in collids:
+        cursor.execute('UPDATE collection SET mcount = (SELECT count(*) FROM member WHERE cid = ?), '
+                       'mbytes = (SELECT coalesce(sum(%s), 0) FROM member WHERE cid = ?) '
+                       'WHERE id = ?' % sizeExpr, (str(collid), str(collid), str(collid)))
+    return len(collids)
+
+
+def recount(conn, collids=None):
+    """Compute again the counters of Members of some Collections.
+
+    :param conn: DB.
+    :type conn: :class:`~SQLiteDB`
+    :param collids: IDs of the Collections. By default, the ones without counters.
+    :type collids: list
+    :returns: Number of Collections updated.
+    :rtype: int
+    """
+    with conn.transaction() as cursor:
+        return recountcursor(cursor, collids)
+
+
+def positions(cursor, collid, documents):
+    """Append the Members without a position at the end of an ordered Collection.
+
+    It must be called inside the write transaction of the insertion.
+
+    :param cursor: Cursor of the transaction.
+    :type cursor: sqlite3.Cursor
+    :param collid: Collection ID.
+    :type collid: str
+    :param documents: Members to insert.
+    :type documents: list
+    """
+    row = cursor.execute('SELECT id, version, nextindex, document FROM collection WHERE id = ?',
+                         (collid,)).fetchone()
+    if row is None or not isordered(loaddocument(row)):
+        return
+
+    first = row['nextindex']
+    if first is None:
+        # Collections made ordered after their Members were inserted
+        last = cursor.execute("SELECT max(%s) AS last FROM member WHERE cid = ? AND "
+                              "json_type(document, '$.mappings.index') IN ('integer', 'real')"
+                              % indexExpr, (collid,)).fetchone()['last']
+        first = math.floor(last) + 1 if last is not None else 0
+
+    missing, minimum = indexrange(documents)
+    first = max(first, minimum or 0)
+    assignindexes(documents, first)
+    cursor.execute('UPDATE collection SET nextindex = ? WHERE id = ?', (first + missing, collid))
+
+
+def room(cursor, collid, wanted):
+    """Return how many Members can still be added to a Collection.
+
+    It must be called inside the write transaction of the insertion.
+
+    :param cursor: Cursor of the transaction.
+    :type cursor: sqlite3.Cursor
+    :param collid: Collection ID.
+    :type collid: str
+    :param wanted: Number of Members to insert.
+    :type wanted: int
+    :returns: Number of Members which fit and the maxLength (-1 if there is none).
+    :rtype: tuple
+    :raises: Exception
+    """
+    row = cursor.execute('SELECT id, version, mcount, document FROM collection WHERE id = ?',
+                         (collid,)).fetchone()
+    if row is None:
+        raise Exception('Collection %s does not exist!' % collid)
+    maxlen = maxlength(loaddocument(row))
+    if maxlen < 0:
+        return wanted, maxlen
+
+    count = row['mcount']
+    if count is None:
+        recountcursor(cursor, [collid])
+        count = cursor.execute('SELECT mcount FROM collection WHERE id = ?',
+                               (collid,)).fetchone()['mcount']
+    return max(min(wanted, maxlen - count), 0), maxlen
+
+
+def dbvalue(value):
+    """Convert a value of a document to the type stored in SQLite."""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        # Content of the JSON document of the date (ISO 8601 string)
+        return json.loads(json_util.dumps(value))['$date']
+    return value
+
+
+def objectid(value):
+    """Convert an ID read from SQLite to the type used in the documents."""
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+
+def dumpdocument(document):
+    """Return the JSON stored for a document, without IDs and internal fields."""
+    return json_util.dumps({k: v for k, v in document.items()
+                            if k not in ('_id', '_collectionId') + internalFields})
+
+
+def loaddocument(row):
+    """Rebuild the document of a Collection or Member from a row of the DB."""
+    document = {'_id': objectid(row['id'])}
+    if 'cid' in row.keys():
+        document['_collectionId'] = objectid(row['cid'])
+    document.update(json_util.loads(row['document']))
+    document['_version'] = row['version']
+    if 'mversion' in row.keys():
+        document['_mversion'] = row['mversion']
+    # Counters of Members which have not been computed are left out as in MongoDB
+    for column, field in (('mcount', '_count'), ('mbytes', '_bytes'),
+                          ('nextindex', '_nextIndex')):
+        if column in row.keys() and row[column] is not None:
+            document[field] = row[column]
+    return document
+
+
+def dumptable(conn, table):
+    """Read all documents of a table, including their internal fields.
+
+    :param conn: DB.
+    :type conn: :class:`~SQLiteDB`
+    :param table: collection or member.
+    :type table: str
+    :returns: Generator of documents as they would be stored in MongoDB.
+    """
+    for row in conn.execute('SELECT * FROM %s ORDER BY id' % tables[table]):
+        yield loaddocument(row)
+
+
+def loadtable(conn, table, documents):
+    """Store documents in a table replacing the ones with the same ID.
+
+    :param conn: DB.
+    :type conn: :class:`~SQLiteDB`
+    :param table: collection or member.
+    :type table: str
+    :param documents: Documents as they are stored in MongoDB.
+    :type documents: iterable
+    :returns: Number of documents stored.
+    :rtype: int
+    """
+    count = 0
+    collids = set()
+    with conn.transaction() as cursor:
+        for document in documents:
+            if tables[table] == 'collection':
+                cursor.execute('INSERT OR REPLACE INTO collection (id, version, mversion, '
+                               'mcount, mbytes, nextindex, document) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                               (str(document['_id']), document.get('_version', 0),
+                                document.get('_mversion', 0), document.get('_count'),
+                                document.get('_bytes'), document.get('_nextIndex'),
+                                dumpdocument(document)))
+            else:
+                cursor.execute('INSERT OR REPLACE INTO member (id, cid, checksum, location, '
+                               'document, version) VALUES (?, ?, ?, ?, ?, ?)',
+                               memberrow(document['_collectionId'], document) +
+                               (document.get('_version', 0),))
+                collids.add(str(document['_collectionId']))
+            count += 1
+        # The Members replaced may not be the ones counted in the Collection
+        recountcursor(cursor, sorted(collids))
+    return count
+
+
+def textcolumn(document, field):
+    """Return the value of a field if it can be stored in a column of text."""
+    value = document.get(field)
+    return value if isinstance(value, str) else None
+
+
+def fieldexpr(field, columns, values=()):
+    """Return the SQL expression of a field in a filter or in a sort order.
+
+    :param field: Name of the field (possibly dotted).
+    :type field: str
+    :param columns: Fields stored in their own columns.
+    :type columns: dict
+    :param values: Values compared with the field. Columns other than the IDs
+        store only strings, so they are used only if all values are strings.
+    :type values: iterable
+    :returns: SQL expression and True if it is a JSON field.
+    :rtype: tuple
+    :raises: Exception
+    """
+    if field in columns and (field in ('_id', '_collectionId') or
+                             all(isinstance(v, str) for v in values)):
+        return columns[field], False
+
+    return "json_extract(document, '%s')" % jsonpath(field, values), True
+
+
+def jsonpath(field, values=()):
+    """Return the JSON path of a field compared with some values.
+
+    ObjectIds and dates are stored as JSON documents, so the path points to
+    their content if all values are of one of these types.
+
+    :raises: Exception
+    """
+    if not fieldPattern.match(field):
+        raise Exception('Invalid field %s' % field)
+    path = '$.%s' % field
+    if len(values) and all(isinstance(v, ObjectId) for v in values):
+        return '%s."%s"' % (path, bsonKeys['objectId'])
+    if len(values) and all(isinstance(v, datetime.datetime) for v in values):
+        return '%s."%s"' % (path, bsonKeys['date'])
+    return path
+
+
+def typeguard(field, value):
+    """Restrict a comparison to the values of a JSON field of the same type."""
+    if isinstance(value, bool):
+        return "json_type(document, '$.%s') IN ('true', 'false')" % field
+    if isinstance(value, (int, float)):
+        return "json_type(document, '$.%s') IN ('integer', 'real')" % field
+    return "json_type(document, '%s') = 'text'" % jsonpath(field, [value])
+
+
+def sqltype(field, name):
+    """Translate a $type filter to SQL.
+
+    :param field: Name of the field.
+    :type field: str
+    :param name: Alias of the type in MongoDB (see sortBrackets).
+    :type name: str
+    :raises: Exception
+    """
+    path = jsonpath(field)
+    if name in bsonKeys:
+        return "json_type(document, '%s.\"%s\"') IS NOT NULL" % (path, bsonKeys[name])
+    if name not in jsonTypes:
+        raise Exception('Type %s is not supported' % name)
+
+    condition = "json_type(document, '%s') IN (%s)" % (path, ', '.join("'%s'" % t for t in
+                                                                          jsonTypes[name]))
+    if name == 'object':
+        # The documents storing a BSON value are not documents for MongoDB
+        condition += ''.join(" AND json_type(document, '%s.\"%s\"') IS NULL" % (path, key)
+                             for key in sorted(bsonKeys.values()))
+    return condition
+
+
+def sortexprs(field, columns):
+    """Return the SQL expressions to sort by a field like MongoDB.
+
+    The values are sorted first by their type (see sortBrackets), so that the
+    order is the one of the filters built by keysetclause.
+
+    :param field: Name of the field.
+    :type field: str
+    :param columns: Fields stored in their own columns.
+    :type columns: dict
+    :returns: SQL expressions to sort by.
+    :rtype: list
+    :raises: Exception
+    """
+    if field in ('_id', '_collectionId'):
+        return [columns[field]]
+
+    path = jsonpath(field)
+    bsonwhen = ''.join(" WHEN json_type(document, '%s.\"%s\"') IS NOT NULL THEN %d"
+                       % (path, key, sortBrackets.index(name)) for name, key in bsonKeys.items())
+    jsonwhen = ''.join(" WHEN '%s' THEN %d" % (jsontype, sortBrackets.index(name))
+                       for name, types in jsonTypes.items() if name not in ('null', 'object')
+                       for jsontype in types)
+    bracket = ("CASE json_type(document, '%s')%s WHEN 'object' THEN CASE%s ELSE %d END ELSE 0 END"
+               % (path, jsonwhen, bsonwhen, sortBrackets.index('object')))
+    value = 'COALESCE(%s)' % ', '.join(["json_extract(document, '%s.\"%s\"')" % (path, key)
+                                        for key in (bsonKeys['objectId'], bsonKeys['date'])] +
+                                       ["json_extract(document, '%s')" % path])
+    return [bracket, value]
+
+
+def sqlequals(field, columns, value, params):
+    """Translate an equality of a MongoDB filter to SQL."""
+    expr, isjson = fieldexpr(field, columns, [value])
+    if value is None:
+        return '%s IS NULL' % expr
+
+    params.append(dbvalue(value))
+    if not isjson:
+        return '%s = ?' % expr
+
+    # A value of an array matches like in MongoDB
+    params.append(dbvalue(value))
+    return ("(%s = ? OR (json_type(document, '$.%s') = 'array' AND EXISTS "
+            "(SELECT 1 FROM json_each(document, '$.%s') WHERE value = ?)))"
+            % (expr, field, field))
+
+
+def sqlfilter(clause, columns, params):
+    """Translate a MongoDB filter to a SQL condition.
+
+    Only the operators used by the service are supported ($and, $or, $in,
+    $regex, $type, $gt, $gte, $lt and $lte).
+
+    :param clause: Filter of the query.
+    :type clause: dict
+    :param columns: Fields stored in their own columns.
+    :type columns: dict
+    :param params: List where the parameters of the condition are appended.
+    :type params: list
+    :returns: SQL condition.
+    :rtype: str
+    :raises: Exception
+    """
+    conditions = list()
+    for key, condition in clause.items():
+        if key in ('$and', '$or'):
+            parts = [sqlfilter(c, columns, params) for c in condition]
+            conditions.append('(%s)' % (' AND ' if key == '$and' else ' OR ').join(parts))
+        elif isinstance(condition, dict) and any(k.startswith('$') for k in condition):
+            for op, argument in condition.items():
+                if op == '$in':
+                    parts = [sqlequals(key, columns, arg, params) for arg in argument]
+                    conditions.append('(%s)' % ' OR '.join(parts) if len(parts) else '0')
+                elif op == '$type':
+                    conditions.append('(%s)' % sqltype(key, argument))
+                elif op == '$regex':
+                    expr, isjson = fieldexpr(key, columns, [argument])
+                    conditions.append('%s REGEXP ?' % expr)
+                    params.append(argument)
+                elif op in sqlOperators:
+                    expr, isjson = fieldexpr(key, columns, [argument])
+                    # Values of different types are never compared
+                    guard = '%s AND ' % typeguard(key, argument) if isjson else ''
+                    conditions.append('(%s%s %s ?)' % (guard, expr, sqlOperators[op]))
+                    params.append(dbvalue(argument))
+                else:
+                    raise Exception('Operator %s is not supported' % op)
+        else:
+            conditions.append(sqlequals(key, columns, condition, params))
+
+    return ' AND '.join(conditions) if len(conditions) else '1'
+
+
+def memberbatches(conn, where, params, batchsize=None):
+    """Read the Members selected by a SQL condition in batches.
+
+    Every batch is read at once and the next one starts after the last ID,
+    so that the connection does not keep a snapshot of the DB while the
+    Members are sent.
+
+    :param conn: DB.
+    :type conn: :class:`~SQLiteDB`
+    :param where: SQL condition on the table member with the alias m.
+    :type where: str
+    :param params: Parameters of the condition.
+    :type params: list
+    :param batchsize: Number of Members read in each query.
+    :type batchsize: int
+    :returns: Generator of Members without their internal fields.
+    """
+    batchsize = batchsize or 1000
+    last = ''
+    while True:
+        cursor = conn.execute('SELECT m.* FROM member m WHERE (%s) AND m.id > ? '
+                              'ORDER BY m.id LIMIT ?' % where,
+                              tuple(params) + (last, batchsize))
+        rows = cursor.fetchall()
+        cursor.close()
+        for row in rows:
+            yield publicfields(loaddocument(row))
+        if len(rows) < batchsize:
+            return
+        last = rows[-1]['id']
+
+
+class SQLitePage(PageBase):
+    """One page of the documents of a table selected by a MongoDB filter."""
+
+    def __init__(self, conn, table, columns, clause, limit=None, cursor=None,
+                 sort=None, batchsize=None, fields=None):
+        """Constructor of the page.
+
+        :param conn: DB.
+        :type conn: :class:`~SQLiteDB`
+        :param table: Table to query.
+        :type table: str
+        :param columns: Fields stored in their own columns.
+        :type columns: dict
+        :param clause: Filter of the query.
+        :type clause: dict
+        :param limit: Maximum number of documents in the page.
+        :type limit: int
+        :param cursor: Opaque token pointing to the start of the page.
+        :type cursor: str
+        :param sort: Field to sort by. A leading "-" means descending order.
+        :type sort: str
+        :param batchsize: Not used. The whole page is read at once.
+        :type batchsize: int
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :raise: Exception
+        """
+        self.limit = limit
+        self.sort = sort if sort is not None else '_id'
+        self.next_cursor = None
+        self.__last = None
+        self.__count = 0
+
+        clause, self.__fields, order = pagedquery(clause, self.sort, cursor, fields)
+        params = list()
+        where = sqlfilter(clause, columns, params)
+        orderby = ', '.join('%s %s' % (expr, 'ASC' if direction > 0 else 'DESC')
+                            for key, direction in order for expr in sortexprs(key, columns))
+        params.append(limit + 1 if limit else -1)
+
+        # The page is read at once, so that the connection does not keep a
+        # snapshot of the DB while it is sent and can be used by other threads
+        cursor = conn.execute('SELECT * FROM %s WHERE %s ORDER BY %s LIMIT ?'
+                              % (table, where, orderby), params)
+        self.__rows = cursor.fetchall()
+        self.__rows.reverse()
+        cursor.close()
+
+    def fetchone(self):
+        """Retrieve the next document like a cursor.
+
+        :returns: The next document or None if the page is finished.
+        :rtype: dict
+        """
+        if not len(self.__rows):
+            return None
+
+        document = loaddocument(self.__rows.pop())
+        self.__count += 1
+        if self.limit and self.__count > self.limit:
+            # There are more documents. Point to the last one sent
+            self.next_cursor = encodecursor(self.sort, self.__last)
+            return None
+        self.__last = document
+        return project(document, self.__fields)
+
+
+class Collections(SQLitePage, CollectionsBase):
+    """List of the Collections in SQLite."""
+
+    def __init__(self, conn, limit=None, cursor=None, sort=None, batchsize=None,
+                 fields=None):
+        super().__init__(conn, 'collection', collectionColumns, dict(), limit,
+                         cursor, sort, batchsize, fields)
+
+
+class Members(SQLitePage, MembersBase):
+    """List of the Members of a Collection in SQLite."""
+
+    def __init__(self, conn, collid, limit=None, cursor=None, sort=None,
+                 batchsize=None, fields=None, filters=None):
+        row = conn.fetchone('SELECT mversion FROM collection WHERE id = ?',
+                            (str(collid),))
+        if row is None:
+            raise Exception('Collection %s not found' % collid)
+        # Counter of changes in the Members when the list was read
+        self.mversion = row['mversion']
+
+        clause = {'_collectionId': str(collid)}
+        if filters is not None:
+            clause = {'$and': [clause, filters]}
+        super().__init__(conn, 'member', memberColumns, clause, limit, cursor, sort,
+                         batchsize, fields)
+
+
+class Collection(CollectionBase):
+    """A Collection stored in SQLite."""
+
+    def __init__(self, conn, collid=None, fields=None, fetch=True):
+        """Constructor of a Collection object.
+
+        :param conn: DB.
+        :type conn: :class:`~SQLiteDB`
+        :param collid: Collection ID.
+        :type collid: str
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :param fetch: Read the document. If False, the Collection can only be
+            inserted with this ID, updated or deleted.
+        :type fetch: bool
+        :raises: Exception
+        """
+        self.__conn = conn
+        if collid is None:
+            self.document = dict()
+            self._id = None
+            self.version = 0
+            return
+
+        # _id must always be a str
+        self._id = collid.decode('utf-8') if isinstance(collid, bytes) else str(collid)
+
+        if not fetch:
+            self.document = None
+            self.version = None
+            return
+
+        row = conn.fetchone('SELECT id, version, document FROM collection WHERE id = ?',
+                            (self._id,))
+        if row is None:
+            raise Exception('Collection %s does not exist!' % self._id)
+        document = project(loaddocument(row), internalprojection(fields))
+
+        # Number of updates of the document
+        self.version = document.get('_version', 0)
+        self.document = publicfields(document)
+
+    def insert(self, document=None):
+        """Insert a new Collection.
+
+        :param document: Collection.
+        :type document: dict
+        :returns: The ID of the new Collection.
+        :rtype: bytes
+        :raise: Exception
+        """
+        if document is not None:
+            self.document = publicfields(document)
+
+        self.document['_id'] = ObjectId(self._id) if self._id is not None else ObjectId()
+        try:
+            with self.__conn.transaction() as cursor:
+                # The counters of Members start with the Collection
+                cursor.execute('INSERT INTO collection (id, mcount, mbytes, document) '
+                               'VALUES (?, 0, 0, ?)',
+                               (str(self.document['_id']), dumpdocument(self.document)))
+        except sqlite3.IntegrityError:
+            raise Exception('Duplicate key: Collection %s already exists'
+                            % self.document['_id'])
+
+        self._id = str(self.document['_id'])
+        self.version = 0
+        return self._id.encode('utf-8')
+
+    def update(self, document=None):
+        """Update the fields passed as parameters.
+
+        :param document: Collection.
+        :type document: dict
+        :returns: The ID of the updated Collection.
+        :rtype: str
+        :raises: Exception
+        """
+        if '_id' in document and self._id != str(document['_id']):
+            raise Exception('IDs differ!')
+
+        fields = {k: v for k, v in publicfields(document).items() if k != '_id'}
+        with self.__conn.transaction() as cursor:
+            row = cursor.execute('SELECT id, version, document FROM collection WHERE id = ?',
+                                 (self._id,)).fetchone()
+            if row is None:
+                raise Exception('Collection %s does not exist!' % self._id)
+
+            auxdoc = loaddocument(row)
+            auxdoc.update(fields)
+            auxdoc['_version'] += 1
+            cursor.execute('UPDATE collection SET document = ?, version = ? WHERE id = ?',
+                           (dumpdocument(auxdoc), auxdoc['_version'], self._id))
+
+        self.version = auxdoc['_version']
+        self.document = publicfields(auxdoc)
+        return self._id
+
+    def delete(self, batchsize=1000, progress=None):
+        """Delete a Collection and all its Members.
+
+        Members are deleted in batches to keep the write transactions short.
+
+        :param batchsize: Number of Members deleted in each operation.
+        :type batchsize: int
+        :param progress: Function called after each batch with the number of
+            Members deleted up to that moment.
+        :type progress: callable
+        :returns: Number of Members deleted.
+        :rtype: int
+        :raises: Exception
+        """
+        removed = 0
+        while True:
+            with self.__conn.transaction() as cursor:
+                cursor.execute('DELETE FROM member WHERE id IN '
+                               '(SELECT id FROM member WHERE cid = ? LIMIT ?)',
+                               (self._id, batchsize))
+                deleted = cursor.rowcount
+            if not deleted:
+                break
+
+            removed += deleted
+            if progress is not None:
+                progress(removed)
+
+        with self.__conn.transaction() as cursor:
+            cursor.execute('DELETE FROM collection WHERE id = ?', (self._id,))
+            deleted = cursor.rowcount
+
+        if deleted != 1:
+            raise Exception('Collection not found!')
+        self._id = None
+        self.document = None
+        return removed
+
+    def insertmembers(self, documents, ordered=True):
+        """Insert a list of Members in this Collection in one transaction.
+
+        :param documents: Members to insert.
+        :type documents: list
+        :param ordered: Stop at the first error or try to insert all Members.
+        :type ordered: bool
+        :returns: IDs of the Members inserted and errors found.
+        :rtype: tuple
+        """
+        valid, errors = memberdocuments(self._id, documents, ordered)
+        if not len(valid):
+            return list(), errors
+
+        writeerrors = list()
+        count = 0
+        size = 0
+        with self.__conn.transaction() as cursor:
+            # Only the first Members which fit in the Collection are inserted
+            fit, maxlen = room(cursor, self._id, len(valid))
+            valid, errors = fullerrors(valid, errors, fit, maxlen, ordered)
+            positions(cursor, self._id, [doc for index, doc in valid])
+            for pos, (index, document) in enumerate(valid):
+                document.setdefault('_id', ObjectId())
+                try:
+                    cursor.execute(Member.insertsql, memberrow(self._id, document))
+                    count += 1
+                    size += declaredsize(document)
+                except sqlite3.IntegrityError as e:
+                    writeerrors.append({'index': pos, 'errmsg': str(e)})
+                    if ordered:
+                        break
+
+            inserted, errors = insertresult(valid, errors, writeerrors, ordered)
+            if len(inserted):
+                touch(cursor, self._id, count, size)
+        return inserted, errors
+
+    def keysbefore(self, memberid, count=1):
+        """Return the positions of Members inserted before another one.
+
+        :param memberid: ID of the Member which must follow the new ones.
+        :type memberid: str
+        :param count: Number of positions.
+        :type count: int
+        :rtype: list
+        :raises: Exception
+        """
+        row = self.__conn.fetchone('SELECT id, version, document FROM member '
+                                   'WHERE id = ? AND cid = ?', (str(memberid), self._id))
+        high = memberindex(loaddocument(row)) if row is not None else None
+        if high is None:
+            raise Exception('Member %s has no position in Collection %s' % (memberid, self._id))
+
+        # The index on the positions of the Members is used
+        row = self.__conn.fetchone("SELECT max(%s) AS low FROM member WHERE cid = ? AND "
+                                   "json_type(document, '$.mappings.index') IN ('integer', 'real') "
+                                   "AND %s < ?" % (indexExpr, indexExpr), (self._id, high))
+        return spacedkeys(row['low'], high, count)
+
+    def counters(self):
+        """Return the number of Members and the sum of their declared sizes.
+
+        :returns: Number of Members and bytes.
+        :rtype: tuple
+        :raises: Exception
+        """
+        row = self.__conn.fetchone('SELECT mcount, mbytes FROM collection WHERE id = ?',
+                                   (self._id,))
+        if row is None:
+            raise Exception('Collection %s does not exist!' % self._id)
+        if row['mcount'] is None:
+            recount(self.__conn, [self._id])
+            return self.counters()
+        return row['mcount'], row['mbytes']
+
+    def __exists(self, collid):
+        """Raise an Exception if a Collection does not exist."""
+        if self.__conn.fetchone('SELECT id FROM collection WHERE id = ?', (str(collid),)) is None:
+            raise Exception('Collection %s does not exist!' % collid)
+
+    def findmatch(self, document, batchsize=None):
+        """Return the Members with the same values as the fields of a document.
+
+        :param document: Member to compare with (see :func:`~datacoll.dcmodel.matchclause`).
+        :type document: dict
+        :param batchsize: Number of Members read in each query.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        params = [self._id]
+        where = 'm.cid = ? AND %s' % sqlfilter(matchclause(document), memberColumns, params)
+        self.__exists(self._id)
+        return ResultPage(memberbatches(self.__conn, where, params, batchsize))
+
+    def intersection(self, otherid, field='checksum', batchsize=None):
+        """Return the Members with the same value of a field in another Collection.
+
+        The Members are compared with the index on the column of the field.
+
+        :param otherid: ID of the other Collection.
+        :type otherid: str
+        :param field: checksum or location.
+        :type field: str
+        :param batchsize: Number of Members read in each query.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        column = memberColumns[matchfield(field)]
+        self.__exists(self._id)
+        self.__exists(otherid)
+        where = ('m.cid = ? AND m.{0} IS NOT NULL AND EXISTS (SELECT 1 FROM member o '
+                 'WHERE o.{0} = m.{0} AND o.cid = ?)'.format(column))
+        return ResultPage(memberbatches(self.__conn, where, [self._id, str(otherid)],
+                                        batchsize))
+
+    def union(self, otherid, field='checksum', batchsize=None):
+        """Return the Members of this Collection and the ones of another which are not here.
+
+        :param otherid: ID of the other Collection.
+        :type otherid: str
+        :param field: checksum or location.
+        :type field: str
+        :param batchsize: Number of Members read in each query.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        column = memberColumns[matchfield(field)]
+        self.__exists(self._id)
+        self.__exists(otherid)
+        where = ('m.cid = ? AND (m.{0} IS NULL OR NOT EXISTS (SELECT 1 FROM member o '
+                 'WHERE o.{0} = m.{0} AND o.cid = ?))'.format(column))
+        return ResultPage(itertools.chain(
+            memberbatches(self.__conn, 'm.cid = ?', [self._id], batchsize),
+            memberbatches(self.__conn, where, [str(otherid), self._id], batchsize)))
+
+    def flatten(self, depth=4, batchsize=None):
+        """Return the Members of this Collection and of the Collections it contains.
+
+        :param depth: Number of levels of Collections expanded.
+        :type depth: int
+        :param batchsize: Number of Members read in each query.
+        :type batchsize: int
+        :rtype: :class:`~datacoll.dcbase.ResultPage`
+        :raises: Exception
+        """
+        def readmembers(collid):
+            self.__exists(collid)
+            return ResultPage(memberbatches(self.__conn, 'm.cid = ?', [str(collid)],
+                                            batchsize))
+
+        return ResultPage(flattenmembers(readmembers, self._id, depth))
+
+
+def memberrow(collid, document):
+    """Return the values of the columns of a Member to insert."""
+    return (str(document['_id']), str(collid), textcolumn(document, 'checksum'),
+            textcolumn(document, 'location'), dumpdocument(document))
+
+
+class Member(MemberBase):
+    """A Member of a Collection stored in SQLite."""
+
+    insertsql = ('INSERT INTO member (id, cid, checksum, location, document) '
+                 'VALUES (?, ?, ?, ?, ?)')
+
+    def __init__(self, conn, collid, memberid=None, fields=None, fetch=True):
+        """Constructor of the Member.
+
+        :param conn: DB.
+        :type conn: :class:`~SQLiteDB`
+        :param collid: Collection ID.
+        :type collid: str
+        :param memberid: Member ID.
+        :type memberid: str
+        :param fields: Projection of the fields to retrieve.
+        :type fields: dict
+        :param fetch: Read the document. If False, the Member can only be
+            inserted with this ID, updated or deleted.
+        :type fetch: bool
+        :raises: Exception
+        """
+        self.__conn = conn
+        if collid is None:
+            raise Exception('Empty collection ID!')
+
+        # _id must always be a str
+        self._collectionId = collid.decode('utf-8') if isinstance(collid, bytes) else str(collid)
+        self.document = {'_collectionId': ObjectId(self._collectionId)}
+        self.version = 0
+
+        if memberid is None:
+            self._id = None
+            return
+
+        self._id = memberid.decode('utf-8') if isinstance(memberid, bytes) else str(memberid)
+
+        if not fetch:
+            self.version = None
+            return
+
+        row = conn.fetchone('SELECT id, cid, version, document FROM member '
+                            'WHERE id = ? AND cid = ?',
+                            (self._id, self._collectionId))
+        if row is None:
+            raise Exception('Member %s does not exist!' % self._id)
+        document = project(loaddocument(row), internalprojection(fields))
+
+        # Number of updates of the document
+        self.version = document.get('_version', 0)
+        self.document = publicfields(document)
+
+    def delete(self):
+        """Delete this Member.
+
+        :raises: Exception
+        """
+        with self.__conn.transaction() as cursor:
+            # The size of the Member is subtracted from the one of the Collection
+            row = cursor.execute('SELECT %s AS size FROM member WHERE id = ? AND cid = ?'
+                                 % sizeExpr, (self._id, self._collectionId)).fetchone()
+            if row is None:
+                raise Exception('Member not found!')
+            cursor.execute('DELETE FROM member WHERE id = ? AND cid = ?',
+                           (self._id, self._collectionId))
+            touch(cursor, self._collectionId, -1, -row['size'])
+
+        self._id = None
+        self.document = None
+
+    def insert(self, document=None):
+        """Insert this Member in its Collection.
+
+        :param document: Member.
+        :type document: dict
+        :returns: The ID of the new Member.
+        :rtype: bytes
+        :raises: Exception
+        """
+        if document is not None:
+            # Keep _collectionId in the internal document
+            self.document.update(publicfields(document))
+            self.document['_collectionId'] = ObjectId(self._collectionId)
+
+        self.document['_id'] = ObjectId(self._id) if self._id is not None else ObjectId()
+        try:
+            with self.__conn.transaction() as cursor:
+                fit, maxlen = room(cursor, self._collectionId, 1)
+                if not fit:
+                    raise CollectionFull(fullmessage(maxlen))
+                positions(cursor, self._collectionId, [self.document])
+                cursor.execute(self.insertsql, memberrow(self._collectionId, self.document))
+                touch(cursor, self._collectionId, 1, declaredsize(self.document))
+        except sqlite3.IntegrityError:
+            raise Exception('Duplicate key: Member %s already exists' % self.document['_id'])
+
+        self._id = str(self.document['_id'])
+        self.version = 0
+        return self._id.encode('utf-8')
+
+    def update(self, document=None):
+        """Update the fields passed as parameters.
+
+        :param document: Member.
+        :type document: dict
+        :returns: The ID of the updated Member.
+        :rtype: str
+        :raises: Exception
+        """
+        if '_id' in document and self._id != str(document['_id']):
+            raise Exception('IDs differ!')
+
+        fields = {k: v for k, v in publicfields(document).items()
+                  if k not in ('_id', '_collectionId')}
+        with self.__conn.transaction() as cursor:
+            row = cursor.execute('SELECT id, cid, version, document FROM member '
+                                 'WHERE id = ? AND cid = ?',
+                                 (self._id, self._collectionId)).fetchone()
+            if row is None:
+                raise Exception('Member %s does not exist!' % self._id)
+
+            auxdoc = loaddocument(row)
+            before = declaredsize(auxdoc)
+            auxdoc.update(fields)
+            auxdoc['_version'] += 1
+            cursor.execute('UPDATE member SET checksum = ?, location = ?, document = ?, '
+                           'version = ? WHERE id = ?',
+                           (textcolumn(auxdoc, 'checksum'), textcolumn(auxdoc, 'location'),
+                            dumpdocument(auxdoc), auxdoc['_version'], self._id))
+            touch(cursor, self._collectionId, 0, declaredsize(auxdoc) - before)
+
+        self.version = auxdoc['_version']
+        self.document = publicfields(auxdoc)
+        return self._id
@@ -239,8 +239,8 @@ class DataCollTests(unittest.TestCase):
         coll2 = getcollection(self.host)
 
         # Check that the ids are the same
-        collIds = {str(col['_id']) for col in coll2}
-        collNames = {col['name'] for col in coll2}
+        collIds = {str(col['_id']) for col in coll2['contents']}
+        collNames = {col['name'] for col in coll2['contents']}
 
         # Remove both IDs from both collections added
         collIds.remove(collid1)
@@ -265,8 +265,8 @@ class DataCollTests(unittest.TestCase):
         memblist = getmember(self.host, collid)
 
         # Check that the ids are the same
-        membIds = {str(memb['_id']) for memb in memblist}
-        membCheck = {memb['checksum'] for memb in memblist}
+        membIds = {str(memb['_id']) for memb in memblist['contents']}
+        membCheck = {memb['checksum'] for memb in memblist['contents']}
 
         # Remove both IDs from both collections added
         membIds.remove(memberid1)
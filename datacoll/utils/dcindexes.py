@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""Index management for the Data Collection Service
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2016-2017 Javier Quinteros, GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import sys
+import argparse
+import configparser
+from datacoll.dcmongo import connect
+from datacoll.dcmongo import indexreport
+from datacoll.dcmongo import ensureindexes
+from datacoll.dcmongo import recount
+
+version = '0.1'
+
+
+def main():
+    defaultcfg = os.path.join(os.path.dirname(__file__), '..', 'datacoll.cfg')
+
+    parser = argparse.ArgumentParser(description='Manage the indexes of the Data Collection Service')
+    parser.add_argument('command', choices=['report', 'ensure', 'counters'],
+                        help='Report missing and unused indexes, create the missing ones '
+                             'or compute the counters of members of the collections')
+    parser.add_argument('-c', '--config', default=defaultcfg,
+                        help='Configuration file of the service')
+    parser.add_argument('-V', '--version', action='version', version='%(prog)s ' + version,
+                        help='Show version information.')
+    args = parser.parse_args()
+
+    config = configparser.RawConfigParser()
+    if not config.read(args.config):
+        print('Configuration file %s could not be read' % args.config)
+        sys.exit(1)
+
+    conn = connect(config)
+
+    if args.command == 'counters':
+        print('Counters of members computed for %d collections' % recount(conn))
+        return
+
+    if args.command == 'ensure':
+        for name in ensureindexes(conn):
+            print('Index %s created' % name)
+
+    # Report always the final status of the indexes
+    for collname, status in indexreport(conn).items():
+        for key in ('missing', 'unused', 'undeclared'):
+            for name in status[key]:
+                print('%s: index %s is %s' % (collname, name, key))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""Migration of the data of the Data Collection Service between engines
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2016-2017 Javier Quinteros, GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+import sys
+import argparse
+import configparser
+from itertools import islice
+from pymongo import ReplaceOne
+from datacoll import dcmongo
+from datacoll import dcsqlite
+
+version = '0.1'
+
+# Mongo collections in the order they must be copied
+tables = ('Collection', 'Member')
+
+
+def batches(documents, size):
+    """Split an iterable of documents in lists of at most size documents."""
+    documents = iter(documents)
+    while True:
+        batch = list(islice(documents, size))
+        if not len(batch):
+            return
+        yield batch
+
+
+def tosqlite(mongo, sqlite, size):
+    """Copy all documents from MongoDB to SQLite."""
+    for table in tables:
+        count = 0
+        for batch in batches(mongo[table].find().sort('_id', 1).batch_size(size), size):
+            count += dcsqlite.loadtable(sqlite, table, batch)
+        print('%s: %d documents copied to SQLite' % (table, count))
+
+
+def tomongo(sqlite, mongo, size):
+    """Copy all documents from SQLite to MongoDB."""
+    for table in tables:
+        count = 0
+        for batch in batches(dcsqlite.dumptable(sqlite, table), size):
+            mongo[table].bulk_write([ReplaceOne({'_id': doc['_id']}, doc, upsert=True)
+                                     for doc in batch], ordered=False)
+            count += len(batch)
+        print('%s: %d documents copied to MongoDB' % (table, count))
+
+
+def main():
+    defaultcfg = os.path.join(os.path.dirname(__file__), '..', 'datacoll.cfg')
+
+    parser = argparse.ArgumentParser(description='Copy the collections and members between '
+                                                 'the MongoDB and SQLite engines')
+    parser.add_argument('command', choices=['tosqlite', 'tomongo'],
+                        help='Direction of the copy')
+    parser.add_argument('-c', '--config', default=defaultcfg,
+                        help='Configuration file with the [mongo] and [sqlite] sections')
+    parser.add_argument('-b', '--batch', type=int, default=1000,
+                        help='Number of documents written in each operation')
+    parser.add_argument('-V', '--version', action='version', version='%(prog)s ' + version,
+                        help='Show version information.')
+    args = parser.parse_args()
+
+    config = configparser.RawConfigParser()
+    if not config.read(args.config):
+        print('Configuration file %s could not be read' % args.config)
+        sys.exit(1)
+
+    mongo = dcmongo.connect(config)
+    sqlite = dcsqlite.connect(config)
+
+    # Documents with the same ID are replaced, so the copy can be repeated
+    if args.command == 'tosqlite':
+        tosqlite(mongo, sqlite, args.batch)
+        dcsqlite.ensureindexes(sqlite)
+    else:
+        tomongo(sqlite, mongo, args.batch)
+        dcmongo.ensureindexes(mongo)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+#
+# Data Collection WS - prototype
+#
+# (c) 2016 Javier Quinteros, GEOFON team
+# <javier@gfz-potsdam.de>
+#
+# ----------------------------------------------------------------------
+
+"""Data Collection WS - entry point for WSGI servers
+
+The service can be run by an external WSGI server with many worker
+processes, e.g. ::
+
+    $ DATACOLL_CONFIG=/etc/datacoll.cfg gunicorn -w 8 datacoll.wsgi:application
+
+The configuration file is read from the environment variable DATACOLL_CONFIG
+or, if it is not set, from datacoll.cfg in the directory of the package. The
+connections to the DB are opened by each worker after it has been forked.
+
+   :Platform:
+       Linux
+   :Copyright:
+       GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GNU General Public License v3
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import os
+from datacoll.datacoll import create_app
+
+application = create_app(os.environ.get('DATACOLL_CONFIG'))
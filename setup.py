@@ -113,6 +113,12 @@ setup(
     #     'dev': ['check-manifest'],
     #     'test': ['coverage'],
     # },
+    extras_require={
+        'async': ['aiohttp', 'pymongo>=4.9'],
+        'fast': ['orjson'],
+        'zstd': ['zstandard'],
+        'msgpack': ['msgpack'],
+    },
 
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these
@@ -136,6 +142,9 @@ setup(
     entry_points='''
         [console_scripts]
         dir2coll=datacoll.utils.dir2coll:main
+        dcindexes=datacoll.utils.dcindexes:main
+        dcmigrate=datacoll.utils.dcmigrate:main
         datacoll=datacoll.datacoll:main
+        datacoll-async=datacoll.dcasync:main
     '''
 )
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the serialization of a list of Members in JSON format.
+
+A page of Members with ObjectId and datetime fields is streamed with
+JSONFactory by each serializer available, and with the previous method
+(json.dumps with the default conversions of dcjson for each document). The best time of several
+repetitions is reported.
+
+    $ python3 tests/benchjson.py -n 10000 -r 5
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+   :Copyright:
+       2016-2017 Javier Quinteros, GEOFON, GFZ Potsdam <geofon@gfz-potsdam.de>
+   :License:
+       GPLv3
+   :Platform:
+       Linux
+
+.. moduleauthor:: Javier Quinteros <javier@gfz-potsdam.de>, GEOFON, GFZ Potsdam
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+import datetime
+from bson.objectid import ObjectId
+
+here = os.path.dirname(__file__)
+sys.path.append(os.path.join(here, '..'))
+from datacoll import dcjson
+from datacoll.dcjson import default
+from datacoll.dcformat import JSONFactory
+
+
+class ListPage(object):
+    """Page of documents kept in a list, like the ones read from a cursor."""
+
+    def __init__(self, documents):
+        self.documents = iter(documents)
+        self.next_cursor = 'bmV4dA=='
+
+    def fetchone(self):
+        return next(self.documents, None)
+
+
+def members(number):
+    """Create Members like the ones returned by the service."""
+    collid = ObjectId()
+    now = datetime.datetime.utcnow()
+    return [{'_id': ObjectId(),
+             '_collectionId': collid,
+             'location': 'http://server/data/file%06d.mseed' % index,
+             'checksum': 'md5:%032x' % index,
+             'datatype': 'mseed',
+             'mappings': {'index': index, 'dateAdded': now},
+             'properties': {'station': 'STA%d' % (index % 100), 'channels': ['HHZ', 'HHN', 'HHE'],
+                            'comment': 'Ñandú %d' % index}}
+            for index in range(number)]
+
+
+def jsondumps(documents, flushsize):
+    """Previous method of JSONFactory: one json.dumps per document."""
+    chunks = ['{"contents": [']
+    chunks.append(', '.join(json.dumps(reg, default=default) for reg in documents))
+    chunks.append('], "next_cursor": %s}' % json.dumps('bmV4dA=='))
+    return ''.join(chunks).encode('utf-8')
+
+
+def jsonfactory(documents, flushsize):
+    return b''.join(JSONFactory(ListPage(documents), flushsize))
+
+
+def best(func, documents, repeat, flushsize):
+    """Return the output and the best time of several calls."""
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = func(documents, flushsize)
+        times.append(time.perf_counter() - start)
+    return output, min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the serialization of Members')
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help='Number of Members in the page')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of repetitions of each measure')
+    parser.add_argument('-f', '--flushsize', type=int, default=65536,
+                        help='Minimum size in bytes of the chunks')
+    args = parser.parse_args()
+
+    documents = members(args.number)
+    reference, reftime = best(jsondumps, documents, args.repeat, args.flushsize)
+    print('%-20s %10s %10s %10s' % ('Method', 'Seconds', 'Speedup', 'Bytes'))
+    print('%-20s %10.4f %10.2f %10d' % ('json.dumps', reftime, 1.0, len(reference)))
+
+    outputs = list()
+    for name in sorted(dcjson.serializers):
+        dcjson.setserializer(name)
+        output, seconds = best(jsonfactory, documents, args.repeat, args.flushsize)
+        outputs.append(output)
+        print('%-20s %10.4f %10.2f %10d' % (name, seconds, reftime / seconds, len(output)))
+
+    # All serializers must send exactly the same content
+    if any(output != outputs[0] for output in outputs):
+        print('Error: The serializers produce different outputs')
+        sys.exit(1)
+    if json.loads(outputs[0]) != json.loads(reference):
+        print('Error: The content differs from the one of json.dumps')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,14 +21,37 @@ import sys
 import os
 import unittest
 import json
+import gzip
+import configparser
+import io
+import tarfile
+import zipfile
+import tempfile
+import fcntl
+import subprocess
+import asyncio
+import types
+import datetime
+import bson
 from urllib.request import Request
 from urllib.request import urlopen
 from urllib.error import HTTPError
 from bson.json_util import loads
+from bson.objectid import ObjectId
+from pymongo import MongoClient
 
 here = os.path.dirname(__file__)
 sys.path.append(os.path.join(here, '..'))
 from unittestTools import WITestRunner
+from datacoll.dcmongo import clientkwargs
+from datacoll.dcmongo import readpreference
+from datacoll.dcmongo import reservesteps
+from datacoll.dcmongo import runsteps
+from datacoll.dcasyncmongo import runsteps as asyncrunsteps
+from datacoll.dccache import cachekey
+from datacoll.dccache import ContentCache
+from datacoll.dcmodel import CollectionCache
+from datacoll.dcjson import serializers
 
 
 # global token
@@ -185,6 +208,21 @@ class DataCollTests(unittest.TestCase):
 
         return
 
+    def test_stats(self):
+        """Counters of the cache of Collections."""
+        collid = createcollection(self.host, 'new-coll.json')
+        getcollection(self.host, collid)
+
+        stats = json.loads(urlopen(Request('%s/stats' % self.host)).read())
+        # Only the engines reading from a DB server have a cache of Collections
+        if 'collectionCache' in stats:
+            self.assertTrue('hits' in stats['collectionCache'], 'hits not in the cache counters!')
+            self.assertTrue('misses' in stats['collectionCache'], 'misses not in the cache counters!')
+            self.assertTrue('stale' in stats['collectionCache'], 'stale not in the cache counters!')
+
+        deletecollection(self.host, collid)
+        return
+
     def test_memb_create_query_delete(self):
         """Creation, query and deletion of a Member of a Collection."""
 
@@ -239,8 +277,8 @@ class DataCollTests(unittest.TestCase):
         coll2 = getcollection(self.host)
 
         # Check that the ids are the same
-        collIds = {str(col['_id']) for col in coll2}
-        collNames = {col['name'] for col in coll2}
+        collIds = {str(col['_id']) for col in coll2['contents']}
+        collNames = {col['name'] for col in coll2['contents']}
 
         # Remove both IDs from both collections added
         collIds.remove(collid1)
@@ -265,8 +303,8 @@ class DataCollTests(unittest.TestCase):
         memblist = getmember(self.host, collid)
 
         # Check that the ids are the same
-        membIds = {str(memb['_id']) for memb in memblist}
-        membCheck = {memb['checksum'] for memb in memblist}
+        membIds = {str(memb['_id']) for memb in memblist['contents']}
+        membCheck = {memb['checksum'] for memb in memblist['contents']}
 
         # Remove both IDs from both collections added
         membIds.remove(memberid1)
@@ -280,6 +318,516 @@ class DataCollTests(unittest.TestCase):
         deletecollection(self.host, collid)
         return
 
+    def test_members_pagination(self):
+        """Pagination of the list of Members."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        memberids = [createmember(self.host, collid, 'new-memb.json') for i in range(3)]
+
+        # First page with two members and a cursor to the next one
+        req = Request('%s/collections/%s/members?limit=2' % (self.host, collid))
+        page = loads(urlopen(req).read())
+        self.assertEqual(len(page['contents']), 2, 'Two members expected!')
+        self.assertIsNotNone(page['next_cursor'], 'Cursor expected!')
+
+        # Last page with the remaining member
+        req = Request('%s/collections/%s/members?limit=2&cursor=%s' %
+                      (self.host, collid, page['next_cursor']))
+        page2 = loads(urlopen(req).read())
+        self.assertEqual(len(page2['contents']), 1, 'One member expected!')
+        self.assertIsNone(page2['next_cursor'], 'No cursor expected!')
+
+        received = [str(m['_id']) for m in page['contents'] + page2['contents']]
+        self.assertEqual(received, sorted(memberids), 'Members differ!')
+
+        for memberid in memberids:
+            deletemember(self.host, collid, memberid)
+        deletecollection(self.host, collid)
+        return
+
+    def test_members_pagination_missing(self):
+        """Pagination of the list of Members by a field missing in some of them."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        url = '%s/collections/%s/members' % (self.host, collid)
+        # Members without the sort field or with values of different types
+        memberids = set()
+        for checksum in ('md5:b', None, 'md5:a', 3, None, True, 1.5):
+            data = {'location': 'http://localhost/file'}
+            if checksum is not None:
+                data['checksum'] = checksum
+            req = Request(url, data=json.dumps(data).encode())
+            req.add_header("Content-Type", 'application/json')
+            memberids.add(json.loads(urlopen(req).read())['_id'])
+
+        for sort in ('checksum', '-checksum'):
+            received = list()
+            cursor = ''
+            while cursor is not None:
+                req = Request('%s?limit=2&sort=%s%s' % (url, sort, cursor))
+                page = loads(urlopen(req).read())
+                received.extend(page['contents'])
+                cursor = '&cursor=%s' % page['next_cursor'] if page['next_cursor'] else None
+
+            self.assertEqual(len(received), len(memberids), 'All members expected with sort %s!' % sort)
+            self.assertEqual({str(m['_id']) for m in received}, memberids, 'Members differ!')
+            # Missing values first, then numbers, strings and booleans
+            checksums = [m.get('checksum') for m in received]
+            expected = [None, None, 1.5, 3, 'md5:a', 'md5:b', True]
+            self.assertEqual(checksums, expected if sort == 'checksum' else expected[::-1],
+                             'Unexpected order with sort %s!' % sort)
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_members_bulk(self):
+        """Creation of many Members with a single request."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        with open('new-memb.json') as fin:
+            memb = json.load(fin)
+
+        # The second item is not valid and the insertion is unordered
+        data = json.dumps([memb, 'not-a-member', memb]).encode('utf-8')
+        req = Request('%s/collections/%s/members?ordered=false' % (self.host, collid),
+                      data=data)
+        req.add_header("Content-Type", 'application/json')
+        u = urlopen(req)
+        result = json.loads(u.read())
+        self.assertEqual(u.getcode(), 201, 'Error code 201 was expected!')
+        self.assertEqual(len(result['created']), 2, 'Two members expected!')
+        self.assertEqual([e['index'] for e in result['errors']], [1],
+                         'Error expected for the second member!')
+
+        # Same content as NDJSON
+        data = '\n'.join(json.dumps(memb) for i in range(3)).encode('utf-8')
+        req = Request('%s/collections/%s/members' % (self.host, collid), data=data)
+        req.add_header("Content-Type", 'application/x-ndjson')
+        result2 = json.loads(urlopen(req).read())
+        self.assertEqual(len(result2['created']), 3, 'Three members expected!')
+
+        for memberid in result['created'] + result2['created']:
+            deletemember(self.host, collid, memberid)
+        deletecollection(self.host, collid)
+        return
+
+    def test_coll_delete_cascade(self):
+        """Deletion of a Collection together with its Members."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        memberid = createmember(self.host, collid, 'new-memb.json')
+
+        deletecollection(self.host, collid)
+
+        # The member must have been removed with the collection
+        with self.assertRaises(HTTPError):
+            getmember(self.host, collid, memberid)
+        return
+
+    def test_members_fields(self):
+        """Retrieval of a subset of the fields of the Members."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        memberid = createmember(self.host, collid, 'new-memb.json')
+
+        req = Request('%s/collections/%s/members/%s?fields=checksum' %
+                      (self.host, collid, memberid))
+        memb = loads(urlopen(req).read())
+        self.assertEqual(set(memb.keys()), {'_id', 'checksum'}, 'Unexpected fields!')
+
+        req = Request('%s/collections/%s/members?fields=location,checksum' %
+                      (self.host, collid))
+        memblist = loads(urlopen(req).read())
+        self.assertEqual(set(memblist['contents'][0].keys()), {'_id', 'location', 'checksum'},
+                         'Unexpected fields!')
+
+        # The fields for internal use are not public
+        for url in ('%s/collections/%s?fields=_count' % (self.host, collid),
+                    '%s/collections?fields=name,_mversion' % self.host,
+                    '%s/collections/%s/members/%s?fields=_version' % (self.host, collid, memberid)):
+            with self.assertRaises(HTTPError) as cm:
+                urlopen(Request(url))
+            self.assertEqual(cm.exception.code, 400, 'Error code 400 was expected!')
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_members_filter(self):
+        """Filter the list of Members in the server."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        with open('new-memb.json') as fin:
+            memb = json.load(fin)
+        memberid1 = createmember(self.host, collid, 'new-memb.json')
+
+        # Create a second member with a different location and checksum
+        memb['location'] = 'http://geofon.gfz-potsdam.de/data/file.mseed'
+        memb['checksum'] = 'md5:0000'
+        req = Request('%s/collections/%s/members' % (self.host, collid),
+                      data=json.dumps(memb).encode('utf-8'))
+        req.add_header("Content-Type", 'application/json')
+        memberid2 = str(json.loads(urlopen(req).read())['_id'])
+
+        req = Request('%s/collections/%s/members?f_checksum=md5:0000' % (self.host, collid))
+        memblist = loads(urlopen(req).read())
+        self.assertEqual([str(m['_id']) for m in memblist['contents']], [memberid2],
+                         'Only the second member was expected!')
+
+        req = Request('%s/collections/%s/members?f_location[prefix]=http://www.fdsn.org/' %
+                      (self.host, collid))
+        memblist = loads(urlopen(req).read())
+        self.assertEqual([str(m['_id']) for m in memblist['contents']], [memberid1],
+                         'Only the first member was expected!')
+
+        # The values of a list are compared also as numbers
+        sizes = dict()
+        for size in (10, 11, 12):
+            memb['size'] = size
+            req = Request('%s/collections/%s/members' % (self.host, collid),
+                          data=json.dumps(memb).encode('utf-8'))
+            req.add_header("Content-Type", 'application/json')
+            sizes[str(json.loads(urlopen(req).read())['_id'])] = size
+        req = Request('%s/collections/%s/members?f_size[in]=10,11' % (self.host, collid))
+        memblist = loads(urlopen(req).read())
+        self.assertEqual(sorted(sizes.get(str(m['_id'])) for m in memblist['contents']), [10, 11],
+                         'Members with size 10 and 11 expected!')
+
+        # Operators not allowed must be rejected
+        req = Request('%s/collections/%s/members?f_location[where]=x' % (self.host, collid))
+        with self.assertRaises(HTTPError):
+            urlopen(req)
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_members_etag(self):
+        """Conditional requests of Members with ETags."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        memberid = createmember(self.host, collid, 'new-memb.json')
+
+        for url in ('%s/collections/%s/members/%s' % (self.host, collid, memberid),
+                    '%s/collections/%s/members' % (self.host, collid)):
+            etag = urlopen(Request(url)).headers['ETag']
+            self.assertIsNotNone(etag, 'ETag expected!')
+
+            # The client already has the current version
+            req = Request(url)
+            req.add_header('If-None-Match', etag)
+            with self.assertRaises(HTTPError) as cm:
+                urlopen(req)
+            self.assertEqual(cm.exception.code, 304, 'Error code 304 was expected!')
+
+        # The list changes when a member is added
+        memberid2 = createmember(self.host, collid, 'new-memb.json')
+        req = Request('%s/collections/%s/members' % (self.host, collid))
+        req.add_header('If-None-Match', etag)
+        self.assertEqual(urlopen(req).getcode(), 200, 'Error code 200 was expected!')
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_members_compression(self):
+        """Compression of the requests and responses with gzip."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        with open('new-memb.json') as fin:
+            memb = json.load(fin)
+
+        # The body of the request is decompressed by the server
+        data = gzip.compress(json.dumps([memb] * 50).encode('utf-8'))
+        req = Request('%s/collections/%s/members' % (self.host, collid), data=data)
+        req.add_header("Content-Type", 'application/json')
+        req.add_header("Content-Encoding", 'gzip')
+        self.assertEqual(urlopen(req).getcode(), 201, 'Error code 201 was expected!')
+
+        # Invalid compressed data must be rejected
+        req = Request('%s/collections/%s/members' % (self.host, collid), data=b'not-gzip')
+        req.add_header("Content-Type", 'application/json')
+        req.add_header("Content-Encoding", 'gzip')
+        with self.assertRaises(HTTPError) as cm:
+            urlopen(req)
+        self.assertEqual(cm.exception.code, 400, 'Error code 400 was expected!')
+
+        url = '%s/collections/%s/members' % (self.host, collid)
+        plain = urlopen(Request(url))
+        req = Request(url)
+        req.add_header('Accept-Encoding', 'gzip')
+        u = urlopen(req)
+        self.assertEqual(u.headers['Content-Encoding'], 'gzip', 'gzip coding expected!')
+        self.assertEqual(gzip.decompress(u.read()), plain.read(),
+                         'Same content expected with and without compression!')
+        self.assertNotEqual(u.headers['ETag'], plain.headers['ETag'],
+                            'Different ETag expected for each coding!')
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_members_bson(self):
+        """Members sent and received in BSON format."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        with open('new-memb.json') as fin:
+            memb = json.load(fin)
+
+        # Several documents one after the other are many members
+        data = b''.join(bson.encode(memb) for i in range(3))
+        req = Request('%s/collections/%s/members' % (self.host, collid), data=data)
+        req.add_header("Content-Type", 'application/bson')
+        req.add_header("Accept", 'application/bson')
+        u = urlopen(req)
+        self.assertEqual(u.headers['Content-Type'], 'application/bson', 'BSON expected!')
+        self.assertEqual(len(bson.decode(u.read())['created']), 3, 'Three members expected!')
+
+        url = '%s/collections/%s/members' % (self.host, collid)
+        req = Request(url)
+        req.add_header("Accept", 'application/bson')
+        u = urlopen(req)
+        page = bson.decode(u.read())
+        self.assertEqual(len(page['contents']), 3, 'Three members expected!')
+        self.assertEqual(page['contents'][0]['location'], memb['location'],
+                         'Same location expected!')
+        self.assertNotEqual(u.headers['ETag'], urlopen(Request(url)).headers['ETag'],
+                            'Different ETag expected for each format!')
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_members_update(self):
+        """Update and deletion of Members without reading them first."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        memberid = createmember(self.host, collid, 'new-memb.json')
+        url = '%s/collections/%s/members/%s' % (self.host, collid, memberid)
+
+        # The updated document is returned by the PUT
+        req = Request(url, data=json.dumps({'checksum': 'updated'}).encode())
+        req.add_header("Content-Type", 'application/json')
+        req.get_method = lambda: 'PUT'
+        u = urlopen(req)
+        memb = json.loads(u.read())
+        self.assertEqual(memb['checksum'], 'updated', 'Updated document expected!')
+        self.assertEqual(u.headers['ETag'], urlopen(Request(url)).headers['ETag'],
+                         'ETag of the update and the GET should be equal!')
+
+        deletemember(self.host, collid, memberid)
+
+        # The Member does not exist anymore
+        for method in ('PUT', 'DELETE'):
+            req = Request(url, data=b'{}')
+            req.add_header("Content-Type", 'application/json')
+            req.get_method = lambda: method
+            with self.assertRaises(HTTPError) as cm:
+                urlopen(req)
+            self.assertEqual(cm.exception.code, 404, 'Error code 404 was expected!')
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_coll_maxlength_stats(self):
+        """Counters of Members and maxLength of a Collection."""
+
+        data = json.dumps({'name': 'limited', 'capabilities': {'maxLength': 2}}).encode()
+        req = Request('%s/collections' % self.host, data=data)
+        req.add_header("Content-Type", 'application/json')
+        collid = json.loads(urlopen(req).read())['_id']
+        self.assertEqual(getcollcapabilities(self.host, collid)['maxLength'], 2,
+                         'maxLength of the Collection expected!')
+
+        url = '%s/collections/%s/members' % (self.host, collid)
+        req = Request(url, data=json.dumps({'location': 'a', 'size': 100}).encode())
+        req.add_header("Content-Type", 'application/json')
+        memberid = json.loads(urlopen(req).read())['_id']
+
+        # Only one of the two Members fits in the Collection
+        data = json.dumps([{'location': 'b', 'size': 50}, {'location': 'c', 'size': 10}])
+        req = Request(url + '?ordered=false', data=data.encode())
+        req.add_header("Content-Type", 'application/json')
+        result = json.loads(urlopen(req).read())
+        self.assertEqual(len(result['created']), 1, 'One member expected!')
+        self.assertEqual(result['errors'][0]['index'], 1, 'Second member should fail!')
+
+        req = Request(url, data=json.dumps({'location': 'd'}).encode())
+        req.add_header("Content-Type", 'application/json')
+        with self.assertRaises(HTTPError) as cm:
+            urlopen(req)
+        self.assertEqual(cm.exception.code, 409, 'Error code 409 was expected!')
+
+        stats = json.loads(urlopen(Request('%s/collections/%s/stats' % (self.host, collid))).read())
+        self.assertEqual(stats, {'memberCount': 2, 'memberBytes': 150, 'maxLength': 2},
+                         'Counters of the members do not match!')
+
+        # The counters follow the updates and deletions
+        req = Request('%s/%s' % (url, memberid), data=json.dumps({'size': 40}).encode())
+        req.add_header("Content-Type", 'application/json')
+        req.get_method = lambda: 'PUT'
+        urlopen(req)
+        deletemember(self.host, collid, result['created'][0])
+        stats = json.loads(urlopen(Request('%s/collections/%s/stats' % (self.host, collid))).read())
+        self.assertEqual((stats['memberCount'], stats['memberBytes']), (1, 40),
+                         'Counters of the members do not match!')
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_coll_ordered(self):
+        """Positions of the Members of an ordered Collection."""
+
+        data = json.dumps({'name': 'ordered', 'capabilities': {'isOrdered': True}}).encode()
+        req = Request('%s/collections' % self.host, data=data)
+        req.add_header("Content-Type", 'application/json')
+        collid = json.loads(urlopen(req).read())['_id']
+
+        # Members without position are appended at the end
+        url = '%s/collections/%s/members' % (self.host, collid)
+        data = json.dumps([{'location': 'a'}, {'location': 'b'}, {'location': 'c'}])
+        req = Request(url, data=data.encode())
+        req.add_header("Content-Type", 'application/json')
+        created = json.loads(urlopen(req).read())['created']
+
+        # A Member inserted before "b" does not renumber the others
+        req = Request('%s?before=%s' % (url, created[1]), data=b'{"location": "x"}')
+        req.add_header("Content-Type", 'application/json')
+        memb = json.loads(urlopen(req).read())
+        self.assertTrue(0 < memb['mappings']['index'] < 1, 'Position between 0 and 1 expected!')
+
+        membs = json.loads(urlopen(Request(url)).read())['contents']
+        self.assertEqual([m['location'] for m in membs], ['a', 'x', 'b', 'c'],
+                         'Members sorted by position expected!')
+
+        membs = json.loads(urlopen(Request(url + '?from=1&to=3')).read())['contents']
+        self.assertEqual([m['mappings']['index'] for m in membs], [1, 2],
+                         'Members in the range of positions expected!')
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_coll_ops(self):
+        """Operations on the Members of two Collections."""
+
+        collids = list()
+        for name, checksums in (('first', ['a', 'b', 'c']), ('second', ['b', 'c', 'd'])):
+            data = json.dumps({'name': name}).encode()
+            req = Request('%s/collections' % self.host, data=data)
+            req.add_header("Content-Type", 'application/json')
+            collids.append(json.loads(urlopen(req).read())['_id'])
+
+            data = json.dumps([{'checksum': c, 'properties': {'name': name}}
+                               for c in checksums])
+            req = Request('%s/collections/%s/members' % (self.host, collids[-1]),
+                          data=data.encode())
+            req.add_header("Content-Type", 'application/json')
+            urlopen(req)
+
+        ops = '%s/collections/%s/ops' % (self.host, collids[0])
+        membs = json.loads(urlopen(Request('%s/intersection/%s' % (ops, collids[1]))).read())
+        self.assertEqual(sorted(m['checksum'] for m in membs['contents']), ['b', 'c'],
+                         'Members with the same checksum expected!')
+
+        membs = json.loads(urlopen(Request('%s/union/%s' % (ops, collids[1]))).read())
+        self.assertEqual(sorted(m['checksum'] for m in membs['contents']), ['a', 'b', 'c', 'd'],
+                         'Members of both Collections expected!')
+
+        req = Request('%s/findMatch' % ops, data=b'{"properties": {"name": "first"}, "checksum": "b"}')
+        req.add_header("Content-Type", 'application/json')
+        membs = json.loads(urlopen(req).read())
+        self.assertEqual([m['checksum'] for m in membs['contents']], ['b'],
+                         'Only one matching Member expected!')
+
+        # A Member referencing the second Collection is replaced by its Members
+        data = json.dumps({'location': 'collections/%s' % collids[1],
+                           'datatype': 'application/vnd.rda.collection'})
+        req = Request('%s/collections/%s/members' % (self.host, collids[0]), data=data.encode())
+        req.add_header("Content-Type", 'application/json')
+        urlopen(req)
+        membs = json.loads(urlopen(Request('%s/flatten' % ops)).read())
+        self.assertEqual(sorted(m['checksum'] for m in membs['contents']),
+                         ['a', 'b', 'b', 'c', 'c', 'd'], 'Members of both Collections expected!')
+
+        with self.assertRaises(HTTPError):
+            urlopen(Request('%s/intersection/%s?by=size' % (ops, collids[1])))
+
+        for collid in collids:
+            deletecollection(self.host, collid)
+        return
+
+    def test_memb_download(self):
+        """Download of the content of a Member."""
+
+        data = json.dumps({'name': 'download'}).encode()
+        req = Request('%s/collections' % self.host, data=data)
+        req.add_header("Content-Type", 'application/json')
+        collid = json.loads(urlopen(req).read())['_id']
+
+        # The content of the Member is the features document of this service
+        url = '%s/collections/%s/members' % (self.host, collid)
+        data = json.dumps({'location': '%s/features' % self.host}).encode()
+        req = Request(url, data=data)
+        req.add_header("Content-Type", 'application/json')
+        memberid = json.loads(urlopen(req).read())['_id']
+
+        content = urlopen(Request('%s/%s/download' % (url, memberid))).read()
+        self.assertEqual(json.loads(content), json.loads(urlopen(Request('%s/features' % self.host)).read()),
+                         'Content of the location of the Member expected!')
+
+        with self.assertRaises(HTTPError):
+            urlopen(Request('%s/%s/download' % (url, '0' * 24)))
+
+        deletecollection(self.host, collid)
+        return
+
+    def test_coll_download(self):
+        """Download of the content of all Members of a Collection in an archive."""
+
+        data = json.dumps({'name': 'archive'}).encode()
+        req = Request('%s/collections' % self.host, data=data)
+        req.add_header("Content-Type", 'application/json')
+        collid = json.loads(urlopen(req).read())['_id']
+
+        # The second Member cannot be fetched and is reported in the manifest
+        url = '%s/collections/%s/members' % (self.host, collid)
+        for location in ('%s/features' % self.host, 'http://localhost:1/missing'):
+            # The checksum and the location are the key of the content in the cache
+            data = {'location': location, 'checksum': 'test:%s' % location}
+            req = Request(url, data=json.dumps(data).encode())
+            req.add_header("Content-Type", 'application/json')
+            urlopen(req).read()
+
+        features = json.loads(urlopen(Request('%s/features' % self.host)).read())
+        before = json.loads(urlopen(Request('%s/stats' % self.host)).read())
+        for fmt in ('tar', 'zip'):
+            req = Request('%s/collections/%s/download?format=%s' % (self.host, collid, fmt))
+            content = io.BytesIO(urlopen(req).read())
+            if fmt == 'tar':
+                with tarfile.open(fileobj=content) as archive:
+                    files = {info.name: archive.extractfile(info).read() for info in archive}
+            else:
+                with zipfile.ZipFile(content) as archive:
+                    files = {name: archive.read(name) for name in archive.namelist()}
+
+            self.assertEqual(sorted(files), ['features', 'manifest.json'],
+                             'Content of one Member and the manifest expected!')
+            self.assertEqual(json.loads(files['features']), features,
+                             'Content of the location of the Member expected!')
+            manifest = json.loads(files['manifest.json'])
+            self.assertEqual(manifest['failed'], 1, 'One Member which could not be fetched expected!')
+            self.assertIn('error', manifest['members'][1], 'Error of the second Member expected!')
+
+        # With the cache of the content, the first Member was fetched only once
+        if 'contentCache' in before:
+            after = json.loads(urlopen(Request('%s/stats' % self.host)).read())['contentCache']
+            self.assertGreater(after['hits'], before['contentCache']['hits'],
+                               'Second archive should be built from the cache!')
+
+        with self.assertRaises(HTTPError):
+            urlopen(Request('%s/collections/%s/download?format=rar' % (self.host, collid)))
+
+        deletecollection(self.host, collid)
+
+        with self.assertRaises(HTTPError):
+            urlopen(Request('%s/collections/%s/download' % (self.host, collid)))
+        return
+
     def test_coll_missing(self):
         """Try to retrieve a non-existing Collection."""
 
@@ -288,6 +836,250 @@ class DataCollTests(unittest.TestCase):
             getcollection(self.host, 'non-existing-collection')
         return
 
+    def test_invalid_requests(self):
+        """Rejection of the invalid parameters and documents of the requests."""
+
+        collid = createcollection(self.host, 'new-coll.json')
+        url = '%s/collections/%s' % (self.host, collid)
+
+        invalid = [Request(url + '/members?limit=0'),
+                   Request(url + '/download?format=rar'),
+                   Request(url + '/ops/flatten?depth=10'),
+                   Request(url + '/members?before=x', data=b'{"location": "x"}'),
+                   Request(url, data=json.dumps({'_id': 'other'}).encode(), method='PUT')]
+        for req in invalid:
+            req.add_header("Content-Type", 'application/json')
+            with self.assertRaises(HTTPError) as cm:
+                urlopen(req)
+            self.assertEqual(cm.exception.code, 400, 'Error code 400 was expected!')
+
+        deletecollection(self.host, collid)
+        return
+
+
+class ConfigTests(unittest.TestCase):
+    """Test the options of the sample configuration without a running service."""
+
+    def readsample(self):
+        config = configparser.RawConfigParser()
+        config.read(os.path.join(here, '..', 'datacoll', 'datacoll.cfg.sample'))
+        return config
+
+    def test_readpreference(self):
+        """Read preference of the replicas with the sample configuration."""
+
+        config = self.readsample()
+        config.set('mongo', 'readpreference', 'secondaryPreferred')
+        preference = readpreference(config)
+        self.assertEqual(preference.mongos_mode, 'secondaryPreferred', 'Unexpected read preference!')
+        self.assertEqual(preference.max_staleness, -1, 'Empty maxstalenessseconds means no limit!')
+
+        config.set('mongo', 'maxstalenessseconds', '120')
+        self.assertEqual(readpreference(config).max_staleness, 120, 'Unexpected maxstalenessseconds!')
+        return
+
+    def test_client_sample(self):
+        """Client of MongoDB built from the sample configuration."""
+
+        config = self.readsample()
+        args, kwargs = clientkwargs(config)
+        self.assertEqual(args, ('localhost', 27017), 'Unexpected server!')
+        self.assertNotIn('username', kwargs, 'The sample should not require authentication!')
+
+        # All the options of the sample are accepted by the driver. No
+        # connection is opened until the client is used.
+        client = MongoClient(*args, connect=False, **kwargs)
+        self.assertEqual(client.options.pool_options.max_pool_size, 100, 'Unexpected maxpoolsize!')
+        client.close()
+
+        config.set('mongo', 'user', 'datacoll')
+        config.set('mongo', 'password', 'secret')
+        args, kwargs = clientkwargs(config)
+        self.assertEqual((kwargs['username'], kwargs['authSource']), ('datacoll', 'datacoll'),
+                         'Credentials expected if user is set!')
+        return
+
+    def test_engine_imports(self):
+        """The front ends with the other engines do not import the driver of MongoDB."""
+
+        # A new interpreter, as this one has already imported dcmongo
+        script = ('import sys, configparser\n'
+                  'import datacoll.datacoll, datacoll.dcasync\n'
+                  'from datacoll.dcbase import loadengine\n'
+                  'config = configparser.RawConfigParser()\n'
+                  'config.read_string("[Service]\\nengine = %s\\n")\n'
+                  'loadengine(config)\n'
+                  'print(sorted(m for m in sys.modules if m.split(".")[0] == "pymongo"))\n')
+        for engine in ('memory', 'sqlite'):
+            output = subprocess.check_output([sys.executable, '-c', script % engine],
+                                             cwd=os.path.join(here, '..'))
+            self.assertEqual(output.decode('utf-8').strip(), '[]', 'pymongo imported with the %s engine!' % engine)
+        return
+
+
+class CacheTests(unittest.TestCase):
+    """Test the caches of the service without a running service."""
+
+    def test_cachekey(self):
+        """Key of the content of the Members in the cache."""
+
+        digest = 'md5:d41d8cd98f00b204e9800998ecf8427e'
+        first = {'location': 'http://example.org/a', 'checksum': digest}
+        second = {'location': 'http://example.org/b', 'checksum': digest.upper()}
+        self.assertEqual(cachekey(first), cachekey(second),
+                         'Verifiable checksums should share the content!')
+
+        # A checksum which cannot be verified must not replace the content of another location
+        first['checksum'] = second['checksum'] = 'test:a'
+        self.assertNotEqual(cachekey(first), cachekey(second),
+                            'Unverifiable checksums should be combined with the location!')
+        self.assertEqual(cachekey(first), cachekey(dict(first)), 'Unexpected key of the same Member!')
+
+        self.assertIsNone(cachekey({'location': 'http://example.org/a'}), 'Member without checksum cached!')
+        return
+
+    def test_shared_directory(self):
+        """Files of the cache sent or fetched by another process are kept."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            keys = ['%064x' % i for i in range(3)]
+            for mtime, key in enumerate(keys):
+                with open(os.path.join(directory, key), 'wb') as fout:
+                    fout.write(b'0' * 100)
+                os.utime(os.path.join(directory, key), (mtime, mtime))
+
+            # One process is sending the first object and fetching another one
+            first = ContentCache(directory, 1000)
+            self.assertEqual(first.fetch(keys[0], None, None), first.path(keys[0]),
+                             'Object in the directory expected!')
+            filling = open(os.path.join(directory, '%064x.part' % 9), 'wb')
+            fcntl.flock(filling, fcntl.LOCK_EX)
+            with open(os.path.join(directory, '%064x.part' % 8), 'wb'):
+                pass
+
+            # Other process starts with a smaller cap
+            second = ContentCache(directory, 50)
+            self.assertEqual(sorted(os.listdir(directory)), sorted(['%064x.part' % 9, '.lock', keys[0]]),
+                             'Only the files not in use should be removed!')
+            self.assertEqual(second.stats()['bytes'], 100, 'Size of the whole directory expected!')
+
+            first.release(keys[0])
+            filling.close()
+        return
+
+    def test_collection_workers(self):
+        """Collections changed by another worker are read again."""
+
+        cache = CollectionCache()
+        generation = cache.generation('a')
+        cache.put('a', {'_id': 'a', 'maxLength': 1}, generation)
+        cache.put('b', {'_id': 'b'}, cache.generation('b'))
+        self.assertEqual(cache.get('a')['maxLength'], 1, 'Cached Collection expected!')
+
+        # A worker forked after the cache was created changes the Collection
+        pid = os.fork()
+        if not pid:
+            cache.invalidate('a')
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertIsNone(cache.get('a'), 'Collection changed by another worker was cached!')
+        self.assertIsNotNone(cache.get('b'), 'Other Collections should be kept!')
+        self.assertEqual(cache.stats()['stale'], 1, 'Unexpected number of stale Collections!')
+
+        # A document read before the change must not be stored
+        cache.put('a', {'_id': 'a', 'maxLength': 1}, generation)
+        self.assertIsNone(cache.get('a'), 'Collection read before the change was cached!')
+        return
+
+
+class FakeDB(object):
+    """Database returning the given results to the calls of any method."""
+
+    def __init__(self, results, asynchronous=False):
+        self.results = list(results)
+        self.asynchronous = asynchronous
+        self.methods = list()
+
+    def __getitem__(self, collname):
+        return self
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            self.methods.append(method)
+            result = self.results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        async def asynccall(*args, **kwargs):
+            return call(*args, **kwargs)
+
+        return asynccall if self.asynchronous else call
+
+
+class StepsTests(unittest.TestCase):
+    """Test the operations shared by both drivers of MongoDB without a database."""
+
+    def test_reserve(self):
+        """Members reserved again after a concurrent insertion with both drivers."""
+
+        results = [{'_count': 8}, types.SimpleNamespace(matched_count=0),
+                   {'_count': 9}, types.SimpleNamespace(matched_count=1)]
+        methods = ['find_one', 'update_one'] * 2
+
+        conn = FakeDB(results)
+        self.assertEqual(runsteps(conn, reservesteps('0' * 24, [1, 2, 3], 10)), 1,
+                         'Only the room left after the concurrent insertion expected!')
+        self.assertEqual(conn.methods, methods, 'Unexpected calls to the driver!')
+
+        conn = FakeDB(results, asynchronous=True)
+        self.assertEqual(asyncio.run(asyncrunsteps(conn, reservesteps('0' * 24, [1, 2, 3], 10))),
+                         1, 'Only the room left after the concurrent insertion expected!')
+        self.assertEqual(conn.methods, methods, 'Unexpected calls to the driver!')
+
+        # The errors of the driver are raised in the steps
+        conn = FakeDB([Exception('timeout')], asynchronous=True)
+        with self.assertRaises(Exception):
+            asyncio.run(asyncrunsteps(conn, reservesteps('0' * 24, [1], 10)))
+        return
+
+
+class SerializerTests(unittest.TestCase):
+    """Test that the JSON serializers produce the same content."""
+
+    def test_serializers(self):
+        """Output of orjson and of the standard library."""
+        document = {'_id': ObjectId('5f0000000000000000000001'),
+                    'added': datetime.datetime(2020, 1, 2, 3, 4, 5, 6),
+                    'updated': datetime.datetime(2020, 1, 2, tzinfo=datetime.timezone.utc),
+                    'raw': b'bytes',
+                    'text': 'Ñandú 1e+16 NaN "Infinity" \\e-07',
+                    'floats': [float('nan'), float('inf'), -float('inf'), 1e16, 1e-7, 0.1, -0.0,
+                               1.0, 1e15, 5e-324, 1.7976931348623157e308, 123456789.123],
+                    'ints': [0, -1, 2 ** 63 - 1]}
+        expected = ('{"_id":"5f0000000000000000000001","added":"2020-01-02T03:04:05.000006",'
+                    '"updated":"2020-01-02T00:00:00+00:00","raw":"bytes",'
+                    '"text":"Ñandú 1e+16 NaN \\"Infinity\\" \\\\e-07",'
+                    '"floats":[null,null,null,1e16,1e-7,0.1,-0.0,1.0,1000000000000000.0,5e-324,'
+                    '1.7976931348623157e308,123456789.123],'
+                    '"ints":[0,-1,9223372036854775807]}').encode('utf-8')
+
+        for name, serializer in serializers.items():
+            self.assertEqual(serializer(document), expected, 'Unexpected output of %s!' % name)
+
+        # Exponents without NaN nor Infinity in the document
+        for name, serializer in serializers.items():
+            self.assertEqual(serializer({'a': [1e16, 1e-7], 'b': 'e+1'}), b'{"a":[1e16,1e-7],"b":"e+1"}',
+                             'Unexpected output of %s!' % name)
+
+        # Integers not supported by orjson are serialized by the standard library
+        document['ints'].append(2 ** 70)
+        expected = expected.replace(b'807]', b'807,%d]' % 2 ** 70)
+        for name, serializer in serializers.items():
+            self.assertEqual(serializer(document), expected, 'Unexpected output of %s!' % name)
+        return
+
 
 global host
 